@@ -4,6 +4,7 @@ import ws_session
 
 
 def _db_test():
+    ws_db.close_all_connections()
     ws_db.db_file.unlink()
     ws_db.initial()
     admin = ws_user.find_user_by_auth("admin", 'admin')
@@ -18,11 +18,13 @@ CREATE TABLE sessions (
     token TEXT NOT NULL UNIQUE,
     user_id INTEGER NOT NULL,
     created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    expires_at INTEGER NOT NULL,  /* unix time, сессия продлевается при использовании */
     FOREIGN KEY(user_id) REFERENCES users(id)
 );
+CREATE INDEX sessions_expires_at ON sessions(expires_at);
 DROP TABLE IF EXISTS desires;
 CREATE TABLE desires(
-    date DATE NOT NULL,
+    date INTEGER NOT NULL,  /* дней от 1970-01-01 (ws_utils.to_epoch_days) */
     user_id INTEGER NOT NULL,
     desire_id INTEGER NOT NULL,
     comment TEXT NOT NULL,
@@ -30,9 +32,11 @@ CREATE TABLE desires(
     FOREIGN KEY(user_id) REFERENCES users(id),
     CONSTRAINT desires_date_user_id_unique UNIQUE (date,user_id)
 );
+/* пожелания пользователя за период читаются из индекса, без обращения к таблице */
+CREATE INDEX desires_user_id_date ON desires(user_id, date, desire_id, comment);
 DROP TABLE IF EXISTS orders;
 CREATE TABLE orders(
-    date DATE NOT NULL,
+    date INTEGER NOT NULL,  /* дней от 1970-01-01 */
     user_id INTEGER NOT NULL,
     order_id INTEGER NOT NULL,
     comment TEXT NOT NULL,
@@ -40,9 +44,59 @@ CREATE TABLE orders(
     FOREIGN KEY(user_id) REFERENCES users(id),
     CONSTRAINT orders_date_user_id_unique UNIQUE (date,user_id)
 );
+CREATE INDEX orders_user_id_date ON orders(user_id, date, order_id, comment);
+/* ALL_DAY (order_id = 2) на день может быть только у одного */
+CREATE UNIQUE INDEX orders_all_day ON orders(date) WHERE order_id = 2;
 DROP TABLE IF EXISTS holidays;
 CREATE TABLE holidays(
-    date DATE NOT NULL,
+    date INTEGER NOT NULL,  /* дней от 1970-01-01 */
     is_work_day BOOLEAN NOT NULL,
     CONSTRAINT holidays_date_unique UNIQUE (date)
 );
+DROP TABLE IF EXISTS changes;
+CREATE TABLE changes(
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,  /* растет монотонно и не переиспользуется */
+    kind TEXT NOT NULL,  /* order | desire */
+    date INTEGER NOT NULL,  /* дней от 1970-01-01 */
+    user_id INTEGER NOT NULL,
+    value_id INTEGER,  /* order_id или desire_id, NULL - удалено */
+    comment TEXT NOT NULL,
+    created_at INTEGER NOT NULL  /* unix time */
+);
+CREATE INDEX changes_created_at ON changes(created_at);
+DROP TABLE IF EXISTS autofill_jobs;
+CREATE TABLE autofill_jobs(
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    month INTEGER NOT NULL,  /* первое число месяца, дней от 1970-01-01 */
+    cur INTEGER NOT NULL,  /* с какого дня заполнять */
+    params TEXT NOT NULL,  /* json параметров запроса */
+    status TEXT NOT NULL,  /* queued | running | done | failed */
+    progress REAL NOT NULL,  /* 0..1 */
+    result TEXT,  /* json */
+    error TEXT,
+    created_by INTEGER,
+    created_at INTEGER NOT NULL,  /* unix time */
+    updated_at INTEGER NOT NULL
+);
+/* одна активная задача на месяц */
+CREATE UNIQUE INDEX autofill_jobs_active_month ON autofill_jobs(month) WHERE status IN ('queued', 'running');
+DROP TABLE IF EXISTS month_versions;
+CREATE TABLE month_versions(
+    month INTEGER PRIMARY KEY,  /* первое число месяца, дней от 1970-01-01 */
+    version INTEGER NOT NULL
+);
+DROP TABLE IF EXISTS hours_ledger;
+CREATE TABLE hours_ledger(
+    user_id INTEGER NOT NULL,
+    month INTEGER NOT NULL,  /* первое число месяца, дней от 1970-01-01 */
+    hours INTEGER NOT NULL,  /* часы по заказам месяца, см. ws_hours */
+    PRIMARY KEY (user_id, month)
+) WITHOUT ROWID;
+CREATE INDEX hours_ledger_month ON hours_ledger(month, user_id, hours);
+DROP TABLE IF EXISTS cache_versions;
+CREATE TABLE cache_versions(
+    name TEXT PRIMARY KEY,  /* кеш процесса, см. ws_version */
+    version INTEGER NOT NULL
+) WITHOUT ROWID;
+/* версия схемы, должна совпадать с ws_db.SCHEMA_VERSION */
+PRAGMA user_version = 4;
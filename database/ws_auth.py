@@ -0,0 +1,117 @@
+import collections
+import threading
+import time
+
+from database import ws_permissions
+from database import ws_version
+
+# кеш token -> пользователь, чтобы не ходить в базу на каждом запросе.
+# invalidate_* сбрасывают записи этого процесса, остальные процессы сбрасывают кеш целиком по ws_version.AUTH
+MAX_SIZE = 4096
+TTL_SEC = 60.0
+
+
+class AuthEntry:
+
+    __slots__ = ['user', 'permissions', 'expires_at']
+
+    def __init__(self, user, expires_at: float):
+        self.user = user  # ws_user.UserRow
+        self.permissions: frozenset[ws_permissions.Permission] = frozenset(ws_permissions.get_permissions(user.role))
+        self.expires_at = expires_at
+
+    @property
+    def user_id(self) -> int:
+        return self.user.id
+
+    @property
+    def role(self) -> ws_permissions.Role:
+        return self.user.role
+
+
+_lock = threading.Lock()
+_entries: collections.OrderedDict[str, AuthEntry] = collections.OrderedDict()
+_tokens_by_user: dict[int, set[str]] = {}
+_stats = {
+    'hits': 0,
+    'misses': 0,
+    'expired': 0,
+    'evictions': 0,
+    'invalidations': 0,
+}
+
+
+def _remove(token: str):
+    entry = _entries.pop(token, None)
+    if entry is None:
+        return
+    tokens = _tokens_by_user.get(entry.user_id)
+    if tokens is not None:
+        tokens.discard(token)
+        if not tokens:
+            del _tokens_by_user[entry.user_id]
+
+
+def get(token: str) -> AuthEntry or None:
+    _version.sync()
+    with _lock:
+        entry = _entries.get(token)
+        if entry is None:
+            _stats['misses'] += 1
+            return None
+        if entry.expires_at <= time.monotonic():
+            _remove(token)
+            _stats['expired'] += 1
+            _stats['misses'] += 1
+            return None
+        _entries.move_to_end(token)
+        _stats['hits'] += 1
+        return entry
+
+
+def put(token: str, user, session_expires_at: int = None) -> AuthEntry:
+    """session_expires_at - unix time окончания сессии, запись в кеше не переживет сессию"""
+    ttl = TTL_SEC
+    if session_expires_at is not None:
+        ttl = min(ttl, session_expires_at - time.time())
+    entry = AuthEntry(user, time.monotonic() + ttl)
+    _version.sync()  # запись кладется в кеш уже сверенной версии, иначе следующий sync ее сбросит
+    with _lock:
+        _remove(token)
+        _entries[token] = entry
+        _tokens_by_user.setdefault(entry.user_id, set()).add(token)
+        while len(_entries) > MAX_SIZE:
+            oldest = next(iter(_entries))
+            _remove(oldest)
+            _stats['evictions'] += 1
+    return entry
+
+
+def invalidate_token(token: str):
+    with _lock:
+        if token in _entries:
+            _remove(token)
+            _stats['invalidations'] += 1
+
+
+def invalidate_user(user_id: int):
+    with _lock:
+        for token in list(_tokens_by_user.get(user_id, ())):
+            _remove(token)
+            _stats['invalidations'] += 1
+
+
+def clear():
+    with _lock:
+        _entries.clear()
+        _tokens_by_user.clear()
+
+
+_version = ws_version.CacheVersion(ws_version.AUTH, clear)
+
+
+def get_stats() -> dict:
+    with _lock:
+        stats = dict(_stats)
+        stats['size'] = len(_entries)
+    return stats
@@ -0,0 +1,145 @@
+import datetime
+import sqlite3
+import threading
+import time
+
+from database import ws_db
+from database import ws_record
+
+# журнал изменений заказов и пожеланий для инкрементальной синхронизации клиентов:
+# клиент запоминает seq последнего изменения и запрашивает только то, что было после
+ORDER = 'order'
+DESIRE = 'desire'
+RETENTION_SEC = 30 * 24 * 60 * 60  # старее удаляем, таким клиентам нужна полная перезагрузка
+COMPACT_INTERVAL_SEC = 60 * 60
+COMPACT_BATCH_SIZE = 1000
+
+
+class ChangeRow(ws_record.Record):
+
+    __slots__ = ['seq', 'kind', 'date', 'user_id', 'value_id', 'comment', 'created_at']
+    _decoders = {'date': ws_record.decode_date}
+
+    seq: int
+    kind: str
+    date: datetime.date
+    user_id: int
+    value_id: int or None  # order_id или desire_id, None - удалено
+    comment: str
+
+
+def log_changes(connection, kind: str, changes: list[tuple[datetime.date, int, int or None, str]]):
+    """Вызывается в той же транзакции, что и само изменение; changes - (date, user_id, value_id, comment)"""
+    now = int(time.time())
+    connection.executemany(
+        "INSERT INTO changes"
+        " (kind, date, user_id, value_id, comment, created_at)"
+        " VALUES (?, ?, ?, ?, ?, ?)",
+        [(kind, date, user_id, None if value_id is None else int(value_id), comment, now)
+         for date, user_id, value_id, comment in changes]
+    )
+
+
+def get_seq_range() -> tuple[int, int]:
+    """(первый доступный seq, последний seq); если журнал пуст, первый = последний + 1"""
+    with ws_db.get_db_connection() as conn:
+        row = conn.execute("SELECT MIN(seq) AS first, MAX(seq) AS last FROM changes").fetchone()
+        if row['last'] is not None:
+            return row['first'], row['last']
+        # журнал пуст (или полностью удален), последний выданный seq остается в sqlite_sequence
+        row = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = 'changes'").fetchone()
+    last = 0 if row is None else row['seq']
+    return last + 1, last
+
+
+def get_changes(since: int, limit: int, user_id: int, all_orders: bool) -> list[ChangeRow]:
+    """
+    Изменения после since по возрастанию seq.
+    Видны свои заказы и пожелания, все заказы - только при all_orders (право QUERY_ORDER).
+    """
+    with ws_db.get_db_connection() as conn:
+        return ws_record.fetch_all(
+            conn, ChangeRow,
+            "SELECT * FROM changes"
+            " WHERE `seq` > ? AND"
+            " (`user_id` = ? OR (`kind` = ? AND ?))"
+            " ORDER BY `seq`"
+            " LIMIT ?",
+            (since, user_id, ORDER, all_orders, limit)
+        )
+
+
+def get_all_changes(since: int, limit: int) -> list[ChangeRow]:
+    """Все изменения после since без фильтра по пользователю (для рассылки уведомлений)"""
+    with ws_db.get_db_connection() as conn:
+        return ws_record.fetch_all(
+            conn, ChangeRow,
+            "SELECT seq, kind, date, user_id FROM changes"
+            " WHERE `seq` > ?"
+            " ORDER BY `seq`"
+            " LIMIT ?",
+            (since, limit)
+        )
+
+
+def compact(retention_sec: float = RETENTION_SEC, batch_size: int = COMPACT_BATCH_SIZE) -> int:
+    """Удаляет старые записи журнала пачками, seq при этом не переиспользуются (AUTOINCREMENT)"""
+    before = int(time.time() - retention_sec)
+    total = 0
+    while True:
+        with ws_db.get_db_connection() as connection:
+            cur = connection.cursor()
+            cur.execute(
+                "DELETE FROM changes WHERE `seq` IN ("
+                " SELECT `seq` FROM changes"
+                " WHERE `created_at` < ?"
+                " ORDER BY `seq`"
+                " LIMIT ?)",
+                (before, batch_size)
+            )
+            connection.commit()
+            deleted = cur.rowcount
+        total += deleted
+        if deleted < batch_size:
+            return total
+
+
+class ChangeLogCompactor(threading.Thread):
+
+    def __init__(self, interval: float = COMPACT_INTERVAL_SEC):
+        super().__init__(name='change-log-compactor', daemon=True)
+        self.interval = interval
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            try:
+                removed = compact()
+            except sqlite3.Error as e:
+                print(f"change log compactor error {e}")
+                continue
+            if removed:
+                print(f"change log compactor removed {removed}")
+
+    def stop(self):
+        self._stop_event.set()
+
+
+_compactor: ChangeLogCompactor or None = None
+
+
+def start_compactor(interval: float = COMPACT_INTERVAL_SEC):
+    global _compactor
+    if _compactor is not None:
+        return
+    _compactor = ChangeLogCompactor(interval)
+    _compactor.start()
+
+
+def stop_compactor():
+    global _compactor
+    if _compactor is None:
+        return
+    _compactor.stop()
+    _compactor.join()
+    _compactor = None
@@ -1,30 +1,400 @@
+import collections
+import contextlib
+import datetime
 import os
+import re
 import sqlite3
 import pathlib
+import random
+import threading
+import time
+import weakref
+
+import ws_utils
 from database import ws_user
+from database import ws_session
 DB_DIR = pathlib.Path(__file__).parent
 
 db_file = DB_DIR / 'work_scheduler.db'
 
+# настройки соединений
+BUSY_TIMEOUT_MS = 5000  # сколько ждать блокировку писателя, прежде чем упасть с SQLITE_BUSY
+MMAP_SIZE = 64 * 1024 * 1024  # читаем файл базы через mmap
+CACHED_STATEMENTS = 256  # кеш подготовленных запросов на соединение
+WRITE_RETRIES = 4  # сколько раз пытаться начать запись, если база занята дольше busy_timeout
+WRITE_RETRY_DELAY_SEC = 0.05
+
+# даты в запросах передаются числом дней от 1970-01-01, см. schema.sql
+sqlite3.register_adapter(datetime.date, ws_utils.to_epoch_days)
+
+
+class _Cursor(sqlite3.Cursor):
+
+    def executemany(self, sql, parameters):
+        return _execute_batch(super().executemany, sql, parameters)
+
+
+class _PooledConnection(sqlite3.Connection):
+    """
+    Соединение потока переиспользуется, поэтому `with` может быть вложенным:
+    коммит/откат делает только самый внешний `with`, а commit() внутри вложенного откладывается до него.
+    Так несколько вызовов DAO можно объединить в одну транзакцию (см. transaction()).
+    """
+
+    _depth = 0
+
+    def __enter__(self):
+        self._depth += 1
+        return super().__enter__()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self._depth -= 1
+        if self._depth > 0:
+            return False
+        return super().__exit__(exc_type, exc_val, exc_tb)
+
+    def commit(self):
+        if self._depth > 1:
+            return
+        super().commit()
+
+    def cursor(self, factory=_Cursor):
+        return super().cursor(factory)
+
+    def executemany(self, sql, parameters):
+        return _execute_batch(super().executemany, sql, parameters)
+
+
+_local = threading.local()
+_lock = threading.Lock()
+_generation = 0  # увеличивается в close_all_connections, старые соединения потоков становятся невалидны
+_connections: weakref.WeakSet = weakref.WeakSet()
+_schema_lock = threading.Lock()
+_schema_checked: set[str] = set()  # базы, схему которых этот процесс уже создал или обновил
+_stats = {
+    'opened': 0,  # сколько соединений было открыто
+    'reused': 0,  # сколько раз выдали уже открытое соединение
+    'closed': 0,  # сколько соединений закрыли явно
+    'busy_retries': 0,  # сколько раз write_transaction повторяла запись из-за SQLITE_BUSY
+}
+
+
+class QueryStats:
+    """Счетчики запросов к базе в пределах одного HTTP запроса (или любого другого блока работы)"""
 
-def get_db_connection():
-    conn = sqlite3.connect(db_file)
+    __slots__ = ['statements', 'connections', 'by_sql', 'in_batch']
+
+    def __init__(self):
+        self.statements = 0
+        self.connections = 0  # сколько соединений пришлось открыть
+        self.by_sql: collections.Counter[str] = collections.Counter()  # запрос без значений -> сколько раз
+        self.in_batch = False  # идет executemany, его строки уже посчитаны одним запросом
+
+
+_literal_re = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+
+
+def _count_statement(stats: QueryStats, sql: str):
+    stats.statements += 1
+    # убираем значения, чтобы группировать одинаковые запросы
+    stats.by_sql[_literal_re.sub('?', sql)] += 1
+
+
+def _on_statement(sql: str):
+    stats = getattr(_local, 'query_stats', None)
+    if stats is None or stats.in_batch:
+        return
+    _count_statement(stats, sql)
+
+
+def _execute_batch(executemany, sql: str, parameters):
+    # trace callback вызывается на каждую строку executemany, а это один запрос, а не N+1
+    stats = getattr(_local, 'query_stats', None)
+    if stats is None or stats.in_batch:
+        return executemany(sql, parameters)
+    _count_statement(stats, sql)
+    stats.in_batch = True
+    try:
+        return executemany(sql, parameters)
+    finally:
+        stats.in_batch = False
+
+
+def begin_query_stats() -> QueryStats:
+    """Начинает подсчет запросов текущего потока"""
+    stats = QueryStats()
+    _local.query_stats = stats
+    return stats
+
+
+def end_query_stats() -> QueryStats or None:
+    stats = getattr(_local, 'query_stats', None)
+    _local.query_stats = None
+    return stats
+
+
+def _open_connection(path: str) -> sqlite3.Connection:
+    is_new = not os.path.exists(path)
+    conn = sqlite3.connect(
+        path,
+        timeout=BUSY_TIMEOUT_MS / 1000,
+        cached_statements=CACHED_STATEMENTS,
+        check_same_thread=False,  # соединением пользуется один поток, но закрыть его может любой
+        factory=_PooledConnection,
+    )
     conn.row_factory = sqlite3.Row
+    # WAL: читатели не блокируются писателем, а fsync делается только на checkpoint
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    conn.execute(f'PRAGMA busy_timeout={BUSY_TIMEOUT_MS}')
+    conn.execute(f'PRAGMA mmap_size={MMAP_SIZE}')
+    conn.set_trace_callback(_on_statement)
+    _check_schema(conn, path, is_new)
     return conn
 
 
+def _check_schema(conn: sqlite3.Connection, path: str, is_new: bool):
+    # схема проверяется при первом соединении с базой, а не при импорте модуля
+    with _schema_lock:
+        if path in _schema_checked:
+            return
+        # файл мог только что создать другой поток, который еще ждет эту блокировку: пустая база - тоже новая
+        if is_new or not conn.execute('SELECT 1 FROM sqlite_master LIMIT 1').fetchone():
+            try:
+                _create_schema(conn)
+            except:
+                conn.close()
+                os.unlink(path)
+                raise
+        else:
+            _upgrade(conn)
+        _schema_checked.add(path)
+
+
+def ensure_schema():
+    """Создает или обновляет схему сразу, например в главном процессе сервера до запуска рабочих"""
+    get_db_connection()
+
+
+def get_db_connection() -> sqlite3.Connection:
+    """
+    Возвращает долгоживущее соединение текущего потока.
+    Соединение не нужно закрывать: `with` только коммитит/откатывает транзакцию.
+    """
+    path = str(db_file)
+    conn = getattr(_local, 'conn', None)
+    if conn is not None and _local.path == path and _local.generation == _generation:
+        with _lock:
+            _stats['reused'] += 1
+        return conn
+    if conn is not None:  # db_file поменяли (например, тестовая база) или соединения сброшены
+        close_db_connection()
+    conn = _open_connection(path)
+    _local.conn = conn
+    _local.path = path
+    _local.generation = _generation
+    with _lock:
+        _connections.add(conn)
+        _stats['opened'] += 1
+    stats = getattr(_local, 'query_stats', None)
+    if stats is not None:
+        stats.connections += 1
+    return conn
+
+
+@contextlib.contextmanager
+def transaction(immediate: bool = False):
+    """
+    Объединяет все запросы внутри блока (в том числе вызовы DAO) в одну транзакцию.
+    immediate=True сразу берет блокировку записи, иначе читатели видят согласованный снимок базы.
+    """
+    with get_db_connection() as conn:
+        if not conn.in_transaction:
+            conn.execute('BEGIN IMMEDIATE' if immediate else 'BEGIN')
+        yield conn
+
+
+def _is_busy(e: sqlite3.OperationalError) -> bool:
+    return getattr(e, 'sqlite_errorcode', None) is not None and e.sqlite_errorcode & 0xff == sqlite3.SQLITE_BUSY
+
+
+def write_transaction(fn, *args):
+    """
+    Выполняет fn(connection, *args) в транзакции BEGIN IMMEDIATE и возвращает ее результат.
+    Если блокировку записи не дали за busy_timeout (SQLITE_BUSY), транзакция повторяется
+    не больше WRITE_RETRIES раз с растущей случайной паузой. Поэтому fn должна только работать с базой.
+    Внутри уже открытой транзакции fn просто выполняется в ней, без повторов.
+    """
+    conn = get_db_connection()
+    if conn.in_transaction:
+        with conn:
+            return fn(conn, *args)
+    for attempt in range(WRITE_RETRIES):
+        try:
+            with transaction(immediate=True) as conn:
+                return fn(conn, *args)
+        except sqlite3.OperationalError as e:
+            if not _is_busy(e) or attempt == WRITE_RETRIES - 1:
+                raise
+        with _lock:
+            _stats['busy_retries'] += 1
+        time.sleep(WRITE_RETRY_DELAY_SEC * 2 ** attempt * random.uniform(0.5, 1.5))
+
+
+def close_db_connection():
+    """Закрывает соединение текущего потока"""
+    conn = getattr(_local, 'conn', None)
+    if conn is None:
+        return
+    _local.conn = None
+    _local.path = None
+    with _lock:
+        if conn in _connections:
+            _connections.discard(conn)
+            _stats['closed'] += 1
+    conn.close()
+
+
+def close_all_connections():
+    """
+    Закрывает соединения всех потоков.
+    Используется перед удалением файла базы и при остановке сервера.
+    Потоки, у которых закрыли соединение, откроют новое при следующем запросе.
+    """
+    global _generation
+    with _lock:
+        _generation += 1
+        conns = list(_connections)
+        _connections.clear()
+        _stats['closed'] += len(conns)
+    for conn in conns:
+        conn.close()
+    _local.conn = None
+    _local.path = None
+
+
+def get_pool_stats() -> dict:
+    with _lock:
+        stats = dict(_stats)
+        stats['active'] = len(_connections)
+    return stats
+
+
+def _create_schema(connection: sqlite3.Connection):
+    with open(pathlib.Path(__file__).parent / 'schema.sql') as f:
+        connection.executescript(f.read())
+    connection.commit()
+
+
 def initial():
+    """Создает все таблицы заново"""
+    path = str(db_file)
+    with _schema_lock:
+        _schema_checked.add(path)  # схему создаем здесь, проверка при соединении не нужна
     try:
         with get_db_connection() as connection:
-            with open(pathlib.Path(__file__).parent / 'schema.sql') as f:
-                connection.executescript(f.read())
-            connection.commit()
+            _create_schema(connection)
         # ws_user.create_initial_users()
     except:
+        with _schema_lock:
+            _schema_checked.discard(path)
+        close_all_connections()
         os.unlink(db_file)
         raise
 
 
-if not db_file.exists():
-    initial()
+def _migrate_v1(connection: sqlite3.Connection):
+    # базы, созданные до версионирования схемы: дописываем то, чего не было в schema.sql на момент их создания
+    columns = [row['name'] for row in connection.execute('PRAGMA table_info(sessions)')]
+    if 'expires_at' not in columns:
+        connection.execute('ALTER TABLE sessions ADD COLUMN expires_at INTEGER NOT NULL DEFAULT 0')
+        # старые сессии считаем только что продленными
+        connection.execute("UPDATE sessions SET expires_at = CAST(strftime('%s', 'now') AS INTEGER) + ?",
+                           (ws_session.SESSION_TTL_SEC,))
+        connection.execute('CREATE INDEX IF NOT EXISTS sessions_expires_at ON sessions(expires_at)')
+    connection.execute('CREATE TABLE IF NOT EXISTS month_versions('
+                       'month DATE PRIMARY KEY, version INTEGER NOT NULL)')
+    connection.execute('CREATE TABLE IF NOT EXISTS changes('
+                       'seq INTEGER PRIMARY KEY AUTOINCREMENT, kind TEXT NOT NULL, date DATE NOT NULL,'
+                       ' user_id INTEGER NOT NULL, value_id INTEGER, comment TEXT NOT NULL,'
+                       ' created_at INTEGER NOT NULL)')
+    connection.execute('CREATE INDEX IF NOT EXISTS changes_created_at ON changes(created_at)')
+    connection.execute('CREATE TABLE IF NOT EXISTS autofill_jobs('
+                       'id INTEGER PRIMARY KEY AUTOINCREMENT, month DATE NOT NULL, cur DATE NOT NULL,'
+                       ' params TEXT NOT NULL, status TEXT NOT NULL, progress REAL NOT NULL, result TEXT,'
+                       ' error TEXT, created_by INTEGER, created_at INTEGER NOT NULL,'
+                       ' updated_at INTEGER NOT NULL)')
+    connection.execute("CREATE UNIQUE INDEX IF NOT EXISTS autofill_jobs_active_month ON autofill_jobs(month)"
+                       " WHERE status IN ('queued', 'running')")
+
+
+# колонки с датами 'YYYY-MM-DD', которые в v2 хранятся числом дней от 1970-01-01
+_DATE_COLUMNS = (
+    ('orders', 'date'),
+    ('desires', 'date'),
+    ('holidays', 'date'),
+    ('changes', 'date'),
+    ('month_versions', 'month'),
+    ('autofill_jobs', 'month'),
+    ('autofill_jobs', 'cur'),
+)
+
+
+def _migrate_v2(connection: sqlite3.Connection):
+    # даты переводим на месте: у колонок DATE числовое сродство, целые в них хранятся как есть,
+    # а julianday('1970-01-01') = 2440587.5
+    for table, column in _DATE_COLUMNS:
+        connection.execute(f"UPDATE {table} SET `{column}` = CAST(julianday(`{column}`) - 2440587.5 AS INTEGER)"
+                           f" WHERE typeof(`{column}`) = 'text'")
+    # до индекса ALL_DAY мог задвоиться (гонка двух админов), оставляем последний записанный
+    connection.execute("DELETE FROM orders WHERE order_id = 2 AND rowid NOT IN ("
+                       " SELECT max(rowid) FROM orders WHERE order_id = 2 GROUP BY date)")
+    connection.execute('CREATE INDEX IF NOT EXISTS orders_user_id_date ON orders(user_id, date, order_id, comment)')
+    connection.execute('CREATE INDEX IF NOT EXISTS desires_user_id_date'
+                       ' ON desires(user_id, date, desire_id, comment)')
+    connection.execute('CREATE UNIQUE INDEX IF NOT EXISTS orders_all_day ON orders(date) WHERE order_id = 2')
+
+
+def _migrate_v3(connection: sqlite3.Connection):
+    from database import ws_hours
+    connection.execute('CREATE TABLE IF NOT EXISTS hours_ledger('
+                       'user_id INTEGER NOT NULL, month INTEGER NOT NULL, hours INTEGER NOT NULL,'
+                       ' PRIMARY KEY (user_id, month)) WITHOUT ROWID')
+    connection.execute('CREATE INDEX IF NOT EXISTS hours_ledger_month ON hours_ledger(month, user_id, hours)')
+    ws_hours.rebuild(connection)
+
+
+def _migrate_v4(connection: sqlite3.Connection):
+    connection.execute('CREATE TABLE IF NOT EXISTS cache_versions('
+                       'name TEXT PRIMARY KEY, version INTEGER NOT NULL) WITHOUT ROWID')
+
+
+# MIGRATIONS[i] переводит базу с версии i на i + 1, версия хранится в PRAGMA user_version.
+# Новые базы создаются из schema.sql сразу последней версии
+MIGRATIONS = (
+    _migrate_v1,
+    _migrate_v2,
+    _migrate_v3,
+    _migrate_v4,
+)
+SCHEMA_VERSION = len(MIGRATIONS)
+
+
+def get_schema_version(connection: sqlite3.Connection) -> int:
+    return connection.execute('PRAGMA user_version').fetchone()[0]
+
 
+def _upgrade(connection: sqlite3.Connection):
+    """Применяет недостающие миграции, каждую в своей транзакции"""
+    for version in range(get_schema_version(connection), SCHEMA_VERSION):
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            # другой процесс мог обновить базу, пока мы ждали блокировку
+            if get_schema_version(connection) == version:
+                MIGRATIONS[version](connection)
+                connection.execute(f'PRAGMA user_version = {version + 1}')
+        except:
+            connection.rollback()
+            raise
+        connection.commit()
+        print(f"db schema upgraded to version {version + 1}")
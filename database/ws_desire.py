@@ -2,9 +2,11 @@ import datetime
 import json
 import enum
 
-import ws_utils
 from database import ws_db
+from database import ws_record
 from database import ws_permissions
+from database import ws_version
+from database import ws_changes
 
 
 class Desire(enum.IntEnum):
@@ -13,25 +15,17 @@ class Desire(enum.IntEnum):
     ALL_DAY = 2
 
 
-class DesireRow(dict):
+class DesireRow(ws_record.Record):
 
     __slots__ = ['date', 'user_id', 'desire', 'comment', 'created_at']
+    _decoders = {'date': ws_record.decode_date, 'desire_id': Desire}
+    _renames = {'desire_id': 'desire'}
 
     date: datetime.date
     user_id: int
     desire: Desire
     comment: str
 
-    def __init__(self, row: dict):
-        super().__init__(row)
-        for k, v in row.items():
-            if k == 'date':
-                v = ws_utils.parse_date(v)
-            elif k == 'desire_id':
-                k = 'desire'
-                v = Desire(v)
-            setattr(self, k, v)
-
 
 def set_desire(date: datetime.date, user_id, desire: Desire or None, comment=""):
     with ws_db.get_db_connection() as connection:
@@ -43,6 +37,8 @@ def set_desire(date: datetime.date, user_id, desire: Desire or None, comment="")
                 f' `user_id` = ?',
                 (date, user_id)
             )
+            if cur.rowcount:
+                ws_changes.log_changes(connection, ws_changes.DESIRE, [(date, user_id, None, comment)])
         else:
             cur.execute(
                 "INSERT INTO desires"
@@ -55,55 +51,95 @@ def set_desire(date: datetime.date, user_id, desire: Desire or None, comment="")
                 (date, user_id, desire, comment,
                  desire, comment)
             )
+            ws_changes.log_changes(connection, ws_changes.DESIRE, [(date, user_id, desire, comment)])
+        ws_version.bump_months(connection, [date])
         connection.commit()
 
 
+def set_desires_bulk(desires: list[tuple[datetime.date, int, Desire or None, str]]) -> int:
+    """
+    Применяет пачку пожеланий (date, user_id, desire, comment) одной транзакцией, desire=None удаляет.
+    Строки применяются по порядку: из нескольких на один день пользователя действует последняя.
+    """
+    if not desires:
+        return 0
+    return ws_db.write_transaction(apply_desires_bulk, desires)
+
+
+def apply_desires_bulk(connection, desires: list[tuple[datetime.date, int, Desire or None, str]]) -> int:
+    """То же, что set_desires_bulk, но внутри уже открытой транзакции connection; возвращает число измененных строк"""
+    # удаления выполняются раньше вставок, поэтому пачку сначала сводим: последняя строка на (date, user_id) выигрывает
+    last = {(row[0], row[1]): row for row in desires}
+    changes = []
+    to_upsert = []
+    for date, user_id, desire, comment in last.values():
+        if desire is None:
+            cur = connection.execute(
+                "DELETE FROM desires WHERE"
+                " `date` = ? AND"
+                " `user_id` = ?",
+                (date, user_id)
+            )
+            if cur.rowcount:
+                changes.append((date, user_id, None, comment))
+        else:
+            to_upsert.append((date, user_id, desire, comment, desire, comment))
+            changes.append((date, user_id, desire, comment))
+    connection.executemany(
+        "INSERT INTO desires"
+        " (date, user_id, desire_id, comment)"
+        " VALUES (?, ?, ?, ?)"
+        " ON CONFLICT(date, user_id)"
+        " DO UPDATE SET `desire_id`=?, `comment`=?",
+        to_upsert
+    )
+    ws_changes.log_changes(connection, ws_changes.DESIRE, changes)
+    ws_version.bump_months(connection, [row[0] for row in changes])
+    return len(changes)
+
+
 def get_desires_all() -> list[DesireRow]:
     with ws_db.get_db_connection() as conn:
-        rows = conn.execute('SELECT * FROM desires').fetchall()
-    return [DesireRow(dict(ix)) for ix in rows]
+        return ws_record.fetch_all(conn, DesireRow, 'SELECT * FROM desires')
 
 
 def get_desires(day: datetime.date) -> list[DesireRow]:
     with ws_db.get_db_connection() as conn:
-        rows = conn.execute(
+        return ws_record.fetch_all(
+            conn, DesireRow,
             "SELECT * FROM desires WHERE"
             " `date` = ?",
             (day,)
-        ).fetchall()
-    return [DesireRow(dict(ix)) for ix in rows]
+        )
 
 
 def get_desires_between(fr: datetime.date, to: datetime.date) -> list[DesireRow]:
     with ws_db.get_db_connection() as conn:
-        rows = conn.execute(
+        return ws_record.fetch_all(
+            conn, DesireRow,
             "SELECT * FROM desires"
             " WHERE date BETWEEN ? AND ?",
             (fr, to - datetime.timedelta(days=1))
-        ).fetchall()
-    return [DesireRow(dict(ix)) for ix in rows]
+        )
 
 
 def get_user_desires_between(user_id: int, fr: datetime.date, to: datetime.date) -> list[DesireRow]:
     with ws_db.get_db_connection() as conn:
-        rows = conn.execute(
-            "SELECT * FROM desires"
+        return ws_record.fetch_all(
+            conn, DesireRow,
+            "SELECT date, user_id, desire_id, comment FROM desires"  # только колонки индекса desires_user_id_date
             " WHERE `user_id` = ? AND date BETWEEN ? AND ?",
             (user_id, fr, to - datetime.timedelta(days=1))
-        ).fetchall()
-    return [DesireRow(dict(ix)) for ix in rows]
+        )
 
 
 def get_desire(date: datetime.date, user_id: int) -> DesireRow or None:
     with ws_db.get_db_connection() as conn:
-        cursor = conn.execute(
+        return ws_record.fetch_one(
+            conn, DesireRow,
             "SELECT * FROM desires WHERE"
             " `date` = ? AND"
             " `user_id` = ?"
             " LIMIT 1",
             (date, user_id)
         )
-        row = cursor.fetchone()
-    if row is None:
-        return None
-    return DesireRow(dict(row))
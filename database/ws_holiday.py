@@ -1,27 +1,20 @@
 import datetime
+import threading
 from dateutil.relativedelta import relativedelta
 
-import ws_utils
-from database import ws_db
+from database import ws_db, ws_version, ws_hours
+from database import ws_record
 from ws_utils import daterange, to_epoch_days
 
 
-class HolidayRow(dict):
+class HolidayRow(ws_record.Record):
 
     __slots__ = ['date', 'is_work_day']
+    _decoders = {'date': ws_record.decode_date, 'is_work_day': bool}
 
     date: datetime.date
     is_work_day: bool
 
-    def __init__(self, row: dict):
-        super().__init__(row)
-        for k, v in row.items():
-            if k == 'date':
-                v = ws_utils.parse_date(v)
-            elif k == 'is_work_day':
-                v = True if v != 0 else False
-            setattr(self, k, v)
-
 
 def set_holiday(date: datetime.date, is_work_day: bool = False):
     is_weekend = date.weekday() in [5, 6]  # сб, вс
@@ -31,7 +24,7 @@ def set_holiday(date: datetime.date, is_work_day: bool = False):
         if is_remove_row:
             cur.execute(
                 "DELETE FROM holidays WHERE"
-                f' `date` = ? AND',
+                f' `date` = ?',
                 (date,)
             )
         else:
@@ -47,75 +40,201 @@ def set_holiday(date: datetime.date, is_work_day: bool = False):
                 (date, is_work_day,
                  is_work_day)
             )
+        ws_hours.refresh_months(connection, [date])
+        ws_version.bump_months(connection, [date])
+        ws_version.bump_cache(connection, ws_version.HOLIDAYS)
         connection.commit()
+    _patch_calendar(date, not is_work_day)
+
+
+def set_holidays_bulk(holidays: list[tuple[datetime.date, bool]]) -> int:
+    """
+    Пачка праздников (date, is_work_day) одной транзакцией, правила те же, что в set_holiday.
+    Из нескольких строк на один день действует последняя.
+    """
+    if not holidays:
+        return 0
+    n = ws_db.write_transaction(apply_holidays_bulk, holidays)
+    invalidate_calendar()
+    return n
+
+
+def apply_holidays_bulk(connection, holidays: list[tuple[datetime.date, bool]]) -> int:
+    """То же, что set_holidays_bulk, но внутри уже открытой транзакции connection; после нее нужен invalidate_calendar()"""
+    # удаления выполняются раньше вставок, поэтому пачку сначала сводим: последняя строка на день выигрывает
+    last = dict(holidays)
+    to_delete = []
+    to_upsert = []
+    for date, is_work_day in last.items():
+        is_weekend = date.weekday() in [5, 6]  # сб, вс
+        if (not is_work_day) == is_weekend:
+            to_delete.append((date,))
+        else:
+            to_upsert.append((date, 1 if is_work_day else 0, 1 if is_work_day else 0))
+    connection.executemany(
+        "DELETE FROM holidays WHERE"
+        " `date` = ?",
+        to_delete
+    )
+    connection.executemany(
+        "INSERT INTO holidays"
+        " (date, is_work_day)"
+        " VALUES (?, ?)"
+        " ON CONFLICT(date)"
+        " DO UPDATE SET `is_work_day`=?",
+        to_upsert
+    )
+    ws_hours.refresh_months(connection, [date for date, is_work_day in holidays])
+    ws_version.bump_months(connection, [date for date, is_work_day in holidays])
+    if holidays:
+        ws_version.bump_cache(connection, ws_version.HOLIDAYS)
+    return len(holidays)
 
 
 def _get_holidays_between(fr: datetime.date, to: datetime.date) -> list[HolidayRow]:
     with ws_db.get_db_connection() as conn:
-        rows = conn.execute(
+        return ws_record.fetch_all(
+            conn, HolidayRow,
             "SELECT * FROM holidays"
             " WHERE date BETWEEN ? AND ?",
             (fr, to - datetime.timedelta(days=1))
-        ).fetchall()
-    return [HolidayRow(dict(ix)) for ix in rows]
+        )
 
 
 def _get_holiday(date: datetime.date) -> HolidayRow or None:
     with ws_db.get_db_connection() as conn:
-        cursor = conn.execute(
+        return ws_record.fetch_one(
+            conn, HolidayRow,
             "SELECT * FROM holidays WHERE"
             " `date` = ?"
             " LIMIT 1",
             (date,)
         )
-        row = cursor.fetchone()
-    if row is None:
-        return None
-    return HolidayRow(dict(row))
 
 
-def is_rest_day(date: datetime.date) -> bool:
-    row = _get_holiday(date)
-    if row is not None:
-        return not row.is_work_day
-    is_weekend = date.weekday() in [5, 6]  # сб, вс
-    return is_weekend
+HOURS_PER_DAY = 8
 
+# производственный календарь в памяти: год -> маска, бит i - (i+1)-й день года выходной.
+# _patch_calendar правит только этот процесс, остальные сбрасывают календарь по ws_version.HOLIDAYS
+_calendar: dict[int, int] = {}
+_calendar_lock = threading.Lock()
 
-def get_rest_days_between(fr: datetime.date, to: datetime.date) -> list[int]:
-    holidays = _get_holidays_between(fr, to)
-    work_days = set()
-    rest_days = set()
-    for row in holidays:
+
+def _build_year(year: int) -> int:
+    start = datetime.date(year, 1, 1)
+    end = datetime.date(year + 1, 1, 1)
+    bits = 0
+    for i, day in enumerate(daterange(start, end)):
+        if day.weekday() in [5, 6]:  # сб, вс
+            bits |= 1 << i
+    for row in _get_holidays_between(start, end):
+        i = row.date.timetuple().tm_yday - 1
         if row.is_work_day:
-            work_days.add(to_epoch_days(row.date))
+            bits &= ~(1 << i)
         else:
-            rest_days.add(to_epoch_days(row.date))
+            bits |= 1 << i
+    return bits
+
+
+def _get_year(year: int) -> int:
+    _calendar_version.sync()
+    bits = _calendar.get(year)
+    if bits is None:
+        # строим под той же блокировкой, что и _patch_calendar, иначе правка между чтением
+        # из базы и установкой маски потеряется
+        with _calendar_lock:
+            bits = _calendar.get(year)
+            if bits is None:
+                bits = _calendar[year] = _build_year(year)
+    return bits
+
+
+def _patch_calendar(date: datetime.date, is_rest: bool):
+    with _calendar_lock:
+        bits = _calendar.get(date.year)
+        if bits is None:
+            return  # год еще не загружен, загрузится из базы
+        day_bit = 1 << (date.timetuple().tm_yday - 1)
+        _calendar[date.year] = bits | day_bit if is_rest else bits & ~day_bit
+
+
+def invalidate_calendar():
+    """Сбрасывает календарь, например после изменения holidays в обход set_holiday"""
+    with _calendar_lock:
+        _calendar.clear()
+
+
+_calendar_version = ws_version.CacheVersion(ws_version.HOLIDAYS, invalidate_calendar)
+
+
+def is_rest_day(date: datetime.date) -> bool:
+    return bool(_get_year(date.year) >> (date.timetuple().tm_yday - 1) & 1)
+
+
+def _rest_mask_between(fr: datetime.date, to: datetime.date):
+    """Выдает (год, первый день года, маска выходных в [fr, to) начиная с первого дня)"""
+    for year in range(fr.year, to.year + 1):
+        year_start = datetime.date(year, 1, 1)
+        first = (max(fr, year_start) - year_start).days
+        last = (min(to, datetime.date(year + 1, 1, 1)) - year_start).days
+        if first >= last:
+            continue
+        yield year_start, first, _get_year(year) >> first & ((1 << (last - first)) - 1)
+
+
+def get_rest_days_between(fr: datetime.date, to: datetime.date) -> list[int]:
     out = []
-    for day in daterange(fr, to):
-        is_weekend = day.weekday() in [5, 6]  # сб, вс
-        epoch_day = to_epoch_days(day)
-        if is_weekend:
-            if epoch_day not in work_days:
-                out.append(epoch_day)
-        else:
-            if epoch_day in rest_days:
-                out.append(epoch_day)
+    for year_start, first, bits in _rest_mask_between(fr, to):
+        offset = to_epoch_days(year_start) + first
+        while bits:
+            low = bits & -bits
+            out.append(offset + low.bit_length() - 1)
+            bits ^= low
     return out
 
 
+def count_rest_days(fr: datetime.date, to: datetime.date) -> int:
+    return sum(bits.bit_count() for _, _, bits in _rest_mask_between(fr, to))
+
+
+def count_work_days(fr: datetime.date, to: datetime.date) -> int:
+    if to <= fr:
+        return 0
+    return (to - fr).days - count_rest_days(fr, to)
+
+
 def calc_hours_for_month(month: datetime.date):
     start = month.replace(day=1)
     end = start + relativedelta(months=1)
-    # week_day = ['пн', 'вт', 'ср', 'чт', 'пт', 'сб', 'вс']
-    rest_days = get_rest_days_between(start, end)
-    hours = 0
-    for day in daterange(start, end):
-        is_rest = to_epoch_days(day) in rest_days
-        # print(day, 'rest' if is_rest else '')
-        if is_rest:
-            continue
-        # if day.weekday() in [5, 6]:  # сб, вс
-        #     continue
-        hours += 8
-    return hours
+    return count_work_days(start, end) * HOURS_PER_DAY
+
+
+def _period(fr: datetime.date, to: datetime.date) -> dict:
+    work_days = count_work_days(fr, to)
+    return {
+        'start': fr,
+        'end': to,
+        'work_days': work_days,
+        'hours': work_days * HOURS_PER_DAY,
+    }
+
+
+def get_work_calendar(fr: datetime.date, to: datetime.date) -> dict:
+    """Норма часов в [fr, to) по месяцам и по неделям (с понедельника), крайние периоды обрезаются по границам"""
+    months = []
+    start = fr
+    while start < to:
+        end = min(start.replace(day=1) + relativedelta(months=1), to)
+        months.append(_period(start, end))
+        start = end
+    weeks = []
+    start = fr
+    while start < to:
+        end = min(start + datetime.timedelta(days=7 - start.weekday()), to)
+        weeks.append(_period(start, end))
+        start = end
+    return {
+        'total': _period(fr, to),
+        'months': months,
+        'weeks': weeks,
+    }
@@ -0,0 +1,159 @@
+import datetime
+
+from dateutil.relativedelta import relativedelta
+
+from database import ws_db
+from database import ws_record
+from database import ws_holiday
+
+# учет отработанных часов: hours_ledger хранит часы по заказам на пользователя и месяц.
+# Строка пересчитывается из orders в той же транзакции, что и изменение заказов или праздников месяца.
+# Переработка прошлых месяцев - бонус, недоработка - штраф: переносится на норму следующих месяцев.
+# Месяц без единого заказа в перенос не входит: пользователя не было в графике (еще не принят, уволен,
+# долгий отпуск), и его норма за этот месяц не должна превращаться в штраф
+
+WORK_HOURS = 8
+ALL_DAY_HOURS = 12
+ALL_DAY_REST_HOURS = 20  # ALL_DAY в выходной
+
+# выходной: праздник из holidays, иначе сб/вс (1970-01-01 - четверг, weekday = (date + 3) % 7)
+_IS_REST_SQL = "COALESCE(1 - h.is_work_day, (o.date + 3) % 7 >= 5)"
+_HOURS_SQL = (
+    f"SUM(CASE o.order_id"
+    f" WHEN 1 THEN {WORK_HOURS}"
+    f" WHEN 2 THEN CASE WHEN {_IS_REST_SQL} THEN {ALL_DAY_REST_HOURS} ELSE {ALL_DAY_HOURS} END"
+    f" ELSE 0 END)"
+)
+
+
+class LedgerRow(ws_record.Record):
+
+    __slots__ = ['user_id', 'month', 'hours']
+    _decoders = {'month': ws_record.decode_date}
+
+    user_id: int
+    month: datetime.date
+    hours: int
+
+
+def _month(date: datetime.date) -> datetime.date:
+    return date.replace(day=1)
+
+
+def _refresh(connection, month: datetime.date, user_ids: list[int] = None):
+    # два запроса на месяц при любом числе пользователей; user_ids=None - все пользователи месяца
+    in_sql = "" if user_ids is None else f" IN ({', '.join('?' * len(user_ids))})"
+    user_sql = "" if user_ids is None else " AND o.user_id" + in_sql
+    user_args = tuple(user_ids or ())
+    connection.execute(
+        "DELETE FROM hours_ledger WHERE"
+        " `month` = ?" + ("" if user_ids is None else " AND `user_id`" + in_sql),
+        (month, *user_args)
+    )
+    connection.execute(
+        "INSERT INTO hours_ledger (user_id, month, hours)"
+        f" SELECT o.user_id, ?, {_HOURS_SQL}"
+        " FROM orders o LEFT JOIN holidays h ON h.date = o.date"
+        " WHERE o.date >= ? AND o.date < ?" + user_sql +
+        " GROUP BY o.user_id",
+        (month, month, month + relativedelta(months=1), *user_args)
+    )
+
+
+def refresh_orders(connection, changes: list[tuple]):
+    """Вызывается в той же транзакции, что и изменение заказов; changes - (date, user_id, ...)"""
+    user_ids_by_month: dict[datetime.date, set[int]] = {}
+    for row in changes:
+        user_ids_by_month.setdefault(_month(row[0]), set()).add(row[1])
+    for month, user_ids in sorted(user_ids_by_month.items()):
+        _refresh(connection, month, sorted(user_ids))
+
+
+def refresh_months(connection, dates):
+    """После изменения праздников: часы ALL_DAY зависят от того, выходной ли день"""
+    for month in sorted({_month(date) for date in dates}):
+        _refresh(connection, month)
+
+
+def rebuild(connection):
+    """Пересчитывает весь журнал из orders (миграция, восстановление)"""
+    connection.execute("DELETE FROM hours_ledger")
+    connection.execute(
+        "INSERT INTO hours_ledger (user_id, month, hours)"
+        " SELECT o.user_id,"
+        " CAST(julianday(date(o.date * 86400, 'unixepoch', 'start of month')) - 2440587.5 AS INTEGER) AS m,"
+        f" {_HOURS_SQL}"
+        " FROM orders o LEFT JOIN holidays h ON h.date = o.date"
+        " GROUP BY o.user_id, m"
+    )
+
+
+def get_hours_between(fr: datetime.date, to: datetime.date) -> dict[int, int]:
+    """Часы по заказам в [fr, to) для каждого пользователя, считаются в базе"""
+    with ws_db.get_db_connection() as conn:
+        rows = conn.execute(
+            f"SELECT o.user_id, {_HOURS_SQL} AS hours"
+            " FROM orders o LEFT JOIN holidays h ON h.date = o.date"
+            " WHERE o.date >= ? AND o.date < ?"
+            " GROUP BY o.user_id",
+            (fr, to)
+        ).fetchall()
+    return {row['user_id']: row['hours'] for row in rows}
+
+
+def _get_ledger(to: datetime.date, user_ids: list[int] = None) -> list[LedgerRow]:
+    user_sql = "" if user_ids is None else f" AND `user_id` IN ({', '.join('?' * len(user_ids))})"
+    with ws_db.get_db_connection() as conn:
+        return ws_record.fetch_all(
+            conn, LedgerRow,
+            "SELECT user_id, month, hours FROM hours_ledger"
+            " WHERE `month` < ?" + user_sql +
+            " ORDER BY `user_id`, `month`",
+            (to, *(user_ids or ()))
+        )
+
+
+class _RequiredHours(dict):
+    """Норма часов по месяцам, считается один раз на месяц"""
+
+    def __missing__(self, month: datetime.date) -> int:
+        hours = self[month] = ws_holiday.calc_hours_for_month(month)
+        return hours
+
+
+def get_carry_hours(month: datetime.date) -> dict[int, int]:
+    """
+    Перенос на month: сумма (часы - норма) за все прошлые месяцы, в которых у пользователя были заказы.
+    Месяцы без заказов пропускаются намеренно - пользователя не было в графике.
+    Положительный - бонус (норму можно уменьшить), отрицательный - штраф.
+    """
+    carry = {}
+    required = _RequiredHours()
+    for row in _get_ledger(_month(month)):
+        carry[row.user_id] = carry.get(row.user_id, 0) + row.hours - required[row.month]
+    return carry
+
+
+def get_report(fr: datetime.date, to: datetime.date, user_ids: list[int] = None) -> list[dict]:
+    """
+    Часы, норма и перенос по месяцам [fr, to) на пользователя одним запросом к журналу.
+    carry_hours - перенос из прошлых месяцев, balance - перенос на следующий месяц.
+    """
+    out = []
+    carry = {}
+    required = _RequiredHours()
+    for row in _get_ledger(to, user_ids):
+        required_hours = required[row.month]
+        carry_hours = carry.get(row.user_id, 0)
+        balance = carry_hours + row.hours - required_hours
+        carry[row.user_id] = balance
+        if row.month >= _month(fr):
+            out.append({
+                'user_id': row.user_id,
+                'month': row.month,
+                'hours': row.hours,
+                'required_hours': required_hours,
+                'carry_hours': carry_hours,
+                'balance': balance,
+            })
+    return out
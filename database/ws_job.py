@@ -0,0 +1,133 @@
+import datetime
+import json
+import time
+
+from database import ws_db
+from database import ws_record
+
+# фоновые задачи автозаполнения. Активная (queued/running) задача на месяц может быть только одна -
+# это гарантирует частичный уникальный индекс, он же служит блокировкой месяца для всех процессов сервера
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+STALE_SEC = 10 * 60  # активная задача без обновлений дольше этого считается потерянной (процесс упал)
+HEARTBEAT_SEC = STALE_SEC / 10  # как часто выполняющаяся задача подтверждает, что ее процесс жив
+
+
+class JobRow(ws_record.Record):
+
+    __slots__ = ['id', 'month', 'cur', 'params', 'status', 'progress', 'result', 'error', 'created_by',
+                 'created_at', 'updated_at']
+    _decoders = {'month': ws_record.decode_date, 'cur': ws_record.decode_date, 'params': json.loads,
+                 'result': json.loads}
+
+    month: datetime.date
+    cur: datetime.date
+    params: dict
+    result: dict or None
+
+    @property
+    def is_finished(self) -> bool:
+        return self.status in (DONE, FAILED)
+
+
+def _fail_stale_jobs(connection, now: int):
+    connection.execute(
+        "UPDATE autofill_jobs SET status = ?, error = ?, updated_at = ? WHERE"
+        " `status` IN (?, ?) AND"
+        " `updated_at` < ?",
+        (FAILED, 'job was lost', now,
+         QUEUED, RUNNING, now - STALE_SEC)
+    )
+
+
+def add_job(cur: datetime.date, params: dict, user_id: int) -> tuple[JobRow, bool]:
+    """
+    Ставит задачу на месяц cur. Если на этот месяц уже есть активная задача, возвращает ее.
+    Возвращает (задача, создана ли новая).
+    """
+    month = cur.replace(day=1)
+    now = int(time.time())
+    with ws_db.transaction(immediate=True) as connection:
+        _fail_stale_jobs(connection, now)
+        row = connection.execute(
+            "SELECT * FROM autofill_jobs WHERE"
+            " `month` = ? AND"
+            " `status` IN (?, ?)",
+            (month, QUEUED, RUNNING)
+        ).fetchone()
+        if row is not None:
+            return JobRow(row), False
+        cursor = connection.execute(
+            "INSERT INTO autofill_jobs"
+            " (month, cur, params, status, progress, created_by, created_at, updated_at)"
+            " VALUES (?, ?, ?, ?, 0, ?, ?, ?)",
+            (month, cur, json.dumps(params, sort_keys=True), QUEUED, user_id, now, now)
+        )
+        job_id = cursor.lastrowid
+    return get_job(job_id), True
+
+
+def get_job(job_id: int) -> JobRow or None:
+    with ws_db.get_db_connection() as conn:
+        return ws_record.fetch_one(
+            conn, JobRow,
+            "SELECT * FROM autofill_jobs WHERE"
+            " `id` = ?",
+            (job_id,)
+        )
+
+
+def update_job(job_id: int, status: str = None, progress: float = None, result: dict = None, error: str = None):
+    """Обновляет переданные поля; заодно обновляет updated_at, по которому видно, что задача жива"""
+    fields = {'updated_at': int(time.time())}
+    if status is not None:
+        fields['status'] = status
+    if progress is not None:
+        fields['progress'] = progress
+    if result is not None:
+        fields['result'] = json.dumps(result)
+    if error is not None:
+        fields['error'] = error
+    with ws_db.get_db_connection() as connection:
+        connection.execute(
+            f"UPDATE autofill_jobs SET {', '.join(f'`{k}` = ?' for k in fields)} WHERE"
+            " `id` = ?",
+            (*fields.values(), job_id)
+        )
+        connection.commit()
+
+
+def _touch_job(connection, job_id: int, from_status: str, to_status: str) -> bool:
+    cursor = connection.execute(
+        "UPDATE autofill_jobs SET status = ?, updated_at = ? WHERE"
+        " `id` = ? AND"
+        " `status` = ?",
+        (to_status, int(time.time()), job_id, from_status)
+    )
+    return cursor.rowcount == 1
+
+
+def start_job(job_id: int) -> bool:
+    """QUEUED -> RUNNING. False, если задачу уже признали потерянной и месяц отдали другой"""
+    with ws_db.get_db_connection() as connection:
+        started = _touch_job(connection, job_id, QUEUED, RUNNING)
+        connection.commit()
+    return started
+
+
+def touch_job(job_id: int) -> bool:
+    """Продлевает выполняющуюся задачу (heartbeat). False, если она уже не RUNNING"""
+    with ws_db.get_db_connection() as connection:
+        alive = _touch_job(connection, job_id, RUNNING, RUNNING)
+        connection.commit()
+    return alive
+
+
+def own_job(connection, job_id: int) -> bool:
+    """
+    Вызывается в транзакции записи результата: продлевает задачу и проверяет, что она все еще RUNNING.
+    Пока транзакция открыта, add_job не может признать ее потерянной.
+    """
+    return _touch_job(connection, job_id, RUNNING, RUNNING)
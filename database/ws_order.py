@@ -2,9 +2,12 @@ import datetime
 import json
 import enum
 
-import ws_utils
 from database import ws_db
+from database import ws_record
 from database import ws_permissions
+from database import ws_version
+from database import ws_changes
+from database import ws_hours
 
 
 class Order(enum.IntEnum):
@@ -13,60 +16,58 @@ class Order(enum.IntEnum):
     ALL_DAY = 2
 
 
-class OrderRow(dict):
+class OrderRow(ws_record.Record):
 
     __slots__ = ['date', 'user_id', 'order', 'comment', 'created_at']
+    _decoders = {'date': ws_record.decode_date, 'order_id': Order}
+    _renames = {'order_id': 'order'}
 
     date: datetime.date
     user_id: int
     order: Order
     comment: str
 
-    def __init__(self, row: dict):
-        super().__init__(row)
-        for k, v in row.items():
-            if k == 'date':
-                v = ws_utils.parse_date(v)
-            elif k == 'order_id':
-                k = 'order'
-                v = Order(v)
-            setattr(self, k, v)
-
 
 def set_order(date: datetime.date, user_id, order: Order or None, comment=""):
-    with ws_db.get_db_connection() as connection:
-        if order is Order.ALL_DAY:
-            # check no one has all day here
-            ad_user_id = get_all_day_order_user_id(date)
-            if ad_user_id is not None:
-                if ad_user_id == user_id:
-                    cur = connection.cursor()
-                    cur.execute(
-                        "UPDATE orders SET comment = ? WHERE"
-                        " `date` = ? AND"
-                        " `user_id` = ?",
-                        (comment,
-                         date, user_id)
-                    )
-                    return
-                else:
-                    cur = connection.cursor()
-                    cur.execute(
-                        "DELETE FROM orders WHERE"
-                        " `date` = ? AND"
-                        " `user_id` = ?",
-                        (date, ad_user_id)
-                    )
-        cur = connection.cursor()
-        if order is None:
-            cur.execute(
+    """
+    Назначение пользователю на день, order=None удаляет назначение.
+    ALL_DAY на день может быть только у одного (индекс orders_all_day): чужой ALL_DAY снимается
+    в той же транзакции, поэтому параллельные запросы не оставляют два ALL_DAY.
+    """
+    ws_db.write_transaction(_set_order, date, user_id, order, comment)
+
+
+def _set_order(connection, date: datetime.date, user_id, order: Order or None, comment: str):
+    changes = []
+    if order is Order.ALL_DAY:
+        for row in connection.execute(
                 "DELETE FROM orders WHERE"
-                f' `date` = ? AND'
-                f' `user_id` = ?',
+                " `date` = ? AND"
+                f" `order_id` = {int(Order.ALL_DAY)} AND"
+                " `user_id` != ?"
+                " RETURNING user_id",
                 (date, user_id)
-            )
-        else:
-            cur.execute(
+        ):
+            changes.append((date, row['user_id'], None, ""))
+    if order is None:
+        cur = connection.execute(
+            "DELETE FROM orders WHERE"
+            " `date` = ? AND"
+            " `user_id` = ?",
+            (date, user_id)
+        )
+        if cur.rowcount:
+            changes.append((date, user_id, None, comment))
+    else:
+        old = connection.execute(
+            "SELECT order_id, comment FROM orders WHERE"
+            " `date` = ? AND"
+            " `user_id` = ?",
+            (date, user_id)
+        ).fetchone()
+        # то же назначение с тем же комментарием ничего не меняет: без журнала, пересчета часов и версии месяца
+        if old is None or old['order_id'] != order or old['comment'] != comment:
+            connection.execute(
                 "INSERT INTO orders"
                 " (date, user_id, order_id, comment)"
                 " VALUES (?, ?, ?, ?)"
@@ -77,58 +78,218 @@ def set_order(date: datetime.date, user_id, order: Order or None, comment=""):
                 (date, user_id, order, comment,
                  order, comment)
             )
-        connection.commit()
+            changes.append((date, user_id, order, comment))
+    ws_changes.log_changes(connection, ws_changes.ORDER, changes)
+    ws_hours.refresh_orders(connection, changes)
+    if changes:
+        ws_version.bump_months(connection, [date])
+
+
+def remove_all_day_order(date: datetime.date) -> int or None:
+    """Снимает ALL_DAY на день, возвращает id пользователя, у которого он был"""
+    return ws_db.write_transaction(_remove_all_day_order, date)
+
+
+def _remove_all_day_order(connection, date: datetime.date) -> int or None:
+    row = connection.execute(
+        "DELETE FROM orders WHERE"
+        " `date` = ? AND"
+        f" `order_id` = {int(Order.ALL_DAY)}"
+        " RETURNING user_id",
+        (date,)
+    ).fetchone()
+    if row is None:
+        return None
+    changes = [(date, row['user_id'], None, "")]
+    ws_changes.log_changes(connection, ws_changes.ORDER, changes)
+    ws_hours.refresh_orders(connection, changes)
+    ws_version.bump_months(connection, [date])
+    return row['user_id']
+
+
+def set_orders_bulk(
+        orders: list[tuple[datetime.date, int, Order or None, str]]
+) -> list[tuple[datetime.date, int, Order or None, Order or None]]:
+    """
+    Применяет пачку назначений (date, user_id, order, comment) одной транзакцией.
+    order=None удаляет назначение.
+    Как и set_order, ALL_DAY на день может быть только у одного: чужой ALL_DAY удаляется.
+    Возвращает изменения (date, user_id, old_order, new_order) для строк, где поменялся order.
+    """
+    if not orders:
+        return []
+    return ws_db.write_transaction(apply_orders_bulk, orders)
+
+
+def replace_work_orders(
+        rosters: dict[datetime.date, list[int]], comment=""
+) -> list[tuple[datetime.date, int, Order or None, Order or None]]:
+    """
+    Заменяет список работающих (WORK) на каждый день из rosters одной транзакцией.
+    Лишние WORK удаляются, недостающим пользователям назначается WORK.
+    """
+    if not rosters:
+        return []
+    return ws_db.write_transaction(_replace_work_orders, rosters, comment)
+
+
+def _replace_work_orders(connection, rosters: dict[datetime.date, list[int]], comment: str):
+    dates = list(rosters.keys())
+    current: dict[datetime.date, set[int]] = {}
+    for row in connection.execute(
+            "SELECT date, user_id FROM orders"
+            f" WHERE date IN ({', '.join('?' * len(dates))}) AND"
+            " `order_id` = ?",
+            (*dates, Order.WORK)
+    ):
+        current.setdefault(ws_record.decode_date(row['date']), set()).add(row['user_id'])
+    orders = []
+    for date, user_ids in rosters.items():
+        work = current.get(date, set())
+        for user_id in sorted(work.difference(user_ids)):
+            orders.append((date, user_id, None, comment))
+        for user_id in user_ids:
+            if user_id not in work:
+                orders.append((date, user_id, Order.WORK, comment))
+    return apply_orders_bulk(connection, orders)
+
+
+def squash_orders(
+        orders: list[tuple[datetime.date, int, Order or None, str]]
+) -> list[tuple[datetime.date, int, Order or None, str]]:
+    """
+    Сводит пачку назначений к одному на (date, user_id), как если бы они применялись по очереди через set_order:
+    последняя строка выигрывает, а новый ALL_DAY на день снимает ALL_DAY, выданный в пачке раньше другому.
+    """
+    squashed: dict[tuple[datetime.date, int], tuple[datetime.date, int, Order or None, str]] = {}
+    all_day_by_date: dict[datetime.date, int] = {}
+    for date, user_id, order, comment in orders:
+        if order is Order.ALL_DAY:
+            ad_user_id = all_day_by_date.get(date)
+            if ad_user_id is not None and ad_user_id != user_id and squashed[(date, ad_user_id)][2] is Order.ALL_DAY:
+                squashed[(date, ad_user_id)] = (date, ad_user_id, None, "")
+            all_day_by_date[date] = user_id
+        squashed[(date, user_id)] = (date, user_id, order, comment)
+    return list(squashed.values())
+
+
+def apply_orders_bulk(connection, orders: list[tuple[datetime.date, int, Order or None, str]]):
+    """
+    То же, что set_orders_bulk, но внутри уже открытой транзакции connection.
+    Два ALL_DAY на один день в пачке - ValueError, такие пачки сначала сводятся через squash_orders.
+    """
+    if not orders:
+        return []
+    all_day_by_date: dict[datetime.date, int] = {}
+    for date, user_id, order, comment in orders:
+        if order is Order.ALL_DAY:
+            if all_day_by_date.setdefault(date, user_id) != user_id:
+                raise ValueError(f'more than one all_day order at {date}')
+    fr = min(row[0] for row in orders)
+    to = max(row[0] for row in orders)
+    old: dict[tuple[datetime.date, int], tuple[Order, str]] = {}
+    old_all_day: dict[datetime.date, int] = {}
+    for row in connection.execute(
+            "SELECT date, user_id, order_id, comment FROM orders"
+            " WHERE date BETWEEN ? AND ?",
+            (fr, to)
+    ):
+        date = ws_record.decode_date(row['date'])
+        order = Order(row['order_id'])
+        old[(date, row['user_id'])] = (order, row['comment'])
+        if order is Order.ALL_DAY:
+            old_all_day[date] = row['user_id']
+    diff = []
+    to_delete = []
+    to_upsert = []
+    # освобождаем ALL_DAY, занятые другими пользователями
+    for date, user_id in all_day_by_date.items():
+        ad_user_id = old_all_day.get(date)
+        if ad_user_id is not None and ad_user_id != user_id:
+            to_delete.append((date, ad_user_id))
+            del old[(date, ad_user_id)]
+            diff.append((date, ad_user_id, Order.ALL_DAY, None))
+    for date, user_id, order, comment in orders:
+        old_order, old_comment = old.get((date, user_id), (None, None))
+        if order is None:
+            if old_order is None:
+                continue
+            to_delete.append((date, user_id))
+            del old[(date, user_id)]
+        else:
+            if old_order is order and old_comment == comment:
+                continue
+            to_upsert.append((date, user_id, order, comment, order, comment))
+            old[(date, user_id)] = (order, comment)
+        if old_order is not order:
+            diff.append((date, user_id, old_order, order))
+    connection.executemany(
+        "DELETE FROM orders WHERE"
+        " `date` = ? AND"
+        " `user_id` = ?",
+        to_delete
+    )
+    connection.executemany(
+        "INSERT INTO orders"
+        " (date, user_id, order_id, comment)"
+        " VALUES (?, ?, ?, ?)"
+        " ON CONFLICT(date, user_id)"
+        " DO UPDATE SET `order_id`=?, `comment`=?",
+        to_upsert
+    )
+    changes = [(date, user_id, None, "") for date, user_id in to_delete]
+    changes += [(date, user_id, order, comment) for date, user_id, order, comment, _, _ in to_upsert]
+    ws_changes.log_changes(connection, ws_changes.ORDER, changes)
+    ws_hours.refresh_orders(connection, changes)
+    ws_version.bump_months(connection, [row[0] for row in changes])
+    return diff
 
 
 def get_orders_all() -> list[OrderRow]:
     with ws_db.get_db_connection() as conn:
-        rows = conn.execute('SELECT * FROM orders').fetchall()
-    return [OrderRow(dict(ix)) for ix in rows]
+        return ws_record.fetch_all(conn, OrderRow, 'SELECT * FROM orders')
 
 
 def get_orders(day: datetime.date) -> list[OrderRow]:
     with ws_db.get_db_connection() as conn:
-        rows = conn.execute(
+        return ws_record.fetch_all(
+            conn, OrderRow,
             "SELECT * FROM orders WHERE"
             " `date` = ?",
             (day,)
-        ).fetchall()
-    return [OrderRow(dict(ix)) for ix in rows]
+        )
 
 
 def get_orders_between(fr: datetime.date, to: datetime.date) -> list[OrderRow]:
     with ws_db.get_db_connection() as conn:
-        rows = conn.execute(
+        return ws_record.fetch_all(
+            conn, OrderRow,
             "SELECT * FROM orders"
             " WHERE date BETWEEN ? AND ?",
             (fr, to - datetime.timedelta(days=1))
-        ).fetchall()
-    return [OrderRow(dict(ix)) for ix in rows]
+        )
 
 
 def get_user_orders_between(user_id: int, fr: datetime.date, to: datetime.date) -> list[OrderRow]:
     with ws_db.get_db_connection() as conn:
-        rows = conn.execute(
-            "SELECT * FROM orders"
+        return ws_record.fetch_all(
+            conn, OrderRow,
+            "SELECT date, user_id, order_id, comment FROM orders"  # только колонки индекса orders_user_id_date
             " WHERE `user_id` = ? AND date BETWEEN ? AND ?",
             (user_id, fr, to - datetime.timedelta(days=1))
-        ).fetchall()
-    return [OrderRow(dict(ix)) for ix in rows]
+        )
 
 
 def get_order(date: datetime.date, user_id: int) -> OrderRow or None:
     with ws_db.get_db_connection() as conn:
-        cursor = conn.execute(
+        return ws_record.fetch_one(
+            conn, OrderRow,
             "SELECT * FROM orders WHERE"
             " `date` = ? AND"
             " `user_id` = ?"
             " LIMIT 1",
             (date, user_id)
         )
-        row = cursor.fetchone()
-    if row is None:
-        return None
-    return OrderRow(dict(row))
 
 
 def get_all_day_order_user_id(date: datetime.date) -> int or None:
@@ -136,9 +297,9 @@ def get_all_day_order_user_id(date: datetime.date) -> int or None:
         cursor = conn.execute(
             "SELECT user_id FROM orders WHERE"
             " `date` = ? AND"
-            " `order_id` = ?"
+            f" `order_id` = {int(Order.ALL_DAY)}"  # константой, иначе sqlite не выберет частичный индекс orders_all_day
             " LIMIT 1",
-            (date, Order.ALL_DAY)
+            (date,)
         )
         row = cursor.fetchone()
     if row is None:
@@ -0,0 +1,114 @@
+import datetime
+import enum
+import functools
+import sqlite3
+
+import ws_utils
+
+# легкие строки результатов запросов: только __slots__, без копии в dict,
+# декодирование колонок описывается один раз на класс, а план разбора строится один раз на запрос
+
+
+@functools.lru_cache(maxsize=4096)
+def decode_date(value: int or str) -> datetime.date:
+    """
+    Даты в базе хранятся числом дней от 1970-01-01 (ws_utils.to_epoch_days), одни и те же дни
+    повторяются в каждой строке месяца. Строка 'YYYY-MM-DD' тоже принимается.
+    """
+    if isinstance(value, str):
+        return datetime.date.fromisoformat(value)
+    return ws_utils.from_epoch_days(value)
+
+
+class Record:
+    """
+    Базовый класс строки. Подкласс перечисляет поля в __slots__ и при необходимости задает
+    _decoders (колонка -> функция разбора), _renames (колонка -> поле) и _hidden (поля, которые не
+    отдаются в to_json, например пароль).
+    """
+
+    __slots__ = ()
+    _decoders: dict = {}
+    _renames: dict = {}
+    _hidden: tuple = ()
+
+    def __init__(self, row: dict):
+        """row - колонки как в базе (dict или sqlite3.Row), разбираются теми же декодерами"""
+        for (name, decode), v in zip(_columns(type(self), tuple(row.keys())), _values(row)):
+            if decode is not None and v is not None:
+                v = decode(v)
+            setattr(self, name, v)
+
+    def _fields(self):
+        for name in self.__slots__:
+            try:
+                yield name, getattr(self, name)
+            except AttributeError:  # колонку не выбирали
+                continue
+
+    def to_json(self) -> dict:
+        out = {}
+        for name, v in self._fields():
+            if name in self._hidden:
+                continue
+            if isinstance(v, (datetime.date, datetime.datetime)):
+                v = v.isoformat()
+            elif isinstance(v, enum.Enum) and not isinstance(v, int):
+                v = v.name
+            out[name] = v
+        return out
+
+    def __eq__(self, other):
+        if type(other) is not type(self):
+            return NotImplemented
+        return dict(self._fields()) == dict(other._fields())
+
+    def __repr__(self):
+        fields = ', '.join(f'{k}={v!r}' for k, v in self._fields() if k not in self._hidden)
+        return f'{type(self).__name__}({fields})'
+
+
+def _values(row) -> tuple:
+    return tuple(row.values()) if isinstance(row, dict) else tuple(row)
+
+
+@functools.lru_cache(maxsize=256)
+def _columns(cls, columns: tuple[str, ...]) -> tuple:
+    """(поле, декодер) для каждой колонки"""
+    return tuple((cls._renames.get(c, c), cls._decoders.get(c)) for c in columns)
+
+
+@functools.lru_cache(maxsize=256)
+def _plan(cls, columns: tuple[str, ...]):
+    """Функция tuple -> cls для конкретного набора колонок"""
+    plan = _columns(cls, columns)
+    new = cls.__new__
+
+    def make(row: tuple):
+        obj = new(cls)
+        for (name, decode), v in zip(plan, row):
+            if decode is not None and v is not None:
+                v = decode(v)
+            setattr(obj, name, v)
+        return obj
+    return make
+
+
+def _execute(conn: sqlite3.Connection, sql: str, params) -> sqlite3.Cursor:
+    cur = conn.cursor()
+    cur.row_factory = None  # кортежи: дешевле всего, поля раскладывает _plan
+    return cur.execute(sql, params)
+
+
+def fetch_all(conn: sqlite3.Connection, cls, sql: str, params=()) -> list:
+    cur = _execute(conn, sql, params)
+    make = _plan(cls, tuple(d[0] for d in cur.description))
+    return [make(row) for row in cur.fetchall()]
+
+
+def fetch_one(conn: sqlite3.Connection, cls, sql: str, params=()):
+    cur = _execute(conn, sql, params)
+    row = cur.fetchone()
+    if row is None:
+        return None
+    return _plan(cls, tuple(d[0] for d in cur.description))(row)
@@ -1,63 +1,167 @@
+import sqlite3
+import threading
+import time
+
 from database import ws_db
-import string
+from database import ws_record
+from database import ws_auth
+from database import ws_version
 import secrets
 
+SESSION_TTL_SEC = 14 * 24 * 60 * 60  # сессия живет 2 недели с последнего использования
+RENEW_INTERVAL_SEC = 60 * 60  # продлеваем не чаще раза в час, чтобы не писать в базу на каждый запрос
+SWEEP_INTERVAL_SEC = 10 * 60
+SWEEP_BATCH_SIZE = 500
+
 
-class Session(dict):
+class Session(ws_record.Record):
 
-    __slots__ = ['id', 'token', 'user_id', 'created_at']
-    def __init__(self, row: dict):
-        super().__init__(row)
-        for k, v in row.items():
-            setattr(self, k, v)
+    __slots__ = ['id', 'token', 'user_id', 'created_at', 'expires_at']
+    _hidden = ('token',)
 
 
-def add_session(user_id, token):
+def add_session(user_id, token, expires_at: int):
     with ws_db.get_db_connection() as connection:
         cur = connection.cursor()
         cur.execute(
             "INSERT INTO sessions"
-            " (user_id, token)"
-            " VALUES (?, ?)",
-            (user_id, token)
+            " (user_id, token, expires_at)"
+            " VALUES (?, ?, ?)",
+            (user_id, token, expires_at)
         )
         connection.commit()
 
 
+def revoke_session(token: str) -> bool:
+    with ws_db.get_db_connection() as connection:
+        cur = connection.cursor()
+        cur.execute(
+            "DELETE FROM sessions WHERE"
+            " `token` = ?",
+            (token,)
+        )
+        deleted = cur.rowcount != 0
+        if deleted:
+            ws_version.bump_cache(connection, ws_version.AUTH)
+        connection.commit()
+    ws_auth.invalidate_token(token)
+    return deleted
+
+
 def find_session_by_token(token: str) -> Session or None:
+    """Возвращает только не истекшую сессию"""
     with ws_db.get_db_connection() as conn:
-        sql = f'SELECT * FROM sessions WHERE `token` = \'{token}\''
-        row = conn.execute(sql).fetchone()
-    if row is None:
-        return None
-    return Session(dict(row))
+        return ws_record.fetch_one(
+            conn, Session,
+            "SELECT * FROM sessions WHERE"
+            " `token` = ? AND"
+            " `expires_at` > ?",
+            (token, int(time.time()))
+        )
 
 
-def _generate_new_token():
-    alphabet = string.ascii_letters + string.digits
-    letters = []
-    for i in range(64):
-        letter = secrets.choice(alphabet)
-        letters.append(letter)
-    return ''.join(letters)
+def touch_session(session: Session):
+    """Скользящее продление: сессия живет SESSION_TTL_SEC с последнего использования"""
+    now = int(time.time())
+    if session.expires_at - now > SESSION_TTL_SEC - RENEW_INTERVAL_SEC:
+        return  # недавно продлевали
+    expires_at = now + SESSION_TTL_SEC
+    with ws_db.get_db_connection() as connection:
+        connection.execute(
+            "UPDATE sessions SET expires_at = ? WHERE"
+            " `id` = ?",
+            (expires_at, session.id)
+        )
+        connection.commit()
+    session.expires_at = expires_at
 
 
-def generate_unique_token():
-    while True:
-        token = _generate_new_token()
-        session = find_session_by_token(token)
-        if session is None:
-            return token
+def _generate_new_token():
+    return secrets.token_hex(32)  # 64 символа
 
 
 def start_user_session(user_id):
-    token = generate_unique_token()
-    add_session(user_id, token)
-    return token
+    expires_at = int(time.time()) + SESSION_TTL_SEC
+    while True:
+        token = _generate_new_token()
+        try:
+            # уникальность гарантирует UNIQUE(token), совпадение практически невозможно
+            add_session(user_id, token, expires_at)
+        except sqlite3.IntegrityError:
+            continue
+        return token
 
 
-def get_sessions() -> list[Session]:
+def get_sessions(after_id: int = 0, limit: int = 100) -> list[Session]:
+    """Постраничная выдача: следующая страница начинается после id последней сессии"""
     with ws_db.get_db_connection() as conn:
-        rows = conn.execute('SELECT * FROM sessions').fetchall()
-    return [Session(dict(ix)) for ix in rows]
+        return ws_record.fetch_all(
+            conn, Session,
+            "SELECT * FROM sessions"
+            " WHERE `id` > ?"
+            " ORDER BY `id`"
+            " LIMIT ?",
+            (after_id, limit)
+        )
 
+
+def delete_expired_sessions(batch_size: int = SWEEP_BATCH_SIZE) -> int:
+    """Удаляет истекшие сессии пачками, чтобы не держать блокировку записи надолго"""
+    now = int(time.time())
+    total = 0
+    while True:
+        with ws_db.get_db_connection() as connection:
+            cur = connection.cursor()
+            cur.execute(
+                "DELETE FROM sessions WHERE `id` IN ("
+                " SELECT `id` FROM sessions"
+                " WHERE `expires_at` <= ?"
+                " LIMIT ?)",
+                (now, batch_size)
+            )
+            connection.commit()
+            deleted = cur.rowcount
+        total += deleted
+        if deleted < batch_size:
+            return total
+
+
+class SessionSweeper(threading.Thread):
+
+    def __init__(self, interval: float = SWEEP_INTERVAL_SEC):
+        super().__init__(name='session-sweeper', daemon=True)
+        self.interval = interval
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            try:
+                removed = delete_expired_sessions()
+            except sqlite3.Error as e:
+                print(f"session sweeper error {e}")
+                continue
+            if removed:
+                print(f"session sweeper removed {removed}")
+
+    def stop(self):
+        self._stop_event.set()
+
+
+_sweeper: SessionSweeper or None = None
+
+
+def start_sweeper(interval: float = SWEEP_INTERVAL_SEC):
+    global _sweeper
+    if _sweeper is not None:
+        return
+    _sweeper = SessionSweeper(interval)
+    _sweeper.start()
+
+
+def stop_sweeper():
+    global _sweeper
+    if _sweeper is None:
+        return
+    _sweeper.stop()
+    _sweeper.join()
+    _sweeper = None
@@ -0,0 +1,177 @@
+import csv
+import datetime
+import io
+import json
+
+import ws_utils
+from database import ws_db
+from database import ws_record
+from database import ws_order
+from database import ws_desire
+from database import ws_holiday
+from database import ws_user
+
+# выгрузка и загрузка расписаний целиком (обмен годовыми графиками с отделом кадров, перенос отделов).
+# Одна строка - одна запись: kind, date, user_id, value_id, comment.
+# value_id - order_id / desire_id / is_work_day (для праздников user_id пустой), пустой value_id удаляет запись
+ORDER = 'order'
+DESIRE = 'desire'
+HOLIDAY = 'holiday'
+KINDS = (ORDER, DESIRE, HOLIDAY)
+COLUMNS = ('kind', 'date', 'user_id', 'value_id', 'comment')
+
+CSV = 'csv'
+NDJSON = 'ndjson'
+FORMATS = (CSV, NDJSON)
+MIMETYPES = {CSV: 'text/csv', NDJSON: 'application/x-ndjson'}
+
+EXPORT_BATCH_SIZE = 1000  # строк за один fetchmany и один кусок ответа
+IMPORT_CHUNK_SIZE = 5000  # строк в одной транзакции загрузки
+
+_EXPORT_SQL = {
+    ORDER: "SELECT date, user_id, order_id, comment FROM orders WHERE date >= ? AND date < ? ORDER BY date, user_id",
+    DESIRE: "SELECT date, user_id, desire_id, comment FROM desires WHERE date >= ? AND date < ? ORDER BY date, user_id",
+    HOLIDAY: "SELECT date, NULL, is_work_day, '' FROM holidays WHERE date >= ? AND date < ? ORDER BY date",
+}
+
+
+def iter_export(fr: datetime.date, to: datetime.date, kinds=KINDS):
+    """
+    Выдает строки (kind, date, user_id, value_id, comment) за [fr, to) пачками по EXPORT_BATCH_SIZE.
+    Все виды читаются из одного снимка базы, в памяти не больше одной пачки.
+    """
+    with ws_db.transaction() as conn:
+        for kind in kinds:
+            cur = conn.cursor()
+            cur.row_factory = None
+            cur.execute(_EXPORT_SQL[kind], (fr, to))
+            while True:
+                rows = cur.fetchmany(EXPORT_BATCH_SIZE)
+                if not rows:
+                    break
+                yield [(kind, ws_record.decode_date(date), user_id, value_id, comment)
+                       for date, user_id, value_id, comment in rows]
+
+
+def encode_csv(batches):
+    yield ','.join(COLUMNS) + '\r\n'
+    for rows in batches:
+        out = io.StringIO()
+        csv.writer(out).writerows(rows)
+        yield out.getvalue()
+
+
+def encode_ndjson(batches):
+    for rows in batches:
+        yield ''.join(json.dumps(dict(zip(COLUMNS, (kind, str(date), user_id, value_id, comment))),
+                                 ensure_ascii=False) + '\n'
+                      for kind, date, user_id, value_id, comment in rows)
+
+
+def export(fr: datetime.date, to: datetime.date, fmt: str = CSV, kinds=KINDS):
+    """Генератор текста выгрузки в формате fmt"""
+    batches = iter_export(fr, to, kinds)
+    return encode_csv(batches) if fmt == CSV else encode_ndjson(batches)
+
+
+def _parse_row(n: int, kind, date, user_id, value_id, comment) -> tuple:
+    try:
+        if kind not in KINDS:
+            raise ValueError(f'unknown kind {kind!r}')
+        date = ws_utils.parse_date(date) if isinstance(date, str) else date
+        user_id = None if user_id in (None, '') else int(user_id)
+        value_id = None if value_id in (None, '') else int(value_id)
+        if kind == ORDER:
+            value = None if value_id is None else ws_order.Order(value_id)
+        elif kind == DESIRE:
+            value = None if value_id is None else ws_desire.Desire(value_id)
+        else:
+            value = None if value_id is None else bool(value_id)
+        if kind != HOLIDAY and user_id is None:
+            raise ValueError('user_id is required')
+        return kind, date, user_id, value, comment or ''
+    except (TypeError, ValueError) as e:
+        raise ValueError(f'line {n}: {e}') from None
+
+
+def parse_csv(lines):
+    """Строки файла -> (kind, date, user_id, value, comment); первая строка - заголовок"""
+    reader = csv.reader(lines)
+    header = next(reader, None)
+    if header is None:
+        return
+    if tuple(header) != COLUMNS:
+        raise ValueError(f'line 1: expected header {",".join(COLUMNS)}')
+    for row in reader:
+        if not row:
+            continue
+        if len(row) != len(COLUMNS):
+            raise ValueError(f'line {reader.line_num}: expected {len(COLUMNS)} columns')
+        yield _parse_row(reader.line_num, *row)
+
+
+def parse_ndjson(lines):
+    for n, line in enumerate(lines, 1):
+        if not line.strip():
+            continue
+        try:
+            obj = json.loads(line)
+            values = [obj.get(column) for column in COLUMNS]
+        except (ValueError, AttributeError):
+            raise ValueError(f'line {n}: invalid json') from None
+        yield _parse_row(n, *values)
+
+
+def parse(lines, fmt: str):
+    return parse_csv(lines) if fmt == CSV else parse_ndjson(lines)
+
+
+def _apply_chunk(connection, chunk: list[tuple]) -> dict:
+    orders = [(date, user_id, value, comment) for kind, date, user_id, value, comment in chunk if kind == ORDER]
+    desires = [(date, user_id, value, comment) for kind, date, user_id, value, comment in chunk if kind == DESIRE]
+    # удаление праздника - возврат к обычному дню недели
+    holidays = [(date, date.weekday() < 5 if value is None else value)
+                for kind, date, user_id, value, comment in chunk if kind == HOLIDAY]
+    # строки файла применяются по порядку: повторная строка на тот же день перекрывает предыдущую
+    # (пожелания и праздники сводит сам apply_*_bulk)
+    ws_order.apply_orders_bulk(connection, ws_order.squash_orders(orders))
+    ws_desire.apply_desires_bulk(connection, desires)
+    ws_holiday.apply_holidays_bulk(connection, holidays)
+    return {ORDER: len(orders), DESIRE: len(desires), HOLIDAY: len(holidays)}
+
+
+def import_rows(rows, chunk_size: int = IMPORT_CHUNK_SIZE, on_progress=None) -> dict:
+    """
+    Загружает строки из parse() кусками по chunk_size, каждый кусок - одна транзакция.
+    on_progress(counts) вызывается после каждого куска. При ошибке в данных уже загруженные куски остаются,
+    ValueError сообщает номер строки. Возвращает число загруженных строк по видам.
+    """
+    counts = dict.fromkeys(KINDS, 0)
+    known_users: set[int] = set()
+    chunk = []
+
+    def flush():
+        user_ids = {row[2] for row in chunk if row[2] is not None}.difference(known_users)
+        if user_ids:
+            unknown = user_ids.difference(ws_user.get_existing_user_ids(list(user_ids)))
+            if unknown:
+                raise ValueError(f'unknown user ids {sorted(unknown)}')
+            known_users.update(user_ids)
+        applied = ws_db.write_transaction(_apply_chunk, chunk)
+        for kind, n in applied.items():
+            counts[kind] += n
+        chunk.clear()
+        if on_progress is not None:
+            on_progress(dict(counts))
+
+    try:
+        for row in rows:
+            chunk.append(row)
+            if len(chunk) >= chunk_size:
+                flush()
+        if chunk:
+            flush()
+    finally:
+        if counts[HOLIDAY]:
+            ws_holiday.invalidate_calendar()
+    return counts
@@ -1,12 +1,17 @@
 import json
 
 from database import ws_db
+from database import ws_record
 from database import ws_permissions
+from database import ws_auth
+from database import ws_version
 
 
-class UserRow(dict):
+class UserRow(ws_record.Record):
 
     __slots__ = ['id', 'login', 'password', 'role', 'first_name', 'last_name', 'fathers_name', 'created_at']
+    _decoders = {'role': ws_permissions.parse_role}
+    _hidden = ('password',)
 
     id: int
     login: str
@@ -16,13 +21,6 @@ class UserRow(dict):
     last_name: str
     fathers_name: str
 
-    def __init__(self, row: dict):
-        super().__init__(row)
-        for k, v in row.items():
-            if k == 'role':
-                v = ws_permissions.parse_role(v)
-            setattr(self, k, v)
-
 
 def add_user(login, password, role: ws_permissions.Role, first_name: str, last_name: str, fathers_name: str=None) -> int:
     with ws_db.get_db_connection() as connection:
@@ -47,13 +45,14 @@ def update_user(row: UserRow):
             (row.login, row.password, row.role.name, row.first_name, row.last_name, row.fathers_name,
              row.id)
         )
+        ws_version.bump_cache(connection, ws_version.AUTH)
         connection.commit()
+    ws_auth.invalidate_user(row.id)
 
 
 def get_users() -> list[UserRow]:
     with ws_db.get_db_connection() as conn:
-        rows = conn.execute('SELECT * FROM users').fetchall()
-    return [UserRow(dict(ix)) for ix in rows]
+        return ws_record.fetch_all(conn, UserRow, 'SELECT * FROM users')
 
 
 def get_user(user_id: int) -> UserRow or None:
@@ -63,10 +62,20 @@ def get_user(user_id: int) -> UserRow or None:
             f' `id` = \'{user_id}\''
             f' LIMIT 1'
         )
-        row = conn.execute(sql).fetchone()
-    if row is None:
-        return None
-    return UserRow(dict(row))
+        return ws_record.fetch_one(conn, UserRow, sql)
+
+
+def get_existing_user_ids(user_ids: list[int]) -> set[int]:
+    """Проверяет сразу пачку id одним запросом"""
+    if not user_ids:
+        return set()
+    with ws_db.get_db_connection() as conn:
+        rows = conn.execute(
+            "SELECT id FROM users WHERE"
+            f" `id` IN ({', '.join('?' * len(user_ids))})",
+            tuple(user_ids)
+        ).fetchall()
+    return {row['id'] for row in rows}
 
 
 def delete_user(user_id: int) -> bool:
@@ -77,7 +86,11 @@ def delete_user(user_id: int) -> bool:
             " `id` = ?",
             (user_id,)
         )
-        return cur.rowcount != 0
+        deleted = cur.rowcount != 0
+        if deleted:
+            ws_version.bump_cache(connection, ws_version.AUTH)
+    ws_auth.invalidate_user(user_id)
+    return deleted
 
 
 def find_user_by_auth(login: str, password: str) -> UserRow or None:
@@ -85,20 +98,14 @@ def find_user_by_auth(login: str, password: str) -> UserRow or None:
         sql = (f'SELECT * FROM users WHERE'
                f' `login` = \'{login}\' AND'
                f' `password` = \'{password}\'')
-        row = conn.execute(sql).fetchone()
-    if row is None:
-        return None
-    return UserRow(dict(row))
+        return ws_record.fetch_one(conn, UserRow, sql)
 
 
 def find_user_by_login(login: str) -> UserRow or None:
     with ws_db.get_db_connection() as conn:
         sql = (f'SELECT * FROM users WHERE'
                f' `login` = \'{login}\'')
-        row = conn.execute(sql).fetchone()
-    if row is None:
-        return None
-    return UserRow(dict(row))
+        return ws_record.fetch_one(conn, UserRow, sql)
 
 
 def create_initial_users():
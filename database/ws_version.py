@@ -0,0 +1,102 @@
+import datetime
+import threading
+import time
+
+from database import ws_db
+
+# версия месяца растет при каждом изменении заказов, пожеланий или праздников в этом месяце,
+# по ней клиенты и кеш ответов понимают, что данные не поменялись.
+# Версии кешей процесса (календарь, авторизация) растут при изменении их данных в любом процессе сервера:
+# остальные процессы видят это не позже чем через CACHE_CHECK_SEC и сбрасывают свой кеш
+HOLIDAYS = 'holidays'
+AUTH = 'auth'
+CACHE_CHECK_SEC = 1.0
+
+
+def _month(date: datetime.date) -> datetime.date:
+    return date.replace(day=1)
+
+
+def bump_months(connection, dates):
+    """Вызывается в той же транзакции, что и само изменение"""
+    months = sorted({_month(date) for date in dates})
+    connection.executemany(
+        "INSERT INTO month_versions"
+        " (month, version)"
+        " VALUES (?, 1)"
+        " ON CONFLICT(month)"
+        " DO UPDATE SET `version` = `version` + 1",
+        [(month,) for month in months]
+    )
+
+
+def get_month_version(date: datetime.date) -> int:
+    with ws_db.get_db_connection() as conn:
+        row = conn.execute(
+            "SELECT version FROM month_versions WHERE"
+            " `month` = ?",
+            (_month(date),)
+        ).fetchone()
+    return 0 if row is None else row['version']
+
+
+def bump_cache(connection, name: str):
+    """Вызывается в той же транзакции, что и изменение данных кеша name"""
+    connection.execute(
+        "INSERT INTO cache_versions"
+        " (name, version)"
+        " VALUES (?, 1)"
+        " ON CONFLICT(name)"
+        " DO UPDATE SET `version` = `version` + 1",
+        (name,)
+    )
+
+
+def get_cache_version(name: str) -> int:
+    with ws_db.get_db_connection() as conn:
+        row = conn.execute(
+            "SELECT version FROM cache_versions WHERE"
+            " `name` = ?",
+            (name,)
+        ).fetchone()
+    return 0 if row is None else row['version']
+
+
+class CacheVersion:
+    """Версия кеша name, с которой работает этот процесс"""
+
+    def __init__(self, name: str, on_change):
+        self.name = name
+        self.on_change = on_change  # сбрасывает кеш
+        self._version = None
+        self._checked_at = float('-inf')
+        self._lock = threading.Lock()
+        _cache_versions.append(self)
+
+    def sync(self):
+        """Вызывается перед чтением кеша: если версия в базе изменилась, кеш сбрасывается"""
+        if time.monotonic() - self._checked_at < CACHE_CHECK_SEC:
+            return
+        with self._lock:
+            now = time.monotonic()
+            if now - self._checked_at < CACHE_CHECK_SEC:
+                return
+            version = get_cache_version(self.name)
+            if version != self._version:
+                self.on_change()
+                self._version = version
+            self._checked_at = now
+
+    def forget(self):
+        with self._lock:
+            self._version = None
+            self._checked_at = float('-inf')
+
+
+_cache_versions: list[CacheVersion] = []
+
+
+def forget_cache_versions():
+    """После смены базы (тесты, бенчмарк): следующий sync перечитает версии и сбросит кеши"""
+    for cache_version in _cache_versions:
+        cache_version.forget()
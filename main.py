@@ -1,6 +1,28 @@
+import argparse
 
-from rest_server import ws_server
+from database import ws_session, ws_changes
+from rest_server import ws_prefork
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--workers', type=int, default=ws_prefork.DEFAULT_WORKERS, help='число процессов')
+    parser.add_argument('--threads', type=int, default=ws_prefork.DEFAULT_THREADS, help='потоков на процесс')
+    parser.add_argument('--streams', type=int, default=ws_prefork.DEFAULT_STREAMS,
+                        help='подключений /events и /poll_events на процесс, сверх - 503')
+    parser.add_argument('--graceful-timeout', type=float, default=ws_prefork.GRACEFUL_TIMEOUT_SEC)
+    parser.add_argument('--dev', action='store_true', help='однопроцессный отладочный сервер с перезагрузкой')
+    args = parser.parse_args()
+    if args.dev:
+        from rest_server import ws_server
+        ws_session.start_sweeper()
+        ws_changes.start_compactor()
+        ws_server.app.run(host=args.host, port=args.port, debug=True)
+        return
+    ws_prefork.run(args.host, args.port, args.workers, args.threads, args.graceful_timeout, args.streams)
 
 
 if __name__ == '__main__':
-    ws_server.app.run(host='0.0.0.0', port='8000', debug=True)
+    main()
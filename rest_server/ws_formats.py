@@ -0,0 +1,62 @@
+import gzip
+import json
+
+import flask
+from flask import Request
+from flask.json.provider import DefaultJSONProvider
+
+from database import ws_record
+
+try:
+    import msgpack
+except ImportError:  # msgpack не обязателен, без него формат просто не предлагается
+    msgpack = None
+
+# форматы ответа, выбираются по Accept; JSON по умолчанию
+JSON_MIMETYPE = 'application/json'
+COLUMNAR_MIMETYPE = 'application/vnd.ws.columnar+json'  # колонки вместо объекта на каждую строку
+MSGPACK_MIMETYPE = 'application/vnd.ws.columnar+msgpack'
+GZIP_MIN_SIZE = 1024  # маленькие ответы сжимать невыгодно
+GZIP_LEVEL = 6
+
+
+class JSONProvider(DefaultJSONProvider):
+    """jsonify для строк базы (ws_record.Record): только открытые поля, без пароля и токена"""
+
+    @staticmethod
+    def default(o):
+        if isinstance(o, ws_record.Record):
+            return o.to_json()
+        return DefaultJSONProvider.default(o)
+
+
+def negotiate(request: Request, columnar: bool) -> str:
+    if not columnar:
+        return JSON_MIMETYPE
+    offered = [JSON_MIMETYPE, COLUMNAR_MIMETYPE]
+    if msgpack is not None:
+        offered.append(MSGPACK_MIMETYPE)
+    return request.accept_mimetypes.best_match(offered, default=JSON_MIMETYPE)
+
+
+def is_columnar(mimetype: str) -> bool:
+    return mimetype != JSON_MIMETYPE
+
+
+def accepts_gzip(request: Request) -> bool:
+    return request.accept_encodings['gzip'] > 0
+
+
+def encode(data: dict, mimetype: str) -> bytes:
+    if mimetype == MSGPACK_MIMETYPE:
+        return msgpack.packb(data)
+    if mimetype == JSON_MIMETYPE:
+        return flask.json.dumps(data).encode()  # как jsonify, чтобы формат по умолчанию не поменялся
+    return json.dumps(data, ensure_ascii=False, separators=(',', ':')).encode()
+
+
+def compress(body: bytes, use_gzip: bool) -> tuple[bytes, str or None]:
+    """Возвращает тело и Content-Encoding"""
+    if not use_gzip or len(body) < GZIP_MIN_SIZE:
+        return body, None
+    return gzip.compress(body, GZIP_LEVEL, mtime=0), 'gzip'
@@ -0,0 +1,123 @@
+import concurrent.futures
+import datetime
+import random
+import threading
+import time
+import traceback
+
+import work_scheduler
+from database import ws_db, ws_job, ws_order
+from rest_server import ws_push
+
+# пул, в котором процесс сервера выполняет свои задачи автозаполнения
+AUTOFILL_WORKERS = 2
+WAIT_POLL_SEC = 0.2  # задача могла попасть в другой процесс сервера, тогда ее статус видно только из базы
+
+_lock = threading.Lock()
+_finished = threading.Condition(_lock)
+_executor: concurrent.futures.ThreadPoolExecutor or None = None
+
+
+def _get_executor() -> concurrent.futures.ThreadPoolExecutor:
+    global _executor
+    with _lock:
+        if _executor is None:
+            _executor = concurrent.futures.ThreadPoolExecutor(AUTOFILL_WORKERS, thread_name_prefix='autofill')
+        return _executor
+
+
+def submit(cur: datetime.date, params: dict, user_id: int) -> tuple[ws_job.JobRow, bool]:
+    """
+    Ставит автозаполнение месяца в очередь. Пока на месяц есть активная задача, новая не создается,
+    возвращается (активная задача, False) - вызывающий решает, тот же это запрос или конфликт.
+    """
+    job, created = ws_job.add_job(cur, params, user_id)
+    if created:
+        _get_executor().submit(_run, job.id, cur, params)
+    return job, created
+
+
+def _heartbeat(job_id: int, stop: threading.Event):
+    # долгий run_best_of не обновляет задачу между результатами, без этого ее сочтут потерянной через STALE_SEC
+    try:
+        while not stop.wait(ws_job.HEARTBEAT_SEC):
+            if not ws_job.touch_job(job_id):
+                return
+    finally:
+        ws_db.close_db_connection()
+
+
+def _apply_result(connection, job_id: int, rows: list[tuple]):
+    # задачу могли признать потерянной и отдать месяц новой задаче: тогда ее результат не пишем
+    if not ws_job.own_job(connection, job_id):
+        return None
+    return ws_order.apply_orders_bulk(connection, rows)
+
+
+def _run(job_id: int, cur: datetime.date, params: dict):
+    stop_heartbeat = threading.Event()
+    try:
+        if not ws_job.start_job(job_id):
+            print('autifill job', job_id, 'was lost before start')
+            return
+        threading.Thread(target=_heartbeat, args=(job_id, stop_heartbeat), name=f'autofill-heartbeat-{job_id}',
+                         daemon=True).start()
+        profile = params.get('profile', False)
+        if 'runs' in params:
+            def on_progress(done, total):
+                ws_job.update_job(job_id, progress=round(0.9 * done / total, 3))
+            result = work_scheduler.run_best_of(cur, params['runs'], params['time_budget'], profile=profile,
+                                                on_progress=on_progress)
+        else:  # seed из прошлого результата воспроизводит то же распределение
+            seed = params['seed'] if params.get('seed') is not None else random.randrange(2 ** 32)
+            result = work_scheduler.run_seed(cur, seed, profile=profile)
+        print('autifill job', job_id, cur, f'seed={result.seed}', result.score.to_json())
+        for day, err in sorted(result.error_all_day.items()):
+            print(f'  err {day} {err}')
+            ws_job.update_job(job_id, status=ws_job.FAILED, error=f"{day} {err}",
+                              result={'seed': result.seed, 'score': result.score.to_json()})
+            return
+        ws_job.update_job(job_id, progress=0.9)
+        diff = ws_db.write_transaction(_apply_result, job_id, result.rows)
+        if diff is None:
+            print(f'autifill job {job_id} was lost, result is dropped')
+            return
+        ws_push.notify()
+        print(f'autifill job {job_id} changed {len(diff)} orders')
+        out = {
+            'seed': result.seed,
+            'score': result.score.to_json(),
+            'changed': len(diff),
+        }
+        if result.profile is not None:
+            out['profile'] = result.profile
+        ws_job.update_job(job_id, status=ws_job.DONE, progress=1.0, result=out)
+    except Exception as e:
+        traceback.print_exc()
+        ws_job.update_job(job_id, status=ws_job.FAILED, error=repr(e))
+    finally:
+        stop_heartbeat.set()
+        ws_db.close_db_connection()  # поток пула живет долго, соединение откроется заново при следующей задаче
+        with _finished:
+            _finished.notify_all()
+
+
+def wait(job_id: int, timeout: float) -> ws_job.JobRow or None:
+    """Ждет завершения задачи не дольше timeout и возвращает ее текущее состояние"""
+    deadline = time.monotonic() + timeout
+    while True:
+        job = ws_job.get_job(job_id)
+        left = deadline - time.monotonic()
+        if job is None or job.is_finished or left <= 0:
+            return job
+        with _finished:
+            _finished.wait(min(left, WAIT_POLL_SEC))
+
+
+def shutdown(wait_jobs: bool = True):
+    """При остановке процесса даем задачам закончиться, иначе месяц останется занят до STALE_SEC"""
+    global _executor
+    with _lock:
+        executor, _executor = _executor, None
+    if executor is not None:
+        executor.shutdown(wait=wait_jobs)
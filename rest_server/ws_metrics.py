@@ -0,0 +1,263 @@
+import bisect
+import json
+import os
+import threading
+import time
+
+from flask import Flask, Response, g, request
+
+from database import ws_db, ws_auth
+
+# границы корзин гистограмм
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)  # секунды
+STATEMENT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+# одинаковый запрос, выполненный столько раз за один HTTP запрос, считаем признаком N+1
+REPEATED_STATEMENT_THRESHOLD = 10
+MAX_STATEMENT_LABEL = 120
+# pre-fork: каждый рабочий процесс сохраняет свои метрики в общий каталог, /metrics отдает сумму по всем
+SNAPSHOT_INTERVAL_SEC = 5.0
+
+
+class Histogram:
+
+    __slots__ = ['buckets', 'counts', 'sum', 'count']
+
+    def __init__(self, buckets: tuple):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # последняя корзина - +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def merge(self, counts: list[int], total: float, count: int):
+        self.counts = [a + b for a, b in zip(self.counts, counts)]
+        self.sum += total
+        self.count += count
+
+
+_lock = threading.Lock()
+_latency: dict[tuple[str, str], Histogram] = {}  # (endpoint, method)
+_statements: dict[str, Histogram] = {}  # endpoint
+_responses: dict[tuple[str, str, int], int] = {}  # (endpoint, method, status)
+_connections: dict[str, int] = {}  # endpoint
+_repeated: dict[tuple[str, str], int] = {}  # (endpoint, statement) -> сколько запросов с N+1
+
+
+def _endpoint() -> str:
+    return request.endpoint or 'unknown'
+
+
+def _before_request():
+    g.metrics_start = time.perf_counter()
+    ws_db.begin_query_stats()
+
+
+def _after_request(response: Response):
+    start = g.pop('metrics_start', None)
+    stats = ws_db.end_query_stats()
+    if start is None:
+        return response
+    elapsed = time.perf_counter() - start
+    endpoint = _endpoint()
+    repeated = []
+    if stats is not None:
+        repeated = [(sql, n) for sql, n in stats.by_sql.items() if n >= REPEATED_STATEMENT_THRESHOLD]
+    with _lock:
+        key = (endpoint, request.method)
+        hist = _latency.get(key)
+        if hist is None:
+            hist = _latency[key] = Histogram(LATENCY_BUCKETS)
+        hist.observe(elapsed)
+        status_key = (endpoint, request.method, response.status_code)
+        _responses[status_key] = _responses.get(status_key, 0) + 1
+        if stats is not None:
+            hist = _statements.get(endpoint)
+            if hist is None:
+                hist = _statements[endpoint] = Histogram(STATEMENT_BUCKETS)
+            hist.observe(stats.statements)
+            _connections[endpoint] = _connections.get(endpoint, 0) + stats.connections
+        for sql, n in repeated:
+            repeated_key = (endpoint, sql[:MAX_STATEMENT_LABEL])
+            _repeated[repeated_key] = _repeated.get(repeated_key, 0) + 1
+    for sql, n in repeated:
+        print(f"N+1 in {endpoint}: {n} x {sql}")
+    return response
+
+
+def reset():
+    with _lock:
+        _latency.clear()
+        _statements.clear()
+        _responses.clear()
+        _connections.clear()
+        _repeated.clear()
+
+
+def _label_value(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(**labels) -> str:
+    return '{' + ','.join(f'{k}="{_label_value(v)}"' for k, v in labels.items()) + '}'
+
+
+def _histogram_lines(name: str, hist: Histogram, **labels) -> list[str]:
+    lines = []
+    cumulative = 0
+    for bound, count in zip((*hist.buckets, '+Inf'), hist.counts):
+        cumulative += count
+        lines.append(f'{name}_bucket{_labels(**labels, le=bound)} {cumulative}')
+    lines.append(f'{name}_sum{_labels(**labels)} {hist.sum}')
+    lines.append(f'{name}_count{_labels(**labels)} {hist.count}')
+    return lines
+
+
+def _snapshot() -> dict:
+    """Метрики процесса в виде, пригодном для json: ключи - списки, гистограммы - [counts, sum, count]"""
+    pool = ws_db.get_pool_stats()
+    auth = ws_auth.get_stats()
+    with _lock:
+        return {
+            'latency': [[list(k), [h.counts, h.sum, h.count]] for k, h in _latency.items()],
+            'statements': [[[k], [h.counts, h.sum, h.count]] for k, h in _statements.items()],
+            'responses': [[list(k), n] for k, n in _responses.items()],
+            'connections': [[[k], n] for k, n in _connections.items()],
+            'repeated': [[list(k), n] for k, n in _repeated.items()],
+            'process': [[['pool_active'], pool['active']], [['pool_opened'], pool['opened']],
+                        [['auth_hits'], auth['hits']], [['auth_misses'], auth['misses']]],
+        }
+
+
+def _merge(snapshots: list[dict]) -> dict:
+    merged = {}
+    for name in ('latency', 'statements'):
+        buckets = LATENCY_BUCKETS if name == 'latency' else STATEMENT_BUCKETS
+        hists = merged[name] = {}
+        for snapshot in snapshots:
+            for key, value in snapshot.get(name, ()):
+                key = tuple(key)
+                hist = hists.get(key)
+                if hist is None:
+                    hist = hists[key] = Histogram(buckets)
+                hist.merge(*value)
+    for name in ('responses', 'connections', 'repeated', 'process'):
+        counters = merged[name] = {}
+        for snapshot in snapshots:
+            for key, n in snapshot.get(name, ()):
+                key = tuple(key)
+                counters[key] = counters.get(key, 0) + n
+    return merged
+
+
+_shared_dir: str or None = None
+_shared_name: str or None = None
+_snapshot_stop = threading.Event()
+_snapshot_thread: threading.Thread or None = None
+
+
+def _write_snapshot():
+    path = os.path.join(_shared_dir, f'{_shared_name}.json')
+    tmp = f'{path}.{os.getpid()}.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(_snapshot(), f)
+    os.replace(tmp, path)  # читатель не увидит файл наполовину записанным
+
+
+def _read_snapshots(directory: str) -> list[dict]:
+    snapshots = [_snapshot()]  # свои метрики - текущие, а не из последнего снимка
+    for name in sorted(os.listdir(directory)):
+        if not name.endswith('.json') or name == f'{_shared_name}.json':
+            continue
+        try:
+            with open(os.path.join(directory, name)) as f:
+                snapshots.append(json.load(f))
+        except (OSError, ValueError) as e:
+            print(f"metrics snapshot {name} error {e}")
+    return snapshots
+
+
+def _run_snapshots():
+    while not _snapshot_stop.wait(SNAPSHOT_INTERVAL_SEC):
+        try:
+            _write_snapshot()
+        except OSError as e:
+            print(f"metrics snapshot error {e}")
+
+
+def start_shared(directory: str, name: str):
+    """
+    Pre-fork: метрики процесса раз в SNAPSHOT_INTERVAL_SEC пишутся в directory/<name>.json,
+    /metrics складывает свои метрики с последними снимками остальных рабочих.
+    Перезапущенный рабочий с тем же name заменяет снимок упавшего (счетчики начинаются заново).
+    """
+    global _shared_dir, _shared_name, _snapshot_thread
+    _shared_dir, _shared_name = directory, name
+    _snapshot_stop.clear()
+    _snapshot_thread = threading.Thread(target=_run_snapshots, name='metrics-snapshot', daemon=True)
+    _snapshot_thread.start()
+
+
+def stop_shared():
+    """Последний снимок при остановке рабочего, чтобы его счетчики не пропали из суммы"""
+    global _shared_dir, _snapshot_thread
+    if _snapshot_thread is None:
+        return
+    _snapshot_stop.set()
+    _snapshot_thread.join()
+    _snapshot_thread = None
+    try:
+        _write_snapshot()
+    except OSError as e:
+        print(f"metrics snapshot error {e}")
+    _shared_dir = None
+
+
+def render() -> str:
+    """Метрики в текстовом формате Prometheus; в pre-fork - сумма по всем рабочим процессам"""
+    shared_dir = _shared_dir
+    m = _merge(_read_snapshots(shared_dir) if shared_dir is not None else [_snapshot()])
+    lines = []
+    lines.append('# HELP ws_http_request_duration_seconds Request latency by endpoint.')
+    lines.append('# TYPE ws_http_request_duration_seconds histogram')
+    for (endpoint, method), hist in sorted(m['latency'].items()):
+        lines += _histogram_lines('ws_http_request_duration_seconds', hist, endpoint=endpoint, method=method)
+    lines.append('# HELP ws_http_responses_total Responses by endpoint and status code.')
+    lines.append('# TYPE ws_http_responses_total counter')
+    for (endpoint, method, status), n in sorted(m['responses'].items()):
+        lines.append(f'ws_http_responses_total{_labels(endpoint=endpoint, method=method, status=status)} {n}')
+    lines.append('# HELP ws_db_statements_per_request SQL statements executed per request.')
+    lines.append('# TYPE ws_db_statements_per_request histogram')
+    for (endpoint,), hist in sorted(m['statements'].items()):
+        lines += _histogram_lines('ws_db_statements_per_request', hist, endpoint=endpoint)
+    lines.append('# HELP ws_db_connections_opened_total DB connections opened while serving requests.')
+    lines.append('# TYPE ws_db_connections_opened_total counter')
+    for (endpoint,), n in sorted(m['connections'].items()):
+        lines.append(f'ws_db_connections_opened_total{_labels(endpoint=endpoint)} {n}')
+    lines.append('# HELP ws_db_repeated_statement_requests_total Requests that ran the same statement'
+                 f' at least {REPEATED_STATEMENT_THRESHOLD} times (N+1).')
+    lines.append('# TYPE ws_db_repeated_statement_requests_total counter')
+    for (endpoint, sql), n in sorted(m['repeated'].items()):
+        lines.append(f'ws_db_repeated_statement_requests_total{_labels(endpoint=endpoint, statement=sql)} {n}')
+    process = m['process']
+    lines.append('# TYPE ws_db_pool_connections gauge')
+    lines.append(f'ws_db_pool_connections {process[("pool_active",)]}')
+    lines.append('# TYPE ws_db_pool_opened_total counter')
+    lines.append(f'ws_db_pool_opened_total {process[("pool_opened",)]}')
+    lines.append('# TYPE ws_auth_cache_hits_total counter')
+    lines.append(f'ws_auth_cache_hits_total {process[("auth_hits",)]}')
+    lines.append('# TYPE ws_auth_cache_misses_total counter')
+    lines.append(f'ws_auth_cache_misses_total {process[("auth_misses",)]}')
+    return '\n'.join(lines) + '\n'
+
+
+def init_app(app: Flask):
+    app.before_request(_before_request)
+    app.after_request(_after_request)
+
+    @app.get('/metrics')
+    def _get_metrics():
+        return Response(render(), mimetype='text/plain; version=0.0.4')
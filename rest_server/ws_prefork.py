@@ -0,0 +1,170 @@
+"""
+Запуск сервера в нескольких процессах (pre-fork).
+Главный процесс проверяет схему базы один раз, открывает сокет и запускает рабочие процессы,
+каждый из которых обслуживает запросы пулом потоков. Упавший рабочий перезапускается.
+Кеши каждый рабочий строит сам и сверяет с версиями в базе (ws_version), иначе изменения, сделанные
+в одном процессе, не видны остальным.
+SIGTERM/SIGINT: рабочие перестают принимать соединения (/readyz -> 503), дожидаются текущих запросов
+и задач автозаполнения и выходят; кто не успел за graceful_timeout, убивается.
+"""
+import concurrent.futures
+import os
+import shutil
+import signal
+import socket
+import sys
+import tempfile
+import threading
+import time
+
+from werkzeug.serving import BaseWSGIServer
+
+from database import ws_db, ws_session, ws_changes
+from rest_server import ws_server, ws_push, ws_jobs, ws_metrics
+
+# значения по умолчанию можно задать через окружение
+DEFAULT_WORKERS = int(os.environ.get('WS_WORKERS', os.cpu_count() or 1))
+DEFAULT_THREADS = int(os.environ.get('WS_THREADS', 8))  # на обычные запросы
+# /events и /poll_events держат поток все время подключения, для них пул больше на столько потоков
+DEFAULT_STREAMS = int(os.environ.get('WS_STREAMS', ws_server.MAX_STREAMS))
+GRACEFUL_TIMEOUT_SEC = 30.0
+RESPAWN_DELAY_SEC = 1.0
+
+
+class PoolWSGIServer(BaseWSGIServer):
+    """Werkzeug сервер с ограниченным пулом потоков вместо потока на каждое соединение"""
+
+    multithread = True
+    _pool = None
+
+    def __init__(self, host: str, port: int, app, threads: int, fd: int = None):
+        super().__init__(host, port, app, fd=fd)
+        self._pool = concurrent.futures.ThreadPoolExecutor(threads, thread_name_prefix='ws-request')
+
+    def process_request(self, request, client_address):
+        self._pool.submit(self._process_request_thread, request, client_address)
+
+    def _process_request_thread(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+    def server_close(self):
+        if self._pool is not None:  # BaseWSGIServer зовет server_close и из конструктора
+            self._pool.shutdown(wait=True)  # дожидаемся запросов, которые уже обрабатываются
+        super().server_close()
+
+
+def preload():
+    """Один раз в главном процессе, до fork"""
+    ws_db.ensure_schema()
+    # соединения sqlite нельзя использовать после fork
+    ws_db.close_all_connections()
+
+
+def _serve_worker(index: int, sock: socket.socket, host: str, port: int, threads: int, streams: int,
+                  metrics_dir: str):
+    # сверх лимита потоковые запросы получают 503, поэтому threads потоков всегда остаются обычным запросам
+    ws_server.set_max_streams(streams)
+    server = PoolWSGIServer(host, port, ws_server.app, threads + streams, fd=sock.fileno())
+    ws_metrics.start_shared(metrics_dir, f'worker-{index}')
+
+    def drain():
+        ws_server.set_draining()
+        ws_push.stop_hub()  # отпускаем SSE и long-poll подписчиков
+        server.shutdown()
+
+    def on_signal(signum, frame):
+        threading.Thread(target=drain, name='drain').start()
+
+    signal.signal(signal.SIGTERM, on_signal)
+    signal.signal(signal.SIGINT, on_signal)
+    if index == 0:  # фоновая очистка нужна в одном экземпляре
+        ws_session.start_sweeper()
+        ws_changes.start_compactor()
+    print(f"worker {index} pid {os.getpid()} serving on {host}:{port} with {threads} + {streams} threads")
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        ws_jobs.shutdown()
+        ws_metrics.stop_shared()
+        if index == 0:
+            ws_session.stop_sweeper()
+            ws_changes.stop_compactor()
+        ws_db.close_all_connections()
+
+
+def _spawn(index: int, sock: socket.socket, host: str, port: int, threads: int, streams: int,
+           metrics_dir: str) -> int:
+    pid = os.fork()
+    if pid != 0:
+        return pid
+    code = 0
+    try:
+        _serve_worker(index, sock, host, port, threads, streams, metrics_dir)
+    except BaseException as e:
+        print(f"worker {index} failed: {e!r}", file=sys.stderr)
+        code = 1
+    finally:
+        sys.stdout.flush()
+        sys.stderr.flush()
+        os._exit(code)
+
+
+def run(host: str = '0.0.0.0', port: int = 8000, workers: int = DEFAULT_WORKERS, threads: int = DEFAULT_THREADS,
+        graceful_timeout: float = GRACEFUL_TIMEOUT_SEC, streams: int = DEFAULT_STREAMS):
+    preload()
+    sock = socket.create_server((host, port), backlog=1024)
+    sock.set_inheritable(True)
+    metrics_dir = tempfile.mkdtemp(prefix='ws-metrics-')  # снимки метрик рабочих, см. ws_metrics.start_shared
+    children: dict[int, int] = {}  # pid -> номер рабочего
+    stopping = False
+
+    def stop(signum, frame):
+        nonlocal stopping
+        if stopping:
+            return
+        stopping = True
+        print(f"stopping {len(children)} workers")
+        for pid in list(children):
+            _kill(pid, signal.SIGTERM)
+        signal.signal(signal.SIGALRM, kill)
+        signal.alarm(max(1, int(graceful_timeout)))
+
+    def kill(signum, frame):
+        for pid in list(children):
+            print(f"worker pid {pid} did not stop in {graceful_timeout}s, killing")
+            _kill(pid, signal.SIGKILL)
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    for index in range(workers):
+        children[_spawn(index, sock, host, port, threads, streams, metrics_dir)] = index
+    try:
+        while children:
+            try:
+                pid, status = os.wait()
+            except ChildProcessError:
+                break
+            index = children.pop(pid, None)
+            if index is None or stopping:
+                continue
+            print(f"worker {index} pid {pid} exited with status {status}, restarting")
+            time.sleep(RESPAWN_DELAY_SEC)
+            if not stopping:
+                children[_spawn(index, sock, host, port, threads, streams, metrics_dir)] = index
+    finally:
+        signal.alarm(0)
+        sock.close()
+        shutil.rmtree(metrics_dir, ignore_errors=True)
+
+
+def _kill(pid: int, sig: int):
+    try:
+        os.kill(pid, sig)
+    except ProcessLookupError:
+        pass
@@ -0,0 +1,185 @@
+import collections
+import sqlite3
+import threading
+
+from database import ws_changes
+
+# рассылка уведомлений об изменениях подписчикам (SSE и long-poll).
+# Один поток на процесс читает новые записи журнала ws_changes и будит всех подписчиков одним notify_all,
+# поэтому изменения из других процессов сервера тоже доходят, а число пробуждений не зависит от числа подписчиков
+POLL_INTERVAL_SEC = 0.5
+POLL_BATCH_SIZE = 1000
+BUFFER_SIZE = 10000  # подписчик, отставший больше чем на буфер, дочитывает события из журнала
+
+
+class PushEvent:
+
+    __slots__ = ['seq', 'kind', 'month', 'user_id']
+
+    def __init__(self, row: ws_changes.ChangeRow):
+        self.seq = row.seq
+        self.kind = row.kind
+        self.month = row.date.replace(day=1)
+        self.user_id = row.user_id
+
+    def is_visible(self, user_id: int, all_orders: bool) -> bool:
+        # то же правило, что и в /changes: свои заказы и пожелания, все заказы при QUERY_ORDER
+        return self.user_id == user_id or (self.kind == ws_changes.ORDER and all_orders)
+
+
+class PushHub:
+
+    def __init__(self, poll_interval: float = POLL_INTERVAL_SEC, buffer_size: int = BUFFER_SIZE):
+        self.poll_interval = poll_interval
+        self._cond = threading.Condition()
+        self._poll_lock = threading.Lock()  # журнал опрашивает поток хаба, а если он отстал - и поток запроса
+        self._events: collections.deque[PushEvent] = collections.deque(maxlen=buffer_size)
+        self._first_seq = 1  # события с seq меньше этого в буфере уже нет
+        self._last_seq = 0
+        self._kick = threading.Event()
+        self._stopped = False
+        self._thread = None
+        self._stats = {
+            'wakeups': 0,
+            'events': 0,
+            'subscribers': 0,
+            'backfills': 0,
+        }
+
+    def start(self):
+        _, self._last_seq = ws_changes.get_seq_range()
+        self._first_seq = self._last_seq + 1
+        self._thread = threading.Thread(target=self._run, name='push-hub', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
+        self._kick.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    @property
+    def stopped(self) -> bool:
+        return self._stopped
+
+    @property
+    def last_seq(self) -> int:
+        with self._cond:
+            return self._last_seq
+
+    def notify(self):
+        """Изменение в этом процессе: не ждем следующего опроса журнала"""
+        self._kick.set()
+
+    def _run(self):
+        while not self._stopped:
+            self._kick.wait(self.poll_interval)
+            self._kick.clear()
+            try:
+                self.poll()
+            except sqlite3.Error as e:
+                print(f"push hub error {e}")
+
+    def poll(self):
+        with self._poll_lock:
+            while True:
+                rows = ws_changes.get_all_changes(self._last_seq, POLL_BATCH_SIZE)
+                if not rows:
+                    return
+                events = [PushEvent(row) for row in rows]
+                with self._cond:
+                    self._events.extend(events)
+                    if len(self._events) == self._events.maxlen:  # самые старые вытеснены
+                        self._first_seq = self._events[0].seq
+                    self._last_seq = events[-1].seq
+                    self._stats['wakeups'] += 1
+                    self._stats['events'] += len(events)
+                    self._cond.notify_all()
+                if len(rows) < POLL_BATCH_SIZE:
+                    return
+
+    def _backfill(self, since: int) -> tuple[list[PushEvent] or None, int]:
+        # событий после since в буфере уже (или еще) нет: хаб запущен позже или подписчик сильно отстал
+        rows = ws_changes.get_all_changes(since, POLL_BATCH_SIZE)
+        with self._cond:
+            self._stats['backfills'] += 1
+        # seq идут подряд (AUTOINCREMENT), пропуск после since - журнал уже сжат
+        if not rows or rows[0].seq != since + 1:
+            return None, self.last_seq
+        return [PushEvent(row) for row in rows], rows[-1].seq
+
+    def wait(self, since: int, timeout: float) -> tuple[list[PushEvent] or None, int]:
+        """
+        Ждет событий после since не дольше timeout.
+        Возвращает (события, новый курсор); события None - изменения после since из журнала уже удалены
+        или since не выдавался, клиенту нужна полная перезагрузка.
+        """
+        if since > self.last_seq:
+            # курсор мог выдать другой процесс сервера, а хаб этого процесса еще не дочитал журнал
+            self.poll()
+        with self._cond:
+            if since > self._last_seq:
+                return None, self._last_seq
+            if since + 1 >= self._first_seq:
+                self._stats['subscribers'] += 1
+                try:
+                    self._cond.wait_for(lambda: self._last_seq > since or self._stopped, timeout)
+                finally:
+                    self._stats['subscribers'] -= 1
+                if since + 1 >= self._first_seq:  # пока ждали, буфер мог переполниться
+                    return [event for event in self._events if event.seq > since], self._last_seq
+        return self._backfill(since)
+
+    def get_stats(self) -> dict:
+        with self._cond:
+            stats = dict(self._stats)
+            stats['buffered'] = len(self._events)
+            stats['last_seq'] = self._last_seq
+        return stats
+
+
+_hub: PushHub or None = None
+_hub_lock = threading.Lock()
+
+
+def get_hub() -> PushHub:
+    """Хаб запускается при первом подписчике"""
+    global _hub
+    with _hub_lock:
+        if _hub is None:
+            _hub = PushHub()
+            _hub.start()
+        return _hub
+
+
+def notify():
+    if _hub is not None:
+        _hub.notify()
+
+
+def get_stats() -> dict or None:
+    hub = _hub
+    return None if hub is None else hub.get_stats()
+
+
+def stop_hub():
+    global _hub
+    with _hub_lock:
+        hub, _hub = _hub, None
+    if hub is not None:
+        hub.stop()
+
+
+def group_by_month(events: list[PushEvent], user_id: int, all_orders: bool) -> list[dict]:
+    """Видимые пользователю события, по одному на месяц"""
+    months: dict = {}
+    for event in events:
+        if not event.is_visible(user_id, all_orders):
+            continue
+        item = months.setdefault(event.month, {'month': event.month.strftime('%Y-%m'), 'kinds': [], 'seq': 0})
+        if event.kind not in item['kinds']:
+            item['kinds'].append(event.kind)
+        item['seq'] = event.seq
+    return list(months.values())
@@ -0,0 +1,54 @@
+import collections
+import threading
+
+# готовые (сериализованные) ответы по месяцу: (месяц, представление) -> (версия месяца, ответ)
+# запись с устаревшей версией просто перезаписывается
+MAX_SIZE = 1024
+
+_lock = threading.Lock()
+_entries: collections.OrderedDict[tuple, tuple[int, any]] = collections.OrderedDict()
+_stats = {
+    'hits': 0,
+    'misses': 0,
+    'not_modified': 0,
+    'evictions': 0,
+}
+
+
+def get(month, scope: str, version: int):
+    key = (month, scope)
+    with _lock:
+        entry = _entries.get(key)
+        if entry is None or entry[0] != version:
+            _stats['misses'] += 1
+            return None
+        _entries.move_to_end(key)
+        _stats['hits'] += 1
+        return entry[1]
+
+
+def put(month, scope: str, version: int, body):
+    key = (month, scope)
+    with _lock:
+        _entries[key] = (version, body)
+        _entries.move_to_end(key)
+        while len(_entries) > MAX_SIZE:
+            _entries.popitem(last=False)
+            _stats['evictions'] += 1
+
+
+def count_not_modified():
+    with _lock:
+        _stats['not_modified'] += 1
+
+
+def clear():
+    with _lock:
+        _entries.clear()
+
+
+def get_stats() -> dict:
+    with _lock:
+        stats = dict(_stats)
+        stats['size'] = len(_entries)
+    return stats
@@ -1,14 +1,21 @@
 import datetime
+import io
+import json
+import sqlite3
+import threading
 import time
 
 from dateutil.relativedelta import relativedelta
-from flask import Flask, request, jsonify, render_template
+from flask import Flask, Response, request, jsonify, render_template, stream_with_context
 
-import work_scheduler
 import ws_utils
-from database import ws_db, ws_user, ws_session, ws_permissions, ws_desire, ws_order
+from database import ws_db, ws_user, ws_session, ws_permissions, ws_desire, ws_order, ws_auth, ws_holiday, \
+    ws_version, ws_changes, ws_job, ws_transfer, ws_hours
+from rest_server import ws_metrics, ws_response_cache, ws_formats, ws_push, ws_jobs
 
 app = Flask(__name__)
+app.json = ws_formats.JSONProvider(app)
+ws_metrics.init_app(app)
 
 countries = [
     {"id": 1, "name": "Thailand", "capital": "Bangkok", "area": 513120},
@@ -22,7 +29,10 @@ def index():
     return '''
 <p>Привет! это простой REST сервер проекта!</p>
 <a href="/users">users</a></br>
-<a href="/sessions">sessions</a>
+<a href="/sessions">sessions</a></br>
+<a href="/stats">stats</a></br>
+<a href="/metrics">metrics</a></br>
+<a href="/readyz">readyz</a>
 '''
 
 
@@ -33,7 +43,58 @@ def _get_users():
 
 @app.get('/sessions')
 def _get_sessions():
-    return jsonify(ws_session.get_sessions())
+    after_id = request.args.get('after', 0, type=int)
+    limit = min(request.args.get('limit', 100, type=int), 1000)
+    sessions = ws_session.get_sessions(after_id, limit)
+    return jsonify({
+        'sessions': sessions,
+        'next': f'/sessions?after={sessions[-1].id}&limit={limit}' if len(sessions) == limit else None,
+    })
+
+
+_draining = threading.Event()
+
+
+def set_draining():
+    """Сервер останавливается: /readyz отвечает 503, балансировщик перестает слать запросы"""
+    _draining.set()
+
+
+@app.get('/healthz')
+def healthz():
+    return jsonify({'status': 'ok'})
+
+
+@app.get('/readyz')
+def readyz():
+    if _draining.is_set():
+        return jsonify({'status': 'draining'}), 503  # Service Unavailable
+    try:
+        with ws_db.get_db_connection() as connection:
+            connection.execute('SELECT 1').fetchone()
+    except sqlite3.Error as e:
+        return jsonify({'status': 'database error', 'error': str(e)}), 503  # Service Unavailable
+    return jsonify({'status': 'ready'})
+
+
+@app.get('/stats')
+def _get_stats():
+    return jsonify({
+        'db_pool': ws_db.get_pool_stats(),
+        'auth_cache': ws_auth.get_stats(),
+        'response_cache': ws_response_cache.get_stats(),
+        'push': ws_push.get_stats(),
+    })
+
+
+def reset_caches():
+    """Сбрасывает все кеши процесса, построенные по данным базы: после смены ws_db.db_file (тесты, бенчмарк)"""
+    ws_push.stop_hub()
+    ws_db.close_all_connections()
+    ws_auth.clear()
+    ws_holiday.invalidate_calendar()
+    ws_response_cache.clear()
+    ws_version.forget_cache_versions()
 
 
 @app.post("/login")
@@ -65,18 +126,22 @@ def login():
 def _check_user(form, required_permission: ws_permissions.Permission or None) -> tuple[ws_user.UserRow or None, any]:
     try:
         token = form['token']
-    except ValueError:
+    except (KeyError, ValueError):
         return None, (jsonify({"error": "Token not found"}), 401)  # Unauthorized
-    session = ws_session.find_session_by_token(token)
-    if session is None:
-        return None, (jsonify({'error': 'Session is not found'}), 401)  # Unauthorized
-    user = ws_user.get_user(session.user_id)
-    if user is None:
-        return None, (jsonify({'error': 'User is not found'}), 401)  # Unauthorized
-    if required_permission is not None and not ws_permissions.has_permission(user.role, required_permission):
+    auth = ws_auth.get(token)
+    if auth is None:
+        session = ws_session.find_session_by_token(token)
+        if session is None:
+            return None, (jsonify({'error': 'Session is not found'}), 401)  # Unauthorized
+        user = ws_user.get_user(session.user_id)
+        if user is None:
+            return None, (jsonify({'error': 'User is not found'}), 401)  # Unauthorized
+        ws_session.touch_session(session)
+        auth = ws_auth.put(token, user, session.expires_at)
+    if required_permission is not None and required_permission not in auth.permissions:
         return None, (jsonify({'error': 'User has no permission'}), 403)  # Forbidden
     # time.sleep(1)  # fixme: test fake delay
-    return user, None
+    return auth.user, None
 
 
 @app.post("/set_desire")
@@ -99,6 +164,7 @@ def set_desire():
         if desire is None:
             return jsonify({'error': f'Unknown desire id {desire_id}'})
     ws_desire.set_desire(date, user.id, desire, comment)
+    ws_push.notify()
     return jsonify({})
 
 
@@ -114,21 +180,55 @@ def get_desire_data():
         date = ws_utils.parse_date(form['date'])
     except ValueError:
         return jsonify({"error": "Invalid json fields"}), 400  # Bad Request
-    start = date.replace(day=1)
-    end = start + relativedelta(months=1)
-    desires = ws_desire.get_user_desires_between(user.id, start, end)
-    print("get_desire_data", start, end, f'{user.id} {user.first_name} {user.last_name}', desires)
-    return build_desires_data(desires)
-
 
-def build_desires_data(desires):
+    def load(start):
+        end = start + relativedelta(months=1)
+        desires = ws_desire.get_user_desires_between(user.id, start, end)
+        print("get_desire_data", start, end, f'{user.id} {user.first_name} {user.last_name}', desires)
+        return _desires_data(desires)
+    return _month_response(form, date, f'desires:{user.id}', load)
+
+
+def _month_response(form, date: datetime.date, scope: str, load, load_columnar=None):
+    """
+    Ответ с данными месяца с учетом его версии (ws_version).
+    Клиент присылает version из прошлого ответа (или If-None-Match с ETag) и, если в месяце ничего
+    не менялось, получает короткий ответ not_modified. Сериализованные ответы кешируются по версии.
+    Если есть load_columnar, по Accept можно получить колоночный формат (ws_formats), по Accept-Encoding - gzip.
+    """
+    month = date.replace(day=1)
+    mimetype = ws_formats.negotiate(request, load_columnar is not None)
+    use_gzip = ws_formats.accepts_gzip(request)
+    representation = f'{scope}:{mimetype}:{"gzip" if use_gzip else "identity"}'
+    with ws_db.transaction():  # версия и данные из одного снимка базы
+        version = ws_version.get_month_version(month)
+        etag = f'{month}-{scope}-{version}'
+        if form.get('version') == version or request.if_none_match.contains_weak(etag):
+            ws_response_cache.count_not_modified()
+            body, encoding = ws_formats.encode({'not_modified': True, 'version': version}, mimetype), None
+        else:
+            body, encoding = ws_response_cache.get(month, representation, version) or (None, None)
+            if body is None:
+                data = load_columnar(month) if ws_formats.is_columnar(mimetype) else load(month)
+                body, encoding = ws_formats.compress(ws_formats.encode({**data, 'version': version}, mimetype),
+                                                     use_gzip)
+                ws_response_cache.put(month, representation, version, (body, encoding))
+    response = app.response_class(body, mimetype=mimetype)
+    if encoding is not None:
+        response.content_encoding = encoding
+    response.vary.update(('Accept', 'Accept-Encoding'))
+    response.set_etag(etag, weak=True)  # одна версия на все представления (формат, сжатие)
+    return response
+
+
+def _desires_data(desires) -> dict:
     desires_by_day = {}
     for row in desires:
         desires_by_day[row.date.day] = {
             "desire_id": int(row.desire),
             "comment": row.comment,
         }
-    return jsonify({'desires_by_day': [{"day": k, **v} for k, v in desires_by_day.items()], })
+    return {'desires_by_day': [{"day": k, **v} for k, v in desires_by_day.items()], }
 
 
 @app.post("/set_order")
@@ -145,18 +245,20 @@ def set_order():
         order_id = form['order_id']
         order = ws_order.Order(order_id) if order_id >= 0 else None
         comment = form.get('comment', '')
-    except ValueError:
+    except (ValueError, KeyError, TypeError):
         return jsonify({"error": "Invalid json fields"}), 400  # Bad Request
+    order_name = order.name if order is not None else None
     if target_user_id == -1:
-        print("set_order", date, 'None', order.name, comment)
-        ad_user_id = ws_order.get_all_day_order_user_id(date)
-        ws_order.set_order(date, ad_user_id, None, "")
+        print("set_order", date, 'None', order_name, comment)
+        ws_order.remove_all_day_order(date)
+        ws_push.notify()
         return jsonify({})
     target_user: ws_user.UserRow = ws_user.get_user(target_user_id)
     if target_user is None:
         return jsonify({'error': 'Target user is not found'}), 400  # Bad Request
-    print("set_order", date, f'{target_user.first_name} {target_user.last_name}', order.name, comment)
+    print("set_order", date, f'{target_user.first_name} {target_user.last_name}', order_name, comment)
     ws_order.set_order(date, target_user.id, order, comment)
+    ws_push.notify()
     return jsonify({})
 
 
@@ -169,33 +271,20 @@ def set_work_orders():
     if error:
         return error
     try:
-        date = ws_utils.parse_date(form['date'])
-        target_user_ids = form['user_ids']
+        # один день: date + user_ids, несколько дней: days = [{date, user_ids}, ...]
+        days = form['days'] if 'days' in form else [form]
+        rosters: dict[datetime.date, list[int]] = {}
+        for day in days:
+            rosters[ws_utils.parse_date(day['date'])] = list(day['user_ids'])
         comment = form.get('comment', '')
-    except ValueError:
+    except (ValueError, KeyError, TypeError):
         return jsonify({"error": "Invalid json fields"}), 400  # Bad Request
-    print("set_work_orders", date, f'{target_user_ids}', comment)
-    for target_user_id in target_user_ids:
-        target_user: ws_user.UserRow = ws_user.get_user(target_user_id)
-        if target_user is None:
-            return jsonify({'error': 'Target user is not found'}), 400  # Bad Request
-    to_remove: list[int] = []
-    current: list[int] = []
-    for order in ws_order.get_orders(date):
-        if order.order is not ws_order.Order.WORK:
-            continue
-        if order.user_id not in target_user_ids:
-            to_remove.append(order.user_id)
-        else:
-            current.append(order.user_id)
-    to_add: list[int] = []
-    for target_user_id in target_user_ids:
-        if target_user_id not in current:
-            to_add.append(target_user_id)
-    for uid in to_remove:
-        ws_order.set_order(date, uid, None, comment)
-    for uid in to_add:
-        ws_order.set_order(date, uid, ws_order.Order.WORK, comment)
+    print("set_work_orders", {f'{k}': v for k, v in rosters.items()}, comment)
+    target_user_ids = {uid for user_ids in rosters.values() for uid in user_ids}
+    if len(ws_user.get_existing_user_ids(list(target_user_ids))) != len(target_user_ids):
+        return jsonify({'error': 'Target user is not found'}), 400  # Bad Request
+    ws_order.replace_work_orders(rosters, comment)
+    ws_push.notify()
     return jsonify({})
 
 
@@ -228,6 +317,73 @@ def get_permissions():
     })
 
 
+MAX_CALENDAR_DAYS = 10 * 366
+
+
+@app.post("/get_work_calendar")
+def get_work_calendar():
+    """Норма рабочих часов по месяцам и неделям в [from, to), по умолчанию - год из date"""
+    if not request.is_json:
+        return jsonify({"error": "Request must be JSON"}), 415  # Unsupported Media Type
+    form = request.get_json()
+    user, error = _check_user(form, ws_permissions.Permission.QUERY_SELF)
+    if error:
+        return error
+    try:
+        if 'from' in form:
+            fr = ws_utils.parse_date(form['from'])
+            to = ws_utils.parse_date(form['to'])
+        else:
+            fr = ws_utils.parse_date(form['date']).replace(month=1, day=1)
+            to = fr + relativedelta(years=1)
+    except (ValueError, KeyError, TypeError):
+        return jsonify({"error": "Invalid json fields"}), 400  # Bad Request
+    if not fr < to or (to - fr).days > MAX_CALENDAR_DAYS:
+        return jsonify({"error": "Invalid date range"}), 400  # Bad Request
+    calendar = ws_holiday.get_work_calendar(fr, to)
+
+    def period(p):
+        return {**p, 'start': str(p['start']), 'end': str(p['end'])}
+    return jsonify({
+        'total': period(calendar['total']),
+        'months': [period(p) for p in calendar['months']],
+        'weeks': [period(p) for p in calendar['weeks']],
+    })
+
+
+@app.post("/hours_report")
+def hours_report():
+    """
+    Отработанные часы, норма и перенос бонусов/штрафов по месяцам [from, to) из журнала ws_hours.
+    Строки только за месяцы с заказами, месяцы без заказов в перенос не входят.
+    Без права QUERY_ORDER - только свои часы.
+    """
+    if not request.is_json:
+        return jsonify({"error": "Request must be JSON"}), 415  # Unsupported Media Type
+    form = request.get_json()
+    user, error = _check_user(form, ws_permissions.Permission.QUERY_SELF)
+    if error:
+        return error
+    try:
+        fr = ws_utils.parse_date(form['from']).replace(day=1)
+        to = ws_utils.parse_date(form['to'])
+        user_ids = form.get('user_ids')
+        if user_ids is not None:
+            user_ids = [int(user_id) for user_id in user_ids]
+    except (ValueError, KeyError, TypeError):
+        return jsonify({"error": "Invalid json fields"}), 400  # Bad Request
+    if not fr < to or (to - fr).days > MAX_CALENDAR_DAYS:
+        return jsonify({"error": "Invalid date range"}), 400  # Bad Request
+    if not ws_permissions.has_permission(user.role, ws_permissions.Permission.QUERY_ORDER):
+        if user_ids is not None and set(user_ids) != {user.id}:
+            return jsonify({'error': 'User has no permission'}), 403  # Forbidden
+        user_ids = [user.id]
+    rows = ws_hours.get_report(fr, to, user_ids)
+    return jsonify({
+        'rows': [{**row, 'month': str(row['month'])} for row in rows],
+    })
+
+
 @app.post("/get_month_data")
 def get_month_data():
     if not request.is_json:
@@ -241,19 +397,21 @@ def get_month_data():
     except ValueError:
         return jsonify({"error": "Invalid json fields"}), 400  # Bad Request
     if ws_permissions.has_permission(user.role, ws_permissions.Permission.QUERY_ORDER):
-        start = date.replace(day=1)
-        end = start + relativedelta(months=1)
-        orders = ws_order.get_orders_between(start, end)
-        return build_orders_data(orders)
-    if ws_permissions.has_permission(user.role, ws_permissions.Permission.QUERY_SELF_ORDER):
-        start = date.replace(day=1)
-        end = start + relativedelta(months=1)
-        orders = ws_order.get_user_orders_between(user.id, start, end)
-        return build_orders_data(orders)
-    return jsonify({'error': 'User has no permission'}), 403  # Forbidden
-
-
-def build_orders_data(orders):
+        def get_orders(start):
+            return ws_order.get_orders_between(start, start + relativedelta(months=1))
+        scope = 'orders'
+    elif ws_permissions.has_permission(user.role, ws_permissions.Permission.QUERY_SELF_ORDER):
+        def get_orders(start):
+            return ws_order.get_user_orders_between(user.id, start, start + relativedelta(months=1))
+        scope = f'orders:{user.id}'
+    else:
+        return jsonify({'error': 'User has no permission'}), 403  # Forbidden
+    return _month_response(form, date, scope,
+                           lambda start: _orders_data(get_orders(start)),
+                           lambda start: _orders_columnar(get_orders(start)))
+
+
+def _orders_data(orders) -> dict:
     orders_by_day = {}
     for row in orders:
         orders_by_day.setdefault(row.date.day, []).append({
@@ -261,11 +419,184 @@ def build_orders_data(orders):
             "order_id": int(row.order),
             "comment": row.comment,
         })
-    return jsonify({'orders_by_day': [{"day": k, "orders": v} for k, v in orders_by_day.items()], })
+    return {'orders_by_day': [{"day": k, "orders": v} for k, v in orders_by_day.items()], }
+
+
+def _orders_columnar(orders) -> dict:
+    """Колоночный формат: i-я строка - day[i], user_id[i], order_id[i], comments[comment[i]]"""
+    comments: dict[str, int] = {}  # одинаковые комментарии передаются один раз
+    days, user_ids, order_ids, comment_ids = [], [], [], []
+    for row in orders:
+        days.append(row.date.day)
+        user_ids.append(row.user_id)
+        order_ids.append(int(row.order))
+        comment_ids.append(comments.setdefault(row.comment, len(comments)))
+    return {
+        'format': 'columnar',
+        'day': days,
+        'user_id': user_ids,
+        'order_id': order_ids,
+        'comment': comment_ids,
+        'comments': list(comments),
+    }
+
+
+MAX_CHANGES_PAGE = 1000
+
+
+@app.get('/changes')
+def get_changes():
+    """
+    Изменения заказов и пожеланий после since (seq из прошлого ответа), token передается параметром.
+    reset=true - часть журнала уже удалена или база другая, клиенту нужно перечитать месяцы целиком.
+    """
+    user, error = _check_user(request.args, None)
+    if error:
+        return error
+    since = request.args.get('since', 0, type=int)
+    limit = max(1, min(request.args.get('limit', MAX_CHANGES_PAGE, type=int), MAX_CHANGES_PAGE))
+    all_orders = ws_permissions.has_permission(user.role, ws_permissions.Permission.QUERY_ORDER)
+    with ws_db.transaction():  # границы журнала и выборка из одного снимка
+        first, last = ws_changes.get_seq_range()
+        if since + 1 < first or since > last:
+            return jsonify({'reset': True, 'changes': [], 'last_seq': last, 'more': False})
+        changes = ws_changes.get_changes(since, limit, user.id, all_orders)
+    more = len(changes) == limit
+    return jsonify({
+        'reset': False,
+        'changes': [{
+            'seq': row.seq,
+            'kind': row.kind,
+            'date': str(row.date),
+            'user_id': row.user_id,
+            'value_id': row.value_id,
+            'comment': row.comment,
+        } for row in changes],
+        # для следующего запроса: если страница неполная, чужие изменения до last уже можно пропустить
+        'last_seq': changes[-1].seq if more else last,
+        'more': more,
+    })
+
+
+EVENTS_HEARTBEAT_SEC = 15.0
+MAX_POLL_TIMEOUT_SEC = 60.0
+# /events и /poll_events держат поток все время ожидания: сверх лимита отвечаем 503, чтобы они не заняли
+# все потоки процесса и не остановили обычные запросы (/healthz, /set_order, ...)
+MAX_STREAMS = 32
+STREAMS_RETRY_AFTER_SEC = 5
+_streams = threading.BoundedSemaphore(MAX_STREAMS)
+
+
+def set_max_streams(max_streams: int):
+    """Вызывается до запуска сервера, пул потоков ws_prefork рассчитан на этот лимит"""
+    global _streams
+    _streams = threading.BoundedSemaphore(max_streams)
+
+
+def _acquire_stream() -> threading.BoundedSemaphore or None:
+    streams = _streams
+    return streams if streams.acquire(blocking=False) else None
+
+
+def _too_many_streams():
+    return (jsonify({'error': 'Too many streaming connections'}), 503,  # Service Unavailable
+            {'Retry-After': str(STREAMS_RETRY_AFTER_SEC)})
+
+
+def _push_since() -> int:
+    # EventSource при переподключении сам присылает Last-Event-ID
+    since = request.headers.get('Last-Event-ID', type=int)
+    if since is None:
+        since = request.args.get('since', type=int)
+    return ws_push.get_hub().last_seq if since is None else since
+
+
+@app.get('/events')
+def get_events():
+    """
+    Server-sent events об изменениях по месяцам: event: change, data: {month, kinds, seq}.
+    Клиент дочитывает изменения через /changes или /get_month_data с version.
+    event: reset - изменения после Last-Event-ID из журнала уже удалены, нужно перечитать месяцы целиком.
+    Сверх MAX_STREAMS подключений на процесс - 503 с Retry-After.
+    """
+    user, error = _check_user(request.args, None)
+    if error:
+        return error
+    hub = ws_push.get_hub()
+    since = _push_since()
+    streams = _acquire_stream()
+    if streams is None:
+        return _too_many_streams()
+
+    @stream_with_context
+    def stream():
+        cursor = since
+        yield 'retry: 3000\n\n'
+        while True:
+            events, last = hub.wait(cursor, EVENTS_HEARTBEAT_SEC)
+            if hub.stopped:  # сервер останавливается, EventSource переподключится к другому процессу
+                return
+            if events is None:
+                yield f'id: {last}\nevent: reset\ndata: {{}}\n\n'
+            elif last == cursor:
+                # тишина: пинг держит соединение и заодно проверяем, что сессия еще жива
+                _, error = _check_user(request.args, None)
+                if error:
+                    return
+                yield ': ping\n\n'
+                continue
+            else:
+                all_orders = ws_permissions.has_permission(user.role, ws_permissions.Permission.QUERY_ORDER)
+                for item in ws_push.group_by_month(events, user.id, all_orders):
+                    yield f'id: {last}\nevent: change\ndata: {json.dumps(item)}\n\n'
+            cursor = last
+    response = Response(stream(), mimetype='text/event-stream', headers={'Cache-Control': 'no-cache'})
+    # и при обрыве соединения клиентом: его видно на следующей записи, не позже EVENTS_HEARTBEAT_SEC
+    response.call_on_close(streams.release)
+    return response
+
+
+@app.get('/poll_events')
+def poll_events():
+    """Long-poll вариант /events: ждет изменений после since не дольше timeout секунд"""
+    user, error = _check_user(request.args, None)
+    if error:
+        return error
+    hub = ws_push.get_hub()
+    cursor = _push_since()
+    timeout = min(request.args.get('timeout', 25.0, type=float), MAX_POLL_TIMEOUT_SEC)
+    deadline = time.monotonic() + timeout
+    all_orders = ws_permissions.has_permission(user.role, ws_permissions.Permission.QUERY_ORDER)
+    streams = _acquire_stream()
+    if streams is None:
+        return _too_many_streams()
+    try:
+        while True:
+            events, last = hub.wait(cursor, max(0.0, deadline - time.monotonic()))
+            if events is None:
+                return jsonify({'reset': True, 'events': [], 'last_seq': last})
+            visible = ws_push.group_by_month(events, user.id, all_orders)
+            cursor = last
+            if visible or not events or time.monotonic() >= deadline:
+                # чужие изменения не будят клиента, ждем дальше
+                return jsonify({'reset': False, 'events': visible, 'last_seq': cursor})
+    finally:
+        streams.release()
+
+
+MAX_AUTOFILL_WAIT_SEC = 60.0
+MAX_AUTOFILL_RUNS = 64
+MAX_AUTOFILL_TIME_BUDGET_SEC = 60.0
 
 
 @app.post("/autifill")
 def autifill():
+    """
+    Ставит автозаполнение месяца в очередь и возвращает job_id, результат - через /autifill_status.
+    Повторный такой же запрос, пока задача не завершилась, получает ту же задачу;
+    другой запрос на тот же месяц - 409, пока первая задача не закончится.
+    wait - сколько секунд подождать завершения прямо в этом запросе.
+    """
     if not request.is_json:
         return {"error": "Request must be JSON"}, 415  # Unsupported Media Type
     form = request.get_json()
@@ -274,31 +605,120 @@ def autifill():
         return error
     try:
         date = ws_utils.parse_date(form['date'])
-    except ValueError:
+        params = {'profile': bool(form.get('profile', False))}  # отчет AlgProfile в результате
+        if 'runs' in form:  # лучший из нескольких запусков
+            params['runs'] = int(form['runs'])
+            params['time_budget'] = float(form.get('time_budget', 5.0))
+        else:  # без seed он выбирается случайно при запуске
+            params['seed'] = int(form['seed']) if 'seed' in form else None
+        wait = min(float(form.get('wait', 0)), MAX_AUTOFILL_WAIT_SEC)
+    except (ValueError, KeyError, TypeError):
         return jsonify({"error": "Invalid json fields"}), 400  # Bad Request
+    if 'runs' in params and not (1 <= params['runs'] <= MAX_AUTOFILL_RUNS
+                                 and 0 < params['time_budget'] <= MAX_AUTOFILL_TIME_BUDGET_SEC):
+        return jsonify({"error": f"runs must be in 1..{MAX_AUTOFILL_RUNS},"
+                                 f" time_budget in (0, {MAX_AUTOFILL_TIME_BUDGET_SEC}]"}), 400  # Bad Request
 
-    alg = work_scheduler.DistributionAlg(date)
-    print(alg.start, alg.cur, alg.end)
-    alg.prepare()
-    alg.run()
+    job, created = ws_jobs.submit(date, params, user.id)
+    if not created and (job.cur != date or job.params != params):
+        return jsonify({**_job_data(job), 'error': 'Autofill for this month is already in progress'}), 409  # Conflict
+    if wait > 0:
+        job = ws_jobs.wait(job.id, wait)
+    return jsonify({**_job_data(job), 'coalesced': not created}), 200 if job.is_finished else 202  # Accepted
 
-    # check alg errors
-    for day in ws_utils.daterange(alg.cur, alg.end):
-        err = alg.error_all_day.get(day.day)
-        if err:
-            print(f'  err {day} {err}')
-            return jsonify({"error": f"{day} {err}"}), 400  # Bad Request
 
+@app.post("/autifill_status")
+def autifill_status():
+    if not request.is_json:
+        return {"error": "Request must be JSON"}, 415  # Unsupported Media Type
+    form = request.get_json()
+    user, error = _check_user(form, ws_permissions.Permission.MODIFY_ORDER)
+    if error:
+        return error
+    try:
+        job_id = int(form['job_id'])
+        wait = min(float(form.get('wait', 0)), MAX_AUTOFILL_WAIT_SEC)
+    except (ValueError, KeyError, TypeError):
+        return jsonify({"error": "Invalid json fields"}), 400  # Bad Request
+    job = ws_jobs.wait(job_id, wait) if wait > 0 else ws_job.get_job(job_id)
+    if job is None:
+        return jsonify({'error': 'Job is not found'}), 404  # Not Found
+    return jsonify(_job_data(job))
+
+
+def _job_data(job: ws_job.JobRow) -> dict:
+    return {
+        'job_id': job.id,
+        'date': str(job.cur),
+        'status': job.status,
+        'progress': job.progress,
+        'result': job.result,
+        'error': job.error,
+    }
+
+
+def _transfer_format(mimetype: str or None) -> str or None:
+    fmt = request.args.get('format')
+    if fmt is None:
+        for name, type_ in ws_transfer.MIMETYPES.items():
+            if mimetype == type_:
+                return name
+        return ws_transfer.CSV
+    return fmt if fmt in ws_transfer.FORMATS else None
+
+
+@app.get('/export')
+def export():
+    """
+    Выгрузка заказов, пожеланий и праздников за [from, to) в csv (по умолчанию) или ndjson.
+    Ответ отдается потоком, файл за любой период не собирается в памяти.
+    """
+    user, error = _check_user(request.args, ws_permissions.Permission.QUERY_ORDER)
+    if error:
+        return error
+    try:
+        fr = ws_utils.parse_date(request.args['from'])
+        to = ws_utils.parse_date(request.args['to'])
+        kinds = request.args.get('kinds', ','.join(ws_transfer.KINDS)).split(',')
+    except (ValueError, KeyError):
+        return jsonify({"error": "Invalid query fields"}), 400  # Bad Request
+    fmt = _transfer_format(request.accept_mimetypes.best_match(list(ws_transfer.MIMETYPES.values())))
+    if fmt is None or not set(kinds).issubset(ws_transfer.KINDS):
+        return jsonify({"error": "Invalid query fields"}), 400  # Bad Request
+    if not fr < to:
+        return jsonify({"error": "Invalid date range"}), 400  # Bad Request
+    response = Response(stream_with_context(ws_transfer.export(fr, to, fmt, kinds)),
+                        mimetype=ws_transfer.MIMETYPES[fmt])
+    response.headers['Content-Disposition'] = f'attachment; filename="schedule_{fr}_{to}.{fmt}"'
+    return response
+
+
+@app.post('/import')
+def import_():
+    """
+    Загрузка файла выгрузки (тело запроса, csv или ndjson по Content-Type или format), token - в параметрах.
+    Файл читается потоком и применяется кусками по ws_transfer.IMPORT_CHUNK_SIZE строк.
+    """
+    user, error = _check_user(request.args, ws_permissions.Permission.MODIFY_ORDER)
+    if error:
+        return error
+    fmt = _transfer_format(request.mimetype)
+    if fmt is None:
+        return jsonify({"error": "Invalid query fields"}), 400  # Bad Request
+    lines = io.TextIOWrapper(request.stream, encoding='utf-8-sig', newline='')
+    counts = dict.fromkeys(ws_transfer.KINDS, 0)
 
-    # alg is successfull
-    for day in ws_utils.daterange(alg.cur, alg.end):
-        user, reasons = alg.make_all_day.get(day.day)  # type: work_scheduler.UserMonthWork, list[str]
-        ws_order.set_order(day, user.row.id, ws_order.Order.ALL_DAY, str(reasons))
-        for user, reasons in alg.make_work8h.get(day.day, []):
-            ws_order.set_order(day, user.row.id, ws_order.Order.WORK, str(reasons))
+    def on_progress(progress: dict):
+        counts.update(progress)
+        print(f"import {sum(progress.values())} rows")
 
-    orders = ws_order.get_orders_between(alg.start, alg.end)
-    return build_orders_data(orders)
+    try:
+        ws_transfer.import_rows(ws_transfer.parse(lines, fmt), on_progress=on_progress)
+    except (ValueError, UnicodeDecodeError) as e:
+        return jsonify({'error': str(e), 'imported': counts}), 400  # Bad Request
+    finally:
+        ws_push.notify()
+    return jsonify({'imported': counts})
 
 
 @app.post("/get_orders")
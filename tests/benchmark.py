@@ -0,0 +1,235 @@
+"""
+Замеры скорости планировщика и DAO на синтетических командах.
+База создается во временной папке, данные рабочей базы не трогаются.
+
+    python tests/benchmark.py --sizes 10 60 500 --out bench.json
+    python tests/benchmark.py --compare bench_old.json bench.json
+"""
+import argparse
+import contextlib
+import io
+import json
+import pathlib
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import date, timedelta
+
+ROOT = pathlib.Path(__file__).parent.parent
+sys.path.insert(0, str(ROOT))
+sys.path.insert(0, str(ROOT / 'tests'))
+
+from dateutil.relativedelta import relativedelta
+
+from database import ws_db
+from fake_users import fake_users
+
+MONTH = date(2024, 5, 1)
+CUR = date(2024, 5, 10)  # автозаполнение с середины месяца
+SEED = 1
+
+
+def _use_db(path: pathlib.Path):
+    from rest_server import ws_server
+    ws_db.db_file = path
+    ws_server.reset_caches()  # календарь, токены и ответы прежней базы
+
+
+def _fill_team(size: int) -> int:
+    """Создает size пользователей с пожеланиями, праздниками и заказами до CUR, возвращает id админа"""
+    from database import ws_user, ws_permissions, ws_desire, ws_holiday, ws_order
+    rnd = random.Random(SEED)
+    admin_id = ws_user.add_user('admin', 'admin', ws_permissions.Role.ADMIN, 'Админ', 'Админов')
+    user_ids = []
+    for i in range(size):
+        login, password, first_name, last_name, fathers_name = fake_users[i % len(fake_users)]
+        user_ids.append(ws_user.add_user(
+            f'{login}_{i}', password, ws_permissions.Role.USER,
+            first_name=first_name, last_name=last_name, fathers_name=fathers_name
+        ))
+    end = MONTH + relativedelta(months=1)
+    days_in_month = (end - MONTH).days
+    for user_id in user_ids:
+        for i in range(7):
+            day = MONTH + timedelta(days=rnd.randint(0, days_in_month - 1))
+            ws_desire.set_desire(day, user_id, rnd.choice(list(ws_desire.Desire)))
+    ws_holiday.set_holiday(date(2024, 5, 1))
+    ws_holiday.set_holiday(date(2024, 5, 4), is_work_day=True)
+    ws_holiday.set_holiday(date(2024, 5, 9))
+    ws_holiday.set_holiday(date(2024, 5, 10))
+    rows = []
+    day = MONTH
+    while day < CUR:
+        staff = rnd.sample(user_ids, min(len(user_ids), size // 3 + 1))
+        rows.append((day, staff[0], ws_order.Order.ALL_DAY, 'bench'))
+        for user_id in staff[1:]:
+            rows.append((day, user_id, ws_order.Order.WORK, 'bench'))
+        day += timedelta(days=1)
+    ws_order.set_orders_bulk(rows)
+    return admin_id
+
+
+def _clear_autofill():
+    with ws_db.get_db_connection() as connection:
+        connection.execute("DELETE FROM orders WHERE date >= ?", (CUR,))
+        connection.commit()
+
+
+def _set_orders_threaded(day: date, threads: int, per_thread: int):
+    """Параллельные set_order одного дня из нескольких потоков, спорят за ALL_DAY"""
+    from database import ws_order
+
+    def worker(user_id):
+        for i in range(per_thread):
+            ws_order.set_order(day, user_id, ws_order.Order.ALL_DAY if i % 2 else ws_order.Order.WORK, 'bench')
+        ws_db.close_db_connection()
+    workers = [threading.Thread(target=worker, args=(user_id,)) for user_id in range(1, threads + 1)]
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+
+
+def _measure(fn, repeat: int, setup=None) -> dict:
+    times = []
+    for i in range(repeat):
+        if setup is not None:
+            setup()
+        t0 = time.perf_counter()
+        fn()
+        times.append((time.perf_counter() - t0) * 1000)
+    return {
+        'repeat': repeat,
+        'min_ms': round(min(times), 3),
+        'median_ms': round(statistics.median(times), 3),
+        'max_ms': round(max(times), 3),
+    }
+
+
+def bench_size(size: int, repeat: int) -> dict:
+    import work_scheduler
+    from database import ws_order, ws_desire, ws_session
+    from rest_server import ws_server
+
+    admin_id = _fill_team(size)
+    end = MONTH + relativedelta(months=1)
+    out = {}
+
+    # планировщик
+    out['snapshot'] = _measure(lambda: work_scheduler.MonthSnapshot(CUR), repeat)
+    snapshot = work_scheduler.MonthSnapshot(CUR)
+    algs = []
+
+    def make_alg():
+        algs.append(work_scheduler.DistributionAlg(CUR, snapshot, rng=random.Random(SEED)))
+
+    def prepare():
+        algs[-1].prepare()
+    out['prepare'] = _measure(prepare, repeat, setup=make_alg)
+
+    def make_prepared_alg():
+        make_alg()
+        algs[-1].prepare()
+
+    def run():
+        algs[-1].run()
+    out['run'] = _measure(run, repeat, setup=make_prepared_alg)
+
+    # DAO
+    out['get_orders_between'] = _measure(lambda: ws_order.get_orders_between(MONTH, end), repeat)
+    out['get_desires_between'] = _measure(lambda: ws_desire.get_desires_between(MONTH, end), repeat)
+    out['get_orders_all'] = _measure(ws_order.get_orders_all, repeat)
+    out['get_desires_all'] = _measure(ws_desire.get_desires_all, repeat)
+    out['set_order_threads'] = _measure(lambda: _set_orders_threaded(CUR, 8, 25), repeat, setup=_clear_autofill)
+    _clear_autofill()
+
+    # REST
+    client = ws_server.app.test_client()
+    token = ws_session.start_user_session(admin_id)
+
+    def post(path, headers=None, **form):
+        r = client.post(path, json={'token': token, **form}, headers=headers)
+        assert r.status_code == 200, r.get_data(as_text=True)
+
+    out['http_get_month_data'] = _measure(lambda: post('/get_month_data', date=str(CUR)), repeat)
+    columnar = {'Accept': 'application/vnd.ws.columnar+json', 'Accept-Encoding': 'gzip'}
+    out['http_get_month_data_columnar'] = _measure(
+        lambda: post('/get_month_data', headers=columnar, date=str(CUR)), repeat)
+    out['http_get_desire_data'] = _measure(lambda: post('/get_desire_data', date=str(CUR)), repeat)
+    out['http_autifill'] = _measure(lambda: post('/autifill', date=str(CUR), seed=SEED, wait=60), repeat,
+                                    setup=_clear_autofill)
+    return out
+
+
+def profile_size() -> dict:
+    """Отчет AlgProfile для текущей базы: где тратится время и как сужаются кандидаты"""
+    import work_scheduler
+    alg = work_scheduler.DistributionAlg(CUR, rng=random.Random(SEED), profile=True)
+    alg.prepare()
+    alg.run()
+    return alg.profile.to_json()
+
+
+def _git_revision() -> str or None:
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(sizes: list[int], repeat: int) -> dict:
+    results = {
+        'revision': _git_revision(),
+        'python': sys.version.split()[0],
+        'sizes': {},
+        'profiles': {},
+    }
+    db_file = ws_db.db_file
+    with tempfile.TemporaryDirectory() as tmp:
+        try:
+            for size in sizes:
+                _use_db(pathlib.Path(tmp) / f'bench_{size}.db')
+                ws_db.initial()
+                with contextlib.redirect_stdout(io.StringIO()):  # отладочные print в обработчиках
+                    results['sizes'][str(size)] = bench_size(size, repeat)
+                    results['profiles'][str(size)] = profile_size()
+        finally:
+            _use_db(db_file)
+    return results
+
+
+def compare(old: dict, new: dict):
+    print(f"{'case':<28}{'size':>6}{'old ms':>12}{'new ms':>12}{'ratio':>8}")
+    for size, cases in new['sizes'].items():
+        for name, stats in cases.items():
+            old_stats = old['sizes'].get(size, {}).get(name)
+            if old_stats is None:
+                continue
+            ratio = stats['median_ms'] / old_stats['median_ms'] if old_stats['median_ms'] else float('inf')
+            print(f"{name:<28}{size:>6}{old_stats['median_ms']:>12.3f}{stats['median_ms']:>12.3f}{ratio:>8.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10, 60, 500])
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--out', type=pathlib.Path, help='куда сохранить результаты в json')
+    parser.add_argument('--compare', type=pathlib.Path, nargs=2, metavar=('OLD', 'NEW'))
+    args = parser.parse_args()
+    if args.compare:
+        old, new = (json.loads(path.read_text()) for path in args.compare)
+        compare(old, new)
+        return
+    results = run(args.sizes, args.repeat)
+    text = json.dumps(results, indent=2, ensure_ascii=False)
+    if args.out:
+        args.out.write_text(text)
+    print(text)
+
+
+if __name__ == '__main__':
+    main()
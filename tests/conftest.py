@@ -0,0 +1,13 @@
+import pytest
+
+from database import ws_db
+from rest_server import ws_server
+
+
+@pytest.fixture(autouse=True)
+def temp_db(tmp_path, monkeypatch):
+    """Каждый тест работает со своей пустой базой, database/work_scheduler.db не трогается"""
+    monkeypatch.setattr(ws_db, 'db_file', tmp_path / 'work_scheduler.db')
+    ws_server.reset_caches()
+    yield ws_db.db_file
+    ws_server.reset_caches()
@@ -0,0 +1,65 @@
+from database import ws_auth, ws_user, ws_permissions, ws_session, ws_version, ws_db
+
+
+def _make_user(user_id, role=ws_permissions.Role.USER) -> ws_user.UserRow:
+    return ws_user.UserRow({
+        'id': user_id, 'login': f'user{user_id}', 'password': '0000', 'role': role.name,
+        'first_name': 'Имя', 'last_name': 'Фамилия', 'fathers_name': None, 'created_at': None,
+    })
+
+
+class TestAuthCache:
+
+    def setup_method(self):
+        ws_auth.clear()
+
+    def test_hit_miss(self):
+        stats = ws_auth.get_stats()
+        assert ws_auth.get('token1') is None
+        ws_auth.put('token1', _make_user(1, ws_permissions.Role.ADMIN))
+        entry = ws_auth.get('token1')
+        assert entry.user_id == 1
+        assert ws_permissions.Permission.MODIFY_ORDER in entry.permissions
+        new_stats = ws_auth.get_stats()
+        assert new_stats['hits'] == stats['hits'] + 1
+        assert new_stats['misses'] == stats['misses'] + 1
+
+    def test_invalidate_user(self):
+        ws_auth.put('token1', _make_user(1))
+        ws_auth.put('token2', _make_user(1))
+        ws_auth.put('token3', _make_user(2))
+        ws_auth.invalidate_user(1)
+        assert ws_auth.get('token1') is None
+        assert ws_auth.get('token2') is None
+        assert ws_auth.get('token3') is not None
+
+    def test_ttl(self, monkeypatch):
+        monkeypatch.setattr(ws_auth, 'TTL_SEC', -1)
+        ws_auth.put('token1', _make_user(1))
+        assert ws_auth.get('token1') is None
+
+    def test_lru_eviction(self, monkeypatch):
+        monkeypatch.setattr(ws_auth, 'MAX_SIZE', 2)
+        ws_auth.put('token1', _make_user(1))
+        ws_auth.put('token2', _make_user(2))
+        ws_auth.get('token1')
+        ws_auth.put('token3', _make_user(3))
+        assert ws_auth.get('token2') is None
+        assert ws_auth.get('token1') is not None
+
+    def test_revoke_in_other_process(self, monkeypatch):
+        monkeypatch.setattr(ws_version, 'CACHE_CHECK_SEC', 0)
+        ws_auth.put('token1', _make_user(1))
+        # другой процесс сервера отзывает сессию: его invalidate_token сюда не доходит, версия - через базу
+        with ws_db.get_db_connection() as connection:
+            ws_version.bump_cache(connection, ws_version.AUTH)
+            connection.commit()
+        assert ws_auth.get('token1') is None
+
+    def test_revoke_session_bumps_version(self):
+        user_id = ws_user.add_user('auth_user', '0000', ws_permissions.Role.USER, 'Имя', 'Фамилия')
+        token = ws_session.start_user_session(user_id)
+        version = ws_version.get_cache_version(ws_version.AUTH)
+        assert ws_session.revoke_session(token)
+        assert ws_user.delete_user(user_id)
+        assert ws_version.get_cache_version(ws_version.AUTH) == version + 2
@@ -0,0 +1,11 @@
+import benchmark
+from database import ws_db
+
+
+class TestBenchmark:
+
+    def test_smoke(self):
+        db_file = ws_db.db_file
+        results = benchmark.run([3], repeat=1)
+        assert ws_db.db_file == db_file
+        assert results['sizes']['3']['run']['repeat'] == 1
@@ -0,0 +1,48 @@
+from datetime import date
+
+from database import ws_changes, ws_order, ws_desire, ws_db, ws_version
+
+
+class TestChanges:
+
+    day = date(2100, 3, 1)
+
+    def test_log(self):
+        first, last = ws_changes.get_seq_range()
+        ws_order.set_order(self.day, 1, ws_order.Order.ALL_DAY, "a")
+        ws_order.set_order(self.day, 2, ws_order.Order.ALL_DAY, "b")  # снимает ALL_DAY с первого
+        ws_desire.set_desire(self.day, 1, ws_desire.Desire.REST)
+        ws_order.set_order(self.day, 3, None)  # удалять нечего, в журнал не попадает
+        rows = ws_changes.get_changes(last, 100, user_id=1, all_orders=True)
+        assert [(row.kind, row.user_id, row.value_id) for row in rows] == [
+            (ws_changes.ORDER, 1, ws_order.Order.ALL_DAY),
+            (ws_changes.ORDER, 1, None),
+            (ws_changes.ORDER, 2, ws_order.Order.ALL_DAY),
+            (ws_changes.DESIRE, 1, ws_desire.Desire.REST),
+        ]
+        assert [row.seq for row in rows] == list(range(last + 1, last + 5))
+        own = ws_changes.get_changes(last, 100, user_id=1, all_orders=False)
+        assert [row.user_id for row in own] == [1, 1, 1]
+
+    def test_same_order_not_logged(self):
+        ws_order.set_order(self.day, 1, ws_order.Order.WORK, "a")
+        first, last = ws_changes.get_seq_range()
+        version = ws_version.get_month_version(self.day)
+        ws_order.set_order(self.day, 1, ws_order.Order.WORK, "a")
+        assert ws_changes.get_seq_range()[1] == last
+        assert ws_version.get_month_version(self.day) == version
+        ws_order.set_order(self.day, 1, ws_order.Order.WORK, "b")  # поменялся только комментарий
+        assert ws_changes.get_seq_range()[1] == last + 1
+        assert ws_version.get_month_version(self.day) > version
+        assert ws_order.get_order(self.day, 1).comment == "b"
+
+    def test_compact(self):
+        ws_order.set_orders_bulk([(self.day, 1, ws_order.Order.WORK, ""), (self.day, 2, ws_order.Order.WORK, "")])
+        first, last = ws_changes.get_seq_range()
+        with ws_db.get_db_connection() as connection:
+            connection.execute("UPDATE changes SET created_at = 0 WHERE seq = ?", (last - 1,))
+            connection.commit()
+        assert ws_changes.compact() >= 1
+        rows = ws_changes.get_changes(last - 2, 100, user_id=1, all_orders=True)
+        assert [row.seq for row in rows] == [last]
+        assert ws_changes.get_seq_range()[1] == last
@@ -0,0 +1,62 @@
+import threading
+
+from database import ws_db
+
+
+class TestDb:
+
+    def test_connection_reused(self):
+        conn = ws_db.get_db_connection()
+        stats = ws_db.get_pool_stats()
+        assert ws_db.get_db_connection() is conn
+        assert ws_db.get_pool_stats()['reused'] == stats['reused'] + 1
+
+    def test_connection_per_thread(self):
+        conn = ws_db.get_db_connection()
+        other = []
+        thread = threading.Thread(target=lambda: other.append(ws_db.get_db_connection()))
+        thread.start()
+        thread.join()
+        assert other[0] is not conn
+
+    def test_pragmas(self):
+        conn = ws_db.get_db_connection()
+        assert conn.execute('PRAGMA journal_mode').fetchone()[0] == 'wal'
+        assert conn.execute('PRAGMA synchronous').fetchone()[0] == 1  # NORMAL
+        assert conn.execute('PRAGMA busy_timeout').fetchone()[0] == ws_db.BUSY_TIMEOUT_MS
+
+    def test_close_all(self):
+        conn = ws_db.get_db_connection()
+        ws_db.close_all_connections()
+        assert ws_db.get_db_connection() is not conn
+
+    def test_transaction_rollback(self):
+        day = '2100-01-01'
+        try:
+            with ws_db.transaction(immediate=True) as conn:
+                with ws_db.get_db_connection() as inner:
+                    inner.execute("INSERT INTO holidays (date, is_work_day) VALUES (?, 1)", (day,))
+                    inner.commit()  # откладывается до внешнего блока
+                raise RuntimeError()
+        except RuntimeError:
+            pass
+        row = ws_db.get_db_connection().execute("SELECT * FROM holidays WHERE date = ?", (day,)).fetchone()
+        assert row is None
+
+    def test_executemany_counted_once(self):
+        conn = ws_db.get_db_connection()  # схема создается до начала подсчета
+        stats = ws_db.begin_query_stats()
+        try:
+            with conn:
+                conn.executemany("INSERT INTO holidays (date, is_work_day) VALUES (?, 1)",
+                                 [(73000 + day,) for day in range(20)])
+                conn.cursor().executemany("DELETE FROM holidays WHERE date = ?", [(73000 + day,) for day in range(20)])
+                conn.commit()
+        finally:
+            ws_db.end_query_stats()
+        assert stats.by_sql == {
+            'INSERT INTO holidays (date, is_work_day) VALUES (?, ?)': 1,
+            'DELETE FROM holidays WHERE date = ?': 1,
+            'COMMIT': 1,
+        }
+        assert stats.statements == 3
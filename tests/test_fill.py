@@ -30,6 +30,7 @@ class TestFill:
             print(user)
 
     def test_fill_desires(self):
+        self.test_fill_users()  # у каждого теста своя пустая база (conftest)
         days_in_month = (self.end - self.start).days
         for user in ws_user.get_users():
             for i in range(7):
@@ -44,6 +45,7 @@ class TestFill:
         ws_holiday.set_holiday(date(2024, 5, 10))
 
     def test_fill_month_orders(self):
+        self.test_fill_users()
         users = [user for user in ws_user.get_users()]
         for day in daterange(self.start, self.cur):
             all_day_user = random.choice(users)  # type: ws_user.UserRow
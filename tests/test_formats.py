@@ -0,0 +1,36 @@
+import gzip
+
+from database import ws_order
+from rest_server import ws_server, ws_formats
+
+
+class TestFormats:
+
+    def test_orders_columnar(self):
+        orders = [
+            ws_order.OrderRow({'date': '2100-01-01', 'user_id': 1, 'order_id': 2, 'comment': 'auto'}),
+            ws_order.OrderRow({'date': '2100-01-02', 'user_id': 2, 'order_id': 1, 'comment': ''}),
+            ws_order.OrderRow({'date': '2100-01-02', 'user_id': 3, 'order_id': 1, 'comment': 'auto'}),
+        ]
+        assert ws_server._orders_columnar(orders) == {
+            'format': 'columnar',
+            'day': [1, 2, 2],
+            'user_id': [1, 2, 3],
+            'order_id': [2, 1, 1],
+            'comment': [0, 1, 0],
+            'comments': ['auto', ''],
+        }
+
+    def test_negotiate(self):
+        with ws_server.app.test_request_context('/', headers={'Accept': '*/*'}):
+            assert ws_formats.negotiate(ws_server.request, True) == ws_formats.JSON_MIMETYPE
+        with ws_server.app.test_request_context('/', headers={'Accept': ws_formats.COLUMNAR_MIMETYPE}):
+            assert ws_formats.negotiate(ws_server.request, True) == ws_formats.COLUMNAR_MIMETYPE
+            assert ws_formats.negotiate(ws_server.request, False) == ws_formats.JSON_MIMETYPE
+
+    def test_compress(self):
+        assert ws_formats.compress(b'{}', True) == (b'{}', None)
+        body = b'[' + b'1,' * ws_formats.GZIP_MIN_SIZE + b'1]'
+        compressed, encoding = ws_formats.compress(body, True)
+        assert encoding == 'gzip' and gzip.decompress(compressed) == body
+        assert ws_formats.compress(body, False) == (body, None)
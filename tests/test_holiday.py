@@ -0,0 +1,52 @@
+from datetime import date
+
+from database import ws_holiday, ws_version, ws_db
+
+
+class TestHoliday:
+
+    day = date(2100, 1, 4)  # понедельник
+
+    def test_weekends(self):
+        assert ws_holiday.is_rest_day(date(2100, 1, 2))
+        assert ws_holiday.is_rest_day(date(2100, 1, 3))
+        assert not ws_holiday.is_rest_day(self.day)
+
+    def test_set_holiday_patches_calendar(self):
+        assert not ws_holiday.is_rest_day(self.day)
+        ws_holiday.set_holiday(self.day)
+        assert ws_holiday.is_rest_day(self.day)
+        ws_holiday.set_holiday(self.day, is_work_day=True)
+        assert not ws_holiday.is_rest_day(self.day)
+        ws_holiday.set_holiday(date(2100, 1, 2), is_work_day=True)
+        ws_holiday.invalidate_calendar()
+        assert not ws_holiday.is_rest_day(date(2100, 1, 2))  # после перечитывания из базы то же самое
+
+    def test_change_in_other_process(self, monkeypatch):
+        monkeypatch.setattr(ws_version, 'CACHE_CHECK_SEC', 0)
+        assert not ws_holiday.is_rest_day(self.day)
+        # другой процесс сервера: меняет базу, но не календарь этого процесса
+        with ws_db.get_db_connection() as connection:
+            connection.execute("INSERT INTO holidays (date, is_work_day) VALUES (?, 0)", (self.day,))
+            ws_version.bump_cache(connection, ws_version.HOLIDAYS)
+            connection.commit()
+        assert ws_holiday.is_rest_day(self.day)
+
+    def test_rest_days_between(self):
+        ws_holiday.set_holiday(date(2100, 12, 31))
+        days = ws_holiday.get_rest_days_between(date(2100, 12, 30), date(2101, 1, 4))
+        assert days == [ws_holiday.to_epoch_days(d) for d in
+                        (date(2100, 12, 31), date(2101, 1, 1), date(2101, 1, 2))]
+
+    def test_work_calendar(self):
+        ws_holiday.set_holiday(self.day)
+        calendar = ws_holiday.get_work_calendar(date(2100, 1, 1), date(2101, 1, 1))
+        assert len(calendar['months']) == 12
+        assert calendar['months'][0]['work_days'] == 20  # 21 будний день минус праздник
+        assert calendar['months'][0]['hours'] == ws_holiday.calc_hours_for_month(date(2100, 1, 15))
+        assert calendar['total']['hours'] == sum(m['hours'] for m in calendar['months'])
+        assert calendar['total']['hours'] == sum(w['hours'] for w in calendar['weeks'])
+        first_week = calendar['weeks'][0]
+        assert (first_week['start'], first_week['end']) == (date(2100, 1, 1), date(2100, 1, 4))
+        assert first_week['work_days'] == 1  # пт 1 января
+        assert calendar['weeks'][1]['work_days'] == 4
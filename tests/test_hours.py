@@ -0,0 +1,83 @@
+from datetime import date
+
+from database import ws_hours, ws_order, ws_holiday, ws_user, ws_permissions, ws_session, ws_db
+from rest_server import ws_server
+
+
+class TestHours:
+
+    jan = date(2100, 1, 1)
+    feb = date(2100, 2, 1)
+
+    def setup_method(self):
+        self.user_id = ws_user.add_user('hours_user', '0000', ws_permissions.Role.USER, 'Имя', 'Фамилия')
+
+    def _hours(self, month: date) -> int or None:
+        rows = [row for row in ws_hours._get_ledger(month.replace(day=28), [self.user_id]) if row.month == month]
+        return rows[0].hours if rows else None
+
+    def test_ledger(self):
+        monday, saturday = date(2100, 1, 4), date(2100, 1, 9)
+        ws_order.set_order(monday, self.user_id, ws_order.Order.WORK)
+        ws_order.set_order(saturday, self.user_id, ws_order.Order.ALL_DAY)
+        assert self._hours(self.jan) == ws_hours.WORK_HOURS + ws_hours.ALL_DAY_REST_HOURS
+        ws_holiday.set_holiday(saturday, is_work_day=True)  # рабочая суббота
+        assert self._hours(self.jan) == ws_hours.WORK_HOURS + ws_hours.ALL_DAY_HOURS
+        ws_order.set_orders_bulk([(monday, self.user_id, ws_order.Order.ALL_DAY, "")])
+        assert self._hours(self.jan) == 2 * ws_hours.ALL_DAY_HOURS
+        assert ws_hours.get_hours_between(self.jan, self.feb) == {self.user_id: 2 * ws_hours.ALL_DAY_HOURS}
+        ws_order.remove_all_day_order(monday)
+        ws_order.remove_all_day_order(saturday)
+        assert self._hours(self.jan) is None
+
+    def test_carry(self):
+        required = ws_holiday.calc_hours_for_month(self.jan)
+        ws_order.set_orders_bulk([(date(2100, 1, day), self.user_id, ws_order.Order.WORK, "") for day in range(1, 32)])
+        ws_order.set_order(date(2100, 2, 1), self.user_id, ws_order.Order.WORK)
+        overtime = 31 * ws_hours.WORK_HOURS - required
+        assert ws_hours.get_carry_hours(self.feb)[self.user_id] == overtime
+        rows = ws_hours.get_report(self.feb, date(2100, 3, 1), [self.user_id])
+        assert rows == [{
+            'user_id': self.user_id,
+            'month': self.feb,
+            'hours': ws_hours.WORK_HOURS,
+            'required_hours': ws_holiday.calc_hours_for_month(self.feb),
+            'carry_hours': overtime,
+            'balance': overtime + ws_hours.WORK_HOURS - ws_holiday.calc_hours_for_month(self.feb),
+        }]
+
+    def test_refresh_set_based(self):
+        user_ids = [self.user_id] + [
+            ws_user.add_user(f'hours_user{i}', '0000', ws_permissions.Role.USER, 'Имя', 'Фамилия') for i in range(10)]
+        orders = [(date(2100, month, 4), user_id, ws_order.Order.WORK, "") for month in (1, 2) for user_id in user_ids]
+        ws_db.get_db_connection()
+        stats = ws_db.begin_query_stats()
+        try:
+            ws_order.set_orders_bulk(orders)
+        finally:
+            ws_db.end_query_stats()
+        # на месяц один DELETE и один INSERT ... SELECT, а не пара на каждого пользователя
+        ledger_sql = [sql for sql in stats.by_sql if 'hours_ledger' in sql]
+        assert sum(stats.by_sql[sql] for sql in ledger_sql) == 4
+        hours = ws_hours.get_hours_between(self.jan, date(2100, 3, 1))
+        assert hours == {user_id: 2 * ws_hours.WORK_HOURS for user_id in user_ids}
+
+    def test_carry_skips_months_without_orders(self):
+        # март пустой: пользователя не было в графике, его норма не становится штрафом
+        ws_order.set_order(date(2100, 1, 4), self.user_id, ws_order.Order.WORK)
+        ws_order.set_order(date(2100, 4, 1), self.user_id, ws_order.Order.WORK)
+        jan_carry = ws_hours.WORK_HOURS - ws_holiday.calc_hours_for_month(self.jan)
+        assert ws_hours.get_carry_hours(date(2100, 4, 1))[self.user_id] == jan_carry
+        rows = ws_hours.get_report(self.jan, date(2100, 5, 1), [self.user_id])
+        assert [(row['month'], row['carry_hours']) for row in rows] == [
+            (self.jan, 0), (date(2100, 4, 1), jan_carry)]
+
+    def test_report_own_only(self):
+        ws_order.set_order(date(2100, 1, 4), self.user_id, ws_order.Order.WORK)
+        token = ws_session.start_user_session(self.user_id)
+        client = ws_server.app.test_client()
+        form = {'token': token, 'from': '2100-01-01', 'to': '2100-02-01'}
+        r = client.post('/hours_report', json=form)
+        assert [(row['user_id'], row['month'], row['hours']) for row in r.get_json()['rows']] == [
+            (self.user_id, '2100-01-01', ws_hours.WORK_HOURS)]
+        assert client.post('/hours_report', json={**form, 'user_ids': [self.user_id + 1]}).status_code == 403
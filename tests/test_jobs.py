@@ -0,0 +1,80 @@
+from datetime import date
+
+from database import ws_job, ws_db, ws_user, ws_permissions, ws_session, ws_order
+from rest_server import ws_server, ws_jobs
+
+
+class TestJobs:
+
+    day = date(2100, 5, 10)
+
+    def test_one_active_job_per_month(self):
+        job, created = ws_job.add_job(self.day, {'seed': 1}, user_id=1)
+        assert created and job.status == ws_job.QUEUED and job.month == date(2100, 5, 1)
+        same, created = ws_job.add_job(date(2100, 5, 20), {'seed': 2}, user_id=1)
+        assert not created and same.id == job.id and same.params == {'seed': 1}
+        ws_job.update_job(job.id, status=ws_job.DONE, progress=1.0, result={'changed': 3})
+        finished = ws_job.get_job(job.id)
+        assert finished.is_finished and finished.result == {'changed': 3}
+        other, created = ws_job.add_job(self.day, {'seed': 2}, user_id=1)
+        assert created and other.id != job.id
+
+    def test_stale_job_releases_month(self):
+        job, _ = ws_job.add_job(self.day, {'seed': 1}, user_id=1)
+        self._make_stale(job.id)
+        new, created = ws_job.add_job(self.day, {'seed': 1}, user_id=1)
+        assert created
+        assert ws_job.get_job(job.id).status == ws_job.FAILED
+
+    def _make_stale(self, job_id: int):
+        with ws_db.get_db_connection() as connection:
+            connection.execute("UPDATE autofill_jobs SET updated_at = 0 WHERE id = ?", (job_id,))
+            connection.commit()
+
+    def test_heartbeat_keeps_job(self):
+        job, _ = ws_job.add_job(self.day, {'seed': 1}, user_id=1)
+        assert ws_job.start_job(job.id)
+        self._make_stale(job.id)
+        assert ws_job.touch_job(job.id)
+        same, created = ws_job.add_job(self.day, {'seed': 2}, user_id=1)
+        assert not created and same.id == job.id
+
+    def test_lost_job_result_dropped(self):
+        job, _ = ws_job.add_job(self.day, {'seed': 1}, user_id=1)
+        assert ws_job.start_job(job.id)
+        self._make_stale(job.id)
+        new, created = ws_job.add_job(self.day, {'seed': 2}, user_id=1)
+        assert created
+        assert not ws_job.touch_job(job.id)
+        assert not ws_job.start_job(job.id)
+        rows = [(self.day, 1, ws_order.Order.WORK, "")]
+        assert ws_db.write_transaction(ws_jobs._apply_result, job.id, rows) is None
+        assert ws_order.get_order(self.day, 1) is None
+        assert ws_job.start_job(new.id)
+        assert ws_db.write_transaction(ws_jobs._apply_result, new.id, rows) == [
+            (self.day, 1, None, ws_order.Order.WORK)]
+
+    def test_autifill_invalid_runs(self):
+        admin_id = ws_user.add_user('jobs_admin', '0000', ws_permissions.Role.ADMIN, 'Имя', 'Фамилия')
+        client = ws_server.app.test_client()
+        form = {'token': ws_session.start_user_session(admin_id), 'date': str(self.day)}
+        for params in ({'runs': 0}, {'runs': -3}, {'runs': ws_server.MAX_AUTOFILL_RUNS + 1},
+                       {'runs': 2, 'time_budget': 0}, {'runs': 2, 'time_budget': 1e9}):
+            assert client.post('/autifill', json={**form, **params}).status_code == 400
+        assert ws_job.add_job(self.day, {'seed': 1}, user_id=admin_id)[1]  # месяц не заняли
+
+    def test_autifill_profile(self):
+        admin_id = ws_user.add_user('jobs_admin', '0000', ws_permissions.Role.ADMIN, 'Имя', 'Фамилия')
+        for i in range(4):
+            ws_user.add_user(f'jobs_user{i}', '0000', ws_permissions.Role.USER, 'Имя', 'Фамилия')
+        client = ws_server.app.test_client()
+        form = {'token': ws_session.start_user_session(admin_id), 'date': str(self.day), 'seed': 7, 'wait': 30}
+        response = client.post('/autifill', json={**form, 'profile': True})
+        assert response.status_code == 200 and response.json['status'] == ws_job.DONE
+        profile = response.json['result']['profile']
+        assert set(profile['phases_ms']) == {'prepare', 'preserve_old_orders', 'run_all_day', 'run_work8h'}
+        assert profile['stages'] and profile['counters']['work8h.iterations'] > 0
+        status = client.post('/autifill_status', json={'token': form['token'], 'job_id': response.json['job_id']})
+        assert status.json['result']['profile'] == profile
+        response = client.post('/autifill', json=form)
+        assert response.status_code == 200 and 'profile' not in response.json['result']
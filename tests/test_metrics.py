@@ -0,0 +1,44 @@
+import json
+
+from rest_server import ws_server, ws_metrics
+
+
+class TestMetrics:
+
+    def setup_method(self):
+        ws_metrics.reset()
+
+    def test_histogram(self):
+        hist = ws_metrics.Histogram((1, 10))
+        for value in (0.5, 1, 5, 50):
+            hist.observe(value)
+        assert hist.counts == [2, 1, 1]
+        assert hist.count == 4
+
+    def test_metrics_endpoint(self):
+        client = ws_server.app.test_client()
+        client.get('/users')
+        client.post('/get_username', json={'token': 'no such token'})
+        text = client.get('/metrics').get_data(as_text=True)
+        assert 'ws_http_responses_total{endpoint="_get_users",method="GET",status="200"} 1' in text
+        assert 'ws_http_responses_total{endpoint="get_username",method="POST",status="401"} 1' in text
+        assert 'ws_db_statements_per_request_count{endpoint="_get_users"} 1' in text
+
+    def test_shared_between_workers(self, tmp_path):
+        # снимок другого рабочего процесса
+        other = {
+            'responses': [[['_get_users', 'GET', 200], 2]],
+            'statements': [[['_get_users'], [[2] + [0] * len(ws_metrics.STATEMENT_BUCKETS), 2.0, 2]]],
+        }
+        (tmp_path / 'worker-1.json').write_text(json.dumps(other))
+        ws_metrics.start_shared(str(tmp_path), 'worker-0')
+        try:
+            client = ws_server.app.test_client()
+            client.get('/users')
+            text = client.get('/metrics').get_data(as_text=True)
+            assert 'ws_http_responses_total{endpoint="_get_users",method="GET",status="200"} 3' in text
+            assert 'ws_db_statements_per_request_count{endpoint="_get_users"} 3' in text
+        finally:
+            ws_metrics.stop_shared()
+        own = json.loads((tmp_path / 'worker-0.json').read_text())
+        assert [['_get_users', 'GET', 200], 1] in own['responses']
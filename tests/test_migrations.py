@@ -0,0 +1,74 @@
+import datetime
+import sqlite3
+
+import pytest
+
+from database import ws_db, ws_order, ws_holiday
+
+# база в том виде, в каком ее создавал schema.sql до версионирования
+LEGACY_SCHEMA = '''
+CREATE TABLE users (id INTEGER PRIMARY KEY AUTOINCREMENT, login TEXT NOT NULL, password TEXT NOT NULL,
+    role TEXT NOT NULL, first_name TEXT NOT NULL, last_name TEXT NOT NULL, fathers_name TEXT,
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP);
+CREATE TABLE sessions (id INTEGER PRIMARY KEY AUTOINCREMENT, token TEXT NOT NULL UNIQUE, user_id INTEGER NOT NULL,
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP);
+CREATE TABLE desires(date DATE NOT NULL, user_id INTEGER NOT NULL, desire_id INTEGER NOT NULL, comment TEXT NOT NULL,
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP, CONSTRAINT desires_date_user_id_unique UNIQUE (date,user_id));
+CREATE TABLE orders(date DATE NOT NULL, user_id INTEGER NOT NULL, order_id INTEGER NOT NULL, comment TEXT NOT NULL,
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP, CONSTRAINT orders_date_user_id_unique UNIQUE (date,user_id));
+CREATE TABLE holidays(date DATE NOT NULL, is_work_day BOOLEAN NOT NULL, CONSTRAINT holidays_date_unique UNIQUE (date));
+INSERT INTO orders (date, user_id, order_id, comment) VALUES
+    ('2100-01-01', 1, 2, 'first'), ('2100-01-01', 2, 2, 'second'), ('2100-01-01', 3, 1, ''), ('2100-01-02', 1, 1, '');
+INSERT INTO holidays (date, is_work_day) VALUES ('2100-01-04', 0);
+'''
+
+
+@pytest.fixture
+def legacy_db(temp_db):
+    # вместо пустой базы из conftest
+    conn = sqlite3.connect(temp_db)
+    conn.executescript(LEGACY_SCHEMA)
+    conn.close()
+    return temp_db
+
+
+class TestMigrations:
+
+    def test_new_db_is_current(self, tmp_path):
+        conn = sqlite3.connect(tmp_path / 'new.db')
+        with open(ws_db.DB_DIR / 'schema.sql') as f:
+            conn.executescript(f.read())
+        assert ws_db.get_schema_version(conn) == ws_db.SCHEMA_VERSION
+        conn.close()
+
+    def test_upgrade_legacy(self, legacy_db):
+        conn = ws_db.get_db_connection()
+        assert ws_db.get_schema_version(conn) == ws_db.SCHEMA_VERSION
+        assert [row[0] for row in conn.execute("SELECT DISTINCT typeof(date) FROM orders")] == ['integer']
+        orders = ws_order.get_orders_between(datetime.date(2100, 1, 1), datetime.date(2100, 1, 3))
+        assert sorted((row.date.day, row.user_id, row.order) for row in orders) == [
+            (1, 2, ws_order.Order.ALL_DAY),  # задвоенный ALL_DAY: остается последний
+            (1, 3, ws_order.Order.WORK),
+            (2, 1, ws_order.Order.WORK),
+        ]
+        assert ws_holiday.is_rest_day(datetime.date(2100, 1, 4))
+        ledger = {(row['user_id'], row['hours']) for row in conn.execute("SELECT * FROM hours_ledger")}
+        assert ledger == {(1, 8), (2, 12), (3, 8)}  # 2100-01-01 - пятница
+        columns = [row['name'] for row in conn.execute('PRAGMA table_info(sessions)')]
+        assert 'expires_at' in columns
+
+    def test_all_day_unique(self, legacy_db):
+        conn = ws_db.get_db_connection()
+        with pytest.raises(sqlite3.IntegrityError):
+            with conn:
+                conn.execute("INSERT INTO orders (date, user_id, order_id, comment) VALUES (?, 3, ?, '')",
+                             (datetime.date(2100, 1, 1), ws_order.Order.ALL_DAY))
+
+    def test_covering_index(self, legacy_db):
+        conn = ws_db.get_db_connection()
+        plan = conn.execute(
+            "EXPLAIN QUERY PLAN SELECT date, user_id, order_id, comment FROM orders"
+            " WHERE `user_id` = ? AND date BETWEEN ? AND ?",
+            (1, datetime.date(2100, 1, 1), datetime.date(2100, 1, 31))
+        ).fetchall()
+        assert 'COVERING INDEX orders_user_id_date' in plan[0][3]
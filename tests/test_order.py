@@ -0,0 +1,125 @@
+import sqlite3
+import threading
+import time
+from datetime import date
+
+import pytest
+
+from database import ws_order, ws_db, ws_user, ws_permissions, ws_session
+from rest_server import ws_server
+
+
+class TestOrder:
+
+    day = date(2100, 1, 1)
+
+    def test_set_orders_bulk(self):
+        ws_order.set_order(self.day, 1, ws_order.Order.ALL_DAY, "old")
+        diff = ws_order.set_orders_bulk([
+            (self.day, 2, ws_order.Order.ALL_DAY, "new"),
+            (self.day, 3, ws_order.Order.WORK, "new"),
+        ])
+        assert diff == [
+            (self.day, 1, ws_order.Order.ALL_DAY, None),
+            (self.day, 2, None, ws_order.Order.ALL_DAY),
+            (self.day, 3, None, ws_order.Order.WORK),
+        ]
+        assert ws_order.get_all_day_order_user_id(self.day) == 2
+        assert ws_order.get_order(self.day, 1) is None
+        assert ws_order.get_order(self.day, 3).order is ws_order.Order.WORK
+
+    def test_set_orders_bulk_unchanged(self):
+        ws_order.set_orders_bulk([(self.day, 2, ws_order.Order.WORK, "")])
+        assert ws_order.set_orders_bulk([(self.day, 2, ws_order.Order.WORK, "")]) == []
+
+    def test_set_orders_bulk_two_all_day(self):
+        with pytest.raises(ValueError):
+            ws_order.set_orders_bulk([
+                (self.day, 2, ws_order.Order.ALL_DAY, ""),
+                (self.day, 3, ws_order.Order.ALL_DAY, ""),
+            ])
+        assert ws_order.get_orders(self.day) == []
+
+    def test_replace_work_orders(self):
+        day2 = date(2100, 1, 2)
+        ws_order.set_orders_bulk([
+            (self.day, 1, ws_order.Order.WORK, ""),
+            (self.day, 2, ws_order.Order.WORK, ""),
+            (self.day, 3, ws_order.Order.ALL_DAY, ""),
+        ])
+        diff = ws_order.replace_work_orders({self.day: [2, 4], day2: [1]})
+        assert sorted(diff) == sorted([
+            (self.day, 1, ws_order.Order.WORK, None),
+            (self.day, 4, None, ws_order.Order.WORK),
+            (day2, 1, None, ws_order.Order.WORK),
+        ])
+        assert ws_order.get_all_day_order_user_id(self.day) == 3
+
+    def test_set_order_all_day_swap(self):
+        ws_order.set_order(self.day, 1, ws_order.Order.ALL_DAY, "a")
+        ws_order.set_order(self.day, 1, ws_order.Order.ALL_DAY, "b")  # только комментарий
+        ws_order.set_order(self.day, 2, ws_order.Order.WORK)
+        ws_order.set_order(self.day, 2, ws_order.Order.ALL_DAY)
+        assert ws_order.get_all_day_order_user_id(self.day) == 2
+        assert ws_order.get_order(self.day, 1) is None
+        assert ws_order.remove_all_day_order(self.day) == 2
+        assert ws_order.remove_all_day_order(self.day) is None
+        assert ws_order.get_orders(self.day) == []
+
+    def test_set_order_http_remove(self):
+        # order_id = -1 - снять назначение, user_id = -1 - снять ALL_DAY на день
+        admin_id = ws_user.add_user('order_admin', '0000', ws_permissions.Role.ADMIN, 'Имя', 'Фамилия')
+        form = {'token': ws_session.start_user_session(admin_id), 'date': '2100-01-01', 'comment': ''}
+        client = ws_server.app.test_client()
+        ws_order.set_order(self.day, admin_id, ws_order.Order.ALL_DAY)
+        assert client.post('/set_order', json={**form, 'user_id': -1, 'order_id': -1}).status_code == 200
+        assert ws_order.get_all_day_order_user_id(self.day) is None
+        ws_order.set_order(self.day, admin_id, ws_order.Order.WORK)
+        assert client.post('/set_order', json={**form, 'user_id': admin_id, 'order_id': -1}).status_code == 200
+        assert ws_order.get_order(self.day, admin_id) is None
+        assert client.post('/set_order', json={**form, 'user_id': admin_id}).status_code == 400
+
+    def test_set_order_concurrent(self):
+        threads, per_thread = 8, 40
+        errors = []
+
+        def worker(user_id):
+            try:
+                for i in range(per_thread):
+                    order = ws_order.Order.ALL_DAY if i % 2 else ws_order.Order.WORK
+                    ws_order.set_order(self.day, user_id, order, f"{user_id}:{i}")
+            except Exception as e:
+                errors.append(e)
+            finally:
+                ws_db.close_db_connection()
+
+        workers = [threading.Thread(target=worker, args=(user_id,)) for user_id in range(1, threads + 1)]
+        t0 = time.perf_counter()
+        for thread in workers:
+            thread.start()
+        for thread in workers:
+            thread.join()
+        elapsed = time.perf_counter() - t0
+        print(f"set_order: {threads * per_thread / elapsed:.0f} ops/s, {threads} threads")
+        assert errors == []
+        orders = ws_order.get_orders(self.day)
+        assert [row.order for row in orders].count(ws_order.Order.ALL_DAY) == 1
+        # последняя запись каждого потока - ALL_DAY, остальные пользователи его потеряли
+        assert len(orders) == 1 and orders[0].comment == f"{orders[0].user_id}:{per_thread - 1}"
+
+    def test_busy_retry(self):
+        conn = ws_db.get_db_connection()
+        conn.execute('PRAGMA busy_timeout=10')
+        blocker = sqlite3.connect(ws_db.db_file, isolation_level=None, check_same_thread=False)
+        try:
+            blocker.execute('BEGIN IMMEDIATE')
+            timer = threading.Timer(0.05, blocker.rollback)
+            timer.start()
+            retries = ws_db.get_pool_stats()['busy_retries']
+            ws_order.set_order(self.day, 1, ws_order.Order.WORK)
+            timer.join()
+            assert ws_db.get_pool_stats()['busy_retries'] > retries
+            assert ws_order.get_order(self.day, 1).order is ws_order.Order.WORK
+        finally:
+            blocker.close()
+            conn.execute(f'PRAGMA busy_timeout={ws_db.BUSY_TIMEOUT_MS}')
@@ -0,0 +1,30 @@
+import threading
+import urllib.request
+
+from rest_server import ws_server, ws_prefork
+
+
+class TestPrefork:
+
+    def test_health(self):
+        client = ws_server.app.test_client()
+        assert client.get('/healthz').status_code == 200
+        assert client.get('/readyz').get_json() == {'status': 'ready'}
+        ws_server.set_draining()
+        try:
+            assert client.get('/readyz').status_code == 503
+            assert client.get('/healthz').status_code == 200
+        finally:
+            ws_server._draining.clear()
+
+    def test_pool_server(self):
+        server = ws_prefork.PoolWSGIServer('127.0.0.1', 0, ws_server.app, threads=2)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.start()
+        try:
+            with urllib.request.urlopen(f'http://127.0.0.1:{server.port}/healthz', timeout=5) as response:
+                assert response.status == 200
+        finally:
+            server.shutdown()
+            thread.join()
+            server.server_close()
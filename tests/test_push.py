@@ -0,0 +1,95 @@
+import threading
+from datetime import date
+
+from database import ws_changes, ws_order, ws_user, ws_permissions, ws_session
+from rest_server import ws_push, ws_server
+
+
+class TestPush:
+
+    day = date(2100, 4, 1)
+
+    def setup_method(self):
+        self.hub = ws_push.PushHub(poll_interval=0.05)
+        self.hub.start()
+
+    def teardown_method(self):
+        self.hub.stop()
+
+    def test_wait_and_filter(self):
+        since = self.hub.last_seq
+        assert self.hub.wait(since, 0.01) == ([], since)
+        ws_order.set_order(self.day, 1, ws_order.Order.WORK)
+        ws_order.set_order(self.day, 2, ws_order.Order.WORK)
+        self.hub.notify()
+        events, last = self.hub.wait(since, 5)
+        assert last > since and events
+        self.hub.poll()  # второе изменение могло не успеть попасть в первую пачку
+        events, last = self.hub.wait(since, 0)
+        assert [(e.kind, e.user_id) for e in events] == [(ws_changes.ORDER, 1), (ws_changes.ORDER, 2)]
+        assert ws_push.group_by_month(events, 1, all_orders=False) == [
+            {'month': '2100-04', 'kinds': [ws_changes.ORDER], 'seq': events[0].seq}]
+        assert ws_push.group_by_month(events, 3, all_orders=False) == []
+        assert ws_push.group_by_month(events, 3, all_orders=True)[0]['seq'] == last
+
+    def test_cursor_ahead_of_hub(self):
+        # курсор из другого процесса: хаб еще не дочитал журнал, reset быть не должно
+        self.hub.stop()
+        ws_order.set_order(self.day, 1, ws_order.Order.WORK)
+        _, last = ws_changes.get_seq_range()
+        assert self.hub.wait(last, 0) == ([], last)
+        assert self.hub.wait(last + 100, 0) == (None, last)  # такого seq в журнале нет
+
+    def test_backfill(self):
+        ws_order.set_order(self.day, 1, ws_order.Order.WORK)
+        ws_order.set_order(self.day, 2, ws_order.Order.WORK)
+        hub = ws_push.PushHub(poll_interval=0.05)
+        hub.start()  # буфер нового хаба начинается после этих изменений
+        try:
+            events, last = hub.wait(0, 0)
+            assert [e.user_id for e in events] == [1, 2] and last == hub.last_seq
+            assert hub.get_stats()['backfills'] == 1
+        finally:
+            hub.stop()
+
+    def test_reset_after_compact(self):
+        ws_order.set_order(self.day, 1, ws_order.Order.WORK)
+        ws_order.set_order(self.day, 2, ws_order.Order.WORK)
+        assert ws_changes.compact(retention_sec=-10) == 2
+        ws_order.set_order(self.day, 3, ws_order.Order.WORK)
+        hub = ws_push.PushHub(poll_interval=0.05)
+        hub.start()
+        try:
+            assert hub.wait(0, 0) == (None, hub.last_seq)
+            assert hub.wait(2, 0)[0][0].user_id == 3
+        finally:
+            hub.stop()
+
+    def test_one_wakeup_for_many_subscribers(self):
+        since = self.hub.last_seq
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(self.hub.wait(since, 5))) for i in range(5)]
+        for thread in threads:
+            thread.start()
+        ws_order.set_order(self.day, 1, ws_order.Order.WORK)
+        self.hub.notify()
+        for thread in threads:
+            thread.join()
+        assert len(results) == 5 and all(events for events, last in results)
+        assert self.hub.get_stats()['wakeups'] == 1
+
+    def test_streams_limit(self):
+        user_id = ws_user.add_user('push_user', '0000', ws_permissions.Role.USER, 'Имя', 'Фамилия')
+        token = ws_session.start_user_session(user_id)
+        client = ws_server.app.test_client()
+        ws_server.set_max_streams(1)
+        try:
+            events = client.get(f'/events?token={token}', buffered=False)
+            assert events.status_code == 200
+            busy = client.get(f'/poll_events?token={token}&timeout=0')
+            assert busy.status_code == 503 and busy.headers['Retry-After']
+            events.close()  # клиент отключился - место освободилось
+            assert client.get(f'/poll_events?token={token}&timeout=0').status_code == 200
+            assert client.get(f'/poll_events?token={token}&timeout=0').status_code == 200
+        finally:
+            ws_server.set_max_streams(ws_server.MAX_STREAMS)
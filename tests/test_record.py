@@ -0,0 +1,34 @@
+import datetime
+
+from database import ws_db, ws_record, ws_order, ws_user, ws_permissions
+from rest_server import ws_server
+
+
+class TestRecord:
+
+    def test_decode(self):
+        with ws_db.get_db_connection() as conn:
+            rows = ws_record.fetch_all(
+                conn, ws_order.OrderRow,
+                "SELECT '2100-01-02' AS date, 3 AS user_id, 2 AS order_id, 'auto' AS comment"
+            )
+            assert ws_record.fetch_one(conn, ws_order.OrderRow, "SELECT 1 AS user_id WHERE 0") is None
+        assert rows == [ws_order.OrderRow({'date': '2100-01-02', 'user_id': 3, 'order_id': 2, 'comment': 'auto'})]
+        row = rows[0]
+        assert row.date == datetime.date(2100, 1, 2)
+        assert row.order is ws_order.Order.ALL_DAY
+        assert not hasattr(row, '__dict__')
+        assert row.to_json() == {'date': '2100-01-02', 'user_id': 3, 'order': 2, 'comment': 'auto'}
+
+    def test_hidden_fields(self):
+        user = ws_user.UserRow({'id': 1, 'login': 'record_user', 'password': 'secret', 'role': 'ADMIN'})
+        assert user.role is ws_permissions.Role.ADMIN
+        assert user.to_json() == {'id': 1, 'login': 'record_user', 'role': 'ADMIN'}
+        assert 'secret' not in repr(user)
+
+    def test_users_without_password(self):
+        user_id = ws_user.add_user('record_user', 'secret', ws_permissions.Role.USER, 'Имя', 'Фамилия')
+        users = ws_server.app.test_client().get('/users').get_json()
+        user = next(u for u in users if u['id'] == user_id)
+        assert user['login'] == 'record_user' and user['role'] == 'USER'
+        assert 'password' not in user
@@ -0,0 +1,166 @@
+import random
+from datetime import date
+
+import pytest
+
+import work_scheduler
+from database import ws_user, ws_desire, ws_permissions, ws_order, ws_holiday
+
+
+def _make_users(count) -> list[work_scheduler.UserMonthWork]:
+    users = []
+    for i in range(count):
+        row = ws_user.UserRow({'id': i + 1, 'first_name': f'user{i + 1}', 'role': 'user'})
+        user = work_scheduler.UserMonthWork(row, i)
+        user.required_hours = 16
+        users.append(user)
+    return users
+
+
+def _fill_month() -> list[int]:
+    """Март 2100 (с понедельника): 8 пользователей, пожелания, уже назначенные заказы и праздник"""
+    ids = [ws_user.add_user(f'alg_user{i}', '0000', ws_permissions.Role.USER, f'user{i}', 'Фамилия')
+           for i in range(8)]
+    ws_desire.set_desires_bulk([
+        (date(2100, 3, 5), ids[0], ws_desire.Desire.ALL_DAY, ''),
+        (date(2100, 3, 6), ids[1], ws_desire.Desire.REST, ''),
+        (date(2100, 3, 9), ids[2], ws_desire.Desire.WORK, ''),
+        (date(2100, 3, 12), ids[3], ws_desire.Desire.REST, ''),
+        (date(2100, 3, 20), ids[4], ws_desire.Desire.ALL_DAY, ''),
+    ])
+    ws_order.set_order(date(2100, 3, 15), ids[5], ws_order.Order.ALL_DAY)
+    ws_order.set_order(date(2100, 3, 16), ids[6], ws_order.Order.WORK)
+    ws_holiday.set_holiday(date(2100, 3, 8))
+    return ids
+
+
+class _LinearScanAlg(work_scheduler.DistributionAlg):
+    """Выбор дня для work8h полным проходом по дням, как до очереди на куче"""
+
+    def _find_less_overload_day(self, ignore_days: set[int]):
+        out = None
+        min_work8h_count = None
+        for day in self.days:
+            if day.day in ignore_days:
+                continue
+            work8h_count = sum(1 for user in self.user_map.values() if user.work8h >> day.day & 1)
+            if min_work8h_count is None or work8h_count < min_work8h_count:
+                min_work8h_count = work8h_count
+                out = day
+        return out
+
+
+class TestMonthBits:
+
+    day = date(2024, 5, 3)
+
+    def test_work8h_candidates(self):
+        users = _make_users(4)
+        bits = work_scheduler.MonthBits(users)
+        users[3].done_hours = 16  # уже все отработал
+        bits.build_index()
+        bits.add_work8h(users[0], self.day.day)
+        bits.add_force_rest(users[1], self.day.day)
+        candidates = work_scheduler._collect_work8h_candidates(bits, bits.all, self.day)
+        assert bits.to_users(candidates) == [users[2]]
+        candidates = work_scheduler._collect_all_day_candidates(bits, bits.all, self.day)
+        assert bits.to_users(candidates) == [users[2], users[3]]
+
+    def test_left_hours_index(self):
+        users = _make_users(3)
+        bits = work_scheduler.MonthBits(users)
+        bits.build_index()
+        old_left_hours = users[0].left_hours
+        users[0].plan_hours += 8
+        bits.update_left_hours(users[0], old_left_hours)
+        assert bits.to_users(work_scheduler._collect_max_left_hours_users(bits, bits.all)) == users[1:]
+        users[1].plan_hours += 16
+        bits.update_left_hours(users[1], 16)
+        assert bits.to_users(work_scheduler._collect_users_with_left_hours(bits, bits.all)) == [users[0], users[2]]
+
+    def test_rest_score(self):
+        users = _make_users(3)
+        bits = work_scheduler.MonthBits(users)
+        users[0].rest_score = 2
+        users[1].rest_score = 2
+        bits.add_desire(users[0], self.day.day, ws_desire.Desire.REST)
+        bits.build_index()
+        candidates = work_scheduler._collect_max_rest_score_users(bits, bits.all, self.day)
+        assert bits.to_users(candidates) == [users[1]]
+
+
+class TestDistribution:
+
+    cur = date(2100, 3, 1)
+    # seed 7 на _fill_month; совпадает с результатом алгоритма до перехода на маски и кучу дней.
+    # A - ALL_DAY, W - WORK, цифра - номер пользователя из _fill_month; 15-го ALL_DAY и 16-го W6 уже были
+    SCHEDULE_SEED_7 = {
+        1: 'A2 W1 W6 W5 W4', 2: 'A4 W1 W7 W5', 3: 'A2 W1 W5 W7', 4: 'A3 W1 W5 W7 W0',
+        5: 'A0 W1 W4 W5 W2', 6: 'A6 W3 W2 W4 W7', 7: 'A5 W3 W7 W4 W0', 8: 'A1 W3 W6 W7 W0',
+        9: 'A0 W2 W6 W4 W5', 10: 'A3 W1 W6 W4 W2', 11: 'A5 W1 W0 W7 W2', 12: 'A6 W1 W7 W4 W2',
+        13: 'A0 W1 W4 W2 W5', 14: 'A3 W1 W6 W5 W4', 15: 'W1 W6 W4 W7', 16: 'A7 W4 W0 W2',
+        17: 'A2 W3 W6 W5 W0', 18: 'A1 W3 W7 W4 W5', 19: 'A4 W3 W6 W7 W0', 20: 'A4 W3 W1 W2 W0',
+        21: 'A7 W3 W2 W5', 22: 'A6 W1 W5 W2 W0', 23: 'A3 W1 W0 W4 W2', 24: 'A5 W1 W6 W7 W0',
+        25: 'A4 W3 W6 W7 W0', 26: 'A1 W3 W6 W2 W7', 27: 'A0 W3 W6 W2 W5', 28: 'A7 W3 W6 W5 W2',
+        29: 'A1 W3 W6 W2 W4', 30: 'A2 W3 W6 W4 W0', 31: 'A7 W3 W6 W5 W0',
+    }
+
+    def test_pinned_schedule(self):
+        ids = _fill_month()
+        result = work_scheduler.run_seed(self.cur, 7)
+        schedule = {}
+        for day, user_id, order, comment in result.rows:
+            kind = 'A' if order is ws_order.Order.ALL_DAY else 'W'
+            schedule.setdefault(day.day, []).append(f'{kind}{ids.index(user_id)}')
+        assert {day: ' '.join(items) for day, items in schedule.items()} == self.SCHEDULE_SEED_7
+        assert result.score.to_json() == {'total': 12, 'errors': 0, 'left_hours_spread': 4, 'all_day_spread': 1,
+                                          'desires': 5, 'desires_honoured': 5}
+
+    def test_day_queue_matches_linear_scan(self):
+        _fill_month()
+        snapshot = work_scheduler.MonthSnapshot(self.cur)
+        for seed in range(10):
+            alg = _LinearScanAlg(self.cur, snapshot, rng=random.Random(seed))
+            alg.prepare()
+            alg.run()
+            assert work_scheduler.run_seed(self.cur, seed, snapshot).rows == alg.get_order_rows()
+
+    def test_profile(self):
+        _fill_month()
+        assert work_scheduler.run_seed(self.cur, 7).profile is None
+        result = work_scheduler.run_seed(self.cur, 7, profile=True)
+        profile = result.profile
+        assert set(profile['phases_ms']) == {'prepare', 'preserve_old_orders', 'run_all_day', 'run_work8h'}
+        assert all(ms >= 0 for ms in profile['phases_ms'].values())
+        candidates = profile['stages']['work8h.candidates']
+        assert candidates['calls'] > 0 and 0 <= candidates['min'] <= candidates['avg'] <= candidates['max'] <= 8
+        assert profile['counters']['work8h.iterations'] >= candidates['calls']
+        # профилирование не меняет результат
+        assert result.rows == work_scheduler.run_seed(self.cur, 7).rows
+
+
+class TestBestOf:
+
+    cur = date(2100, 3, 1)
+
+    def test_run_best_of(self, monkeypatch):
+        _fill_month()
+        seeds = [1, 0, 3]
+        it = iter(seeds)
+        monkeypatch.setattr(work_scheduler.random, 'randrange', lambda n: next(it))
+        progress = []
+        result = work_scheduler.run_best_of(self.cur, runs=3, time_budget=30, workers=2,
+                                            on_progress=lambda done, total: progress.append((done, total)))
+        assert progress == [(1, 3), (2, 3), (3, 3)]
+        # результат воспроизводится по seed и не хуже ни одного из запусков
+        replay = work_scheduler.run_seed(self.cur, result.seed)
+        assert result.rows == replay.rows and result.score.total == replay.score.total
+        scores = {seed: work_scheduler.run_seed(self.cur, seed).score.total for seed in seeds}
+        assert all(result.score.total <= total for total in scores.values())
+        assert result.seed == min(seeds, key=lambda seed: (scores[seed], seed))
+
+    def test_invalid_params(self):
+        with pytest.raises(ValueError):
+            work_scheduler.run_best_of(self.cur, runs=0, time_budget=5)
+        with pytest.raises(ValueError):
+            work_scheduler.run_best_of(self.cur, runs=2, time_budget=0)
@@ -0,0 +1,30 @@
+from database import ws_session, ws_db
+
+
+class TestSession:
+
+    def test_start_find_revoke(self):
+        token = ws_session.start_user_session(1)
+        session = ws_session.find_session_by_token(token)
+        assert session is not None and session.user_id == 1
+        assert ws_session.revoke_session(token)
+        assert ws_session.find_session_by_token(token) is None
+
+    def test_expired_session_sweep(self):
+        token = ws_session.start_user_session(1)
+        with ws_db.get_db_connection() as connection:
+            connection.execute("UPDATE sessions SET expires_at = 0 WHERE `token` = ?", (token,))
+            connection.commit()
+        assert ws_session.find_session_by_token(token) is None
+        assert ws_session.delete_expired_sessions(batch_size=1) >= 1
+        with ws_db.get_db_connection() as connection:
+            row = connection.execute("SELECT * FROM sessions WHERE `token` = ?", (token,)).fetchone()
+        assert row is None
+
+    def test_pagination(self):
+        for i in range(3):
+            ws_session.start_user_session(1)
+        first = ws_session.get_sessions(limit=2)
+        second = ws_session.get_sessions(after_id=first[-1].id, limit=2)
+        assert len(first) == 2
+        assert second and second[0].id > first[-1].id
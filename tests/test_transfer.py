@@ -0,0 +1,101 @@
+import io
+from datetime import date
+
+import pytest
+
+from database import ws_transfer, ws_user, ws_permissions, ws_session, ws_order, ws_desire, ws_holiday
+from rest_server import ws_server
+
+
+class TestTransfer:
+
+    fr = date(2100, 1, 1)
+    to = date(2100, 2, 1)
+
+    def setup_method(self):
+        self.admin_id = ws_user.add_user('transfer_admin', '0000', ws_permissions.Role.ADMIN, 'Имя', 'Фамилия')
+        self.user_id = ws_user.add_user('transfer_user', '0000', ws_permissions.Role.USER, 'Имя', 'Фамилия')
+
+    def _csv(self, *lines) -> io.StringIO:
+        return io.StringIO('\n'.join([','.join(ws_transfer.COLUMNS), *lines]) + '\n')
+
+    def test_roundtrip(self):
+        lines = [
+            f'order,2100-01-04,{self.admin_id},2,"a, b"',
+            f'order,2100-01-04,{self.user_id},1,',
+            f'desire,2100-01-05,{self.user_id},0,отпуск',
+            'holiday,2100-01-06,,0,',
+        ]
+        progress = []
+        counts = ws_transfer.import_rows(ws_transfer.parse(self._csv(*lines), ws_transfer.CSV),
+                                         chunk_size=2, on_progress=progress.append)
+        assert counts == {ws_transfer.ORDER: 2, ws_transfer.DESIRE: 1, ws_transfer.HOLIDAY: 1}
+        assert len(progress) == 2
+        assert ws_order.get_all_day_order_user_id(date(2100, 1, 4)) == self.admin_id
+        assert ws_desire.get_desire(date(2100, 1, 5), self.user_id).comment == 'отпуск'
+        assert ws_holiday.is_rest_day(date(2100, 1, 6))
+        exported = ''.join(ws_transfer.export(self.fr, self.to))
+        assert exported.splitlines() == [','.join(ws_transfer.COLUMNS)] + lines
+        ndjson = ''.join(ws_transfer.export(self.fr, self.to, ws_transfer.NDJSON, [ws_transfer.ORDER]))
+        rows = list(ws_transfer.parse(io.StringIO(ndjson), ws_transfer.NDJSON))
+        assert [row[:4] for row in rows] == [
+            (ws_transfer.ORDER, date(2100, 1, 4), self.admin_id, ws_order.Order.ALL_DAY),
+            (ws_transfer.ORDER, date(2100, 1, 4), self.user_id, ws_order.Order.WORK),
+        ]
+
+    def test_duplicate_all_day(self):
+        # как два set_order подряд: второй ALL_DAY снимает первый, а не ломает загрузку
+        lines = [
+            f'order,2100-01-04,{self.admin_id},2,',
+            f'order,2100-01-04,{self.user_id},2,',
+            f'order,2100-01-05,{self.user_id},2,',
+            f'order,2100-01-05,{self.user_id},1,',
+            f'order,2100-01-05,{self.admin_id},2,',
+        ]
+        counts = ws_transfer.import_rows(ws_transfer.parse(self._csv(*lines), ws_transfer.CSV))
+        assert counts[ws_transfer.ORDER] == 5
+        assert ws_order.get_all_day_order_user_id(date(2100, 1, 4)) == self.user_id
+        assert ws_order.get_all_day_order_user_id(date(2100, 1, 5)) == self.admin_id
+        exported = ''.join(ws_transfer.export(self.fr, self.to, kinds=[ws_transfer.ORDER]))
+        assert exported.splitlines()[1:] == [
+            f'order,2100-01-04,{self.user_id},2,',
+            f'order,2100-01-05,{self.admin_id},2,',
+            f'order,2100-01-05,{self.user_id},1,',
+        ]
+
+    def test_set_then_clear(self):
+        # очистка позже в том же куске отменяет установку
+        lines = [
+            f'desire,2100-01-05,{self.user_id},0,отпуск',
+            f'desire,2100-01-05,{self.user_id},,',
+            'holiday,2100-01-06,,0,',
+            'holiday,2100-01-06,,,',
+            f'desire,2100-01-07,{self.user_id},,',
+            f'desire,2100-01-07,{self.user_id},0,',
+        ]
+        counts = ws_transfer.import_rows(ws_transfer.parse(self._csv(*lines), ws_transfer.CSV))
+        assert counts[ws_transfer.DESIRE] == 4 and counts[ws_transfer.HOLIDAY] == 2
+        assert ws_desire.get_desire(date(2100, 1, 5), self.user_id) is None
+        assert not ws_holiday.is_rest_day(date(2100, 1, 6))
+        assert ws_desire.get_desire(date(2100, 1, 7), self.user_id) is not None
+        exported = ''.join(ws_transfer.export(self.fr, self.to, kinds=[ws_transfer.DESIRE, ws_transfer.HOLIDAY]))
+        assert exported.splitlines()[1:] == [f'desire,2100-01-07,{self.user_id},0,']
+
+    def test_invalid(self):
+        with pytest.raises(ValueError, match='line 2'):
+            ws_transfer.import_rows(ws_transfer.parse(self._csv('order,2100-01-04,,1,'), ws_transfer.CSV))
+        with pytest.raises(ValueError, match='unknown user ids'):
+            ws_transfer.import_rows(ws_transfer.parse(self._csv('order,2100-01-04,-5,1,'), ws_transfer.CSV))
+
+    def test_http(self):
+        token = ws_session.start_user_session(self.admin_id)
+        client = ws_server.app.test_client()
+        body = self._csv(f'order,2100-01-04,{self.user_id},1,').getvalue().encode()
+        r = client.post(f'/import?token={token}', data=body, content_type='text/csv')
+        assert r.status_code == 200 and r.get_json()['imported'][ws_transfer.ORDER] == 1
+        r = client.get(f'/export?token={token}&from=2100-01-01&to=2100-02-01&kinds=order',
+                       headers={'Accept': ws_transfer.MIMETYPES[ws_transfer.NDJSON]})
+        assert r.mimetype == ws_transfer.MIMETYPES[ws_transfer.NDJSON]
+        assert r.is_streamed and len(r.get_data(as_text=True).splitlines()) == 1
+        user_token = ws_session.start_user_session(self.user_id)
+        assert client.get(f'/export?token={user_token}&from=2100-01-01&to=2100-02-01').status_code == 403
@@ -0,0 +1,40 @@
+from datetime import date
+
+from database import ws_version, ws_order, ws_desire, ws_db, ws_session, ws_user, ws_permissions
+from rest_server import ws_server
+
+
+class TestMonthVersion:
+
+    day = date(2100, 2, 10)
+
+    def teardown_method(self):
+        with ws_db.get_db_connection() as connection:
+            connection.execute("DELETE FROM orders WHERE date >= ?", (date(2100, 1, 1),))
+            connection.execute("DELETE FROM desires WHERE date >= ?", (date(2100, 1, 1),))
+            connection.execute("DELETE FROM month_versions WHERE month >= ?", (date(2100, 1, 1),))
+            connection.commit()
+
+    def test_bump(self):
+        version = ws_version.get_month_version(self.day)
+        ws_order.set_order(self.day, 1, ws_order.Order.WORK)
+        ws_desire.set_desire(self.day, 1, ws_desire.Desire.REST)
+        assert ws_version.get_month_version(self.day) == version + 2
+        assert ws_version.get_month_version(date(2100, 3, 1)) == 0
+        ws_order.set_orders_bulk([(self.day, 1, ws_order.Order.WORK, "")])  # ничего не поменялось
+        assert ws_version.get_month_version(self.day) == version + 2
+
+    def test_not_modified(self):
+        client = ws_server.app.test_client()
+        admin_id = ws_user.add_user('version_admin', 'admin', ws_permissions.Role.ADMIN, 'Админ', 'Админов')
+        token = ws_session.start_user_session(admin_id)
+        form = {'token': token, 'date': str(self.day)}
+        first = client.post('/get_month_data', json=form).get_json()
+        assert client.post('/get_month_data', json={**form, 'version': first['version']}).get_json() == {
+            'not_modified': True, 'version': first['version']}
+        ws_order.set_order(self.day, 1, ws_order.Order.WORK)
+        changed = client.post('/get_month_data', json={**form, 'version': first['version']}).get_json()
+        assert changed['version'] == first['version'] + 1
+        assert changed['orders_by_day'] == [{'day': 10, 'orders': [{'user_id': 1, 'order_id': 1, 'comment': ''}]}]
+        ws_session.revoke_session(token)
+        ws_user.delete_user(admin_id)
@@ -0,0 +1,68 @@
+"""
+Выгрузка и загрузка расписаний напрямую в базу (без сервера).
+
+    python transfer.py export --from 2024-01-01 --to 2025-01-01 -o schedule_2024.csv
+    python transfer.py import schedule_2024.csv
+"""
+import argparse
+import pathlib
+import sys
+
+import ws_utils
+from database import ws_transfer
+
+
+def _format(path: pathlib.Path or None, fmt: str or None) -> str:
+    if fmt is not None:
+        return fmt
+    if path is not None and path.suffix.lstrip('.') in ws_transfer.FORMATS:
+        return path.suffix.lstrip('.')
+    return ws_transfer.CSV
+
+
+def export(args):
+    fmt = _format(args.out, args.format)
+    out = open(args.out, 'w', encoding='utf-8', newline='') if args.out else sys.stdout
+    try:
+        for chunk in ws_transfer.export(args.fr, args.to, fmt, args.kinds):
+            out.write(chunk)
+    finally:
+        if args.out:
+            out.close()
+
+
+def import_(args):
+    fmt = _format(args.file, args.format)
+
+    def on_progress(counts: dict):
+        print(f"imported {sum(counts.values())} rows", file=sys.stderr)
+
+    with open(args.file, encoding='utf-8-sig', newline='') as f:
+        counts = ws_transfer.import_rows(ws_transfer.parse(f, fmt), args.chunk_size, on_progress)
+    print(', '.join(f'{kind}: {n}' for kind, n in counts.items()), file=sys.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest='command', required=True)
+    export_parser = commands.add_parser('export')
+    export_parser.add_argument('--from', dest='fr', type=ws_utils.parse_date, required=True)
+    export_parser.add_argument('--to', type=ws_utils.parse_date, required=True, help='не включая')
+    export_parser.add_argument('--kinds', nargs='+', choices=ws_transfer.KINDS, default=ws_transfer.KINDS)
+    export_parser.add_argument('--format', choices=ws_transfer.FORMATS, help='по умолчанию - по расширению файла')
+    export_parser.add_argument('-o', '--out', type=pathlib.Path, help='по умолчанию - stdout')
+    export_parser.set_defaults(run=export)
+    import_parser = commands.add_parser('import')
+    import_parser.add_argument('file', type=pathlib.Path)
+    import_parser.add_argument('--format', choices=ws_transfer.FORMATS)
+    import_parser.add_argument('--chunk-size', type=int, default=ws_transfer.IMPORT_CHUNK_SIZE)
+    import_parser.set_defaults(run=import_)
+    args = parser.parse_args()
+    try:
+        args.run(args)
+    except (ValueError, OSError) as e:
+        parser.exit(1, f'error: {e}\n')
+
+
+if __name__ == '__main__':
+    main()
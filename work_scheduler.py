@@ -1,25 +1,43 @@
+import concurrent.futures
+import contextlib
 import enum
+import heapq
+import multiprocessing
+import os
 import random
+import time
 import typing
 from datetime import date, timedelta
 from dateutil.relativedelta import relativedelta
 
-from database import ws_holiday, ws_user, ws_order, ws_desire
-from ws_utils import daterange, daterange_reverse
+from database import ws_db, ws_holiday, ws_user, ws_order, ws_desire, ws_hours
+from ws_utils import daterange, daterange_reverse, to_epoch_days
+
+# маски дней месяца: бит d - день d (1..31), бит 32 - первый день следующего месяца
+# множества пользователей: бит i - UserMonthWork.index
+
+
+def _iter_bits(bits: int) -> typing.Iterator[int]:
+    while bits:
+        low = bits & -bits
+        yield low.bit_length() - 1
+        bits ^= low
 
 
 class UserMonthWork:
 
-    def __init__(self, row: ws_user.UserRow):
+    def __init__(self, row: ws_user.UserRow, index: int = 0):
         self.row = row
+        self.index = index  # позиция в DistributionAlg.user_map
+        self.bit = 1 << index
         self.required_hours = 0
         self.done_hours = 0
         self.plan_hours = 0
         self.rest_score = 0
         self.desire_map: dict[int, ws_desire.DesireRow] = {}
-        self.force_rest: dict[int, str] = {}
-        self.work8h: set[int] = set()
-        self.all_day: set[int] = set()
+        self.force_rest = 0  # маска дней
+        self.work8h = 0  # маска дней
+        self.all_day = 0  # маска дней
 
     def get_desire(self, day: date) -> ws_desire.Desire or None:
         row = self.desire_map.get(day.day)
@@ -34,162 +52,256 @@ class UserMonthWork:
     def left_hours(self):
         return self.required_hours - self.done_hours - self.plan_hours
 
+    @property
+    def all_day_count(self) -> int:
+        return self.all_day.bit_count()
+
+
+class MonthBits:
+    """
+    Транспонированное представление UserMonthWork: для каждого дня и каждого значения
+    счетчика храним множество пользователей (битовую маску).
+    Фильтры кандидатов становятся операциями над масками сразу по всем пользователям.
+    """
+
+    def __init__(self, users: list[UserMonthWork]):
+        self.users = users
+        self.all = (1 << len(users)) - 1
+        days = 33  # индексы 1..32
+        self.force_rest = [0] * days
+        self.all_day = [0] * days
+        self.work8h = [0] * days
+        self.desire = {desire: [0] * days for desire in ws_desire.Desire}
+        self.rest_score: dict[int, int] = {}  # rest_score -> пользователи
+        self.all_day_count: dict[int, int] = {}  # число дежурств -> пользователи
+        self.left_hours: dict[int, int] = {}  # left_hours -> пользователи
+        self.left = 0  # пользователи с left_hours > 0
+
+    def to_users(self, bits: int) -> list[UserMonthWork]:
+        return [self.users[i] for i in _iter_bits(bits)]
+
+    def busy(self, day: date) -> int:
+        return self.force_rest[day.day] | self.all_day[day.day] | self.work8h[day.day]
+
+    def add_force_rest(self, user: UserMonthWork, day: int):
+        user.force_rest |= 1 << day
+        self.force_rest[day] |= user.bit
+
+    def add_work8h(self, user: UserMonthWork, day: int):
+        user.work8h |= 1 << day
+        self.work8h[day] |= user.bit
+
+    def add_all_day(self, user: UserMonthWork, day: int):
+        old_count = user.all_day_count
+        user.all_day |= 1 << day
+        self.all_day[day] |= user.bit
+        if self.all_day_count:  # индекс уже построен
+            self._move(self.all_day_count, user, old_count, user.all_day_count)
+
+    def add_desire(self, user: UserMonthWork, day: int, desire: ws_desire.Desire):
+        self.desire[desire][day] |= user.bit
+
+    def build_index(self):
+        """Строит группы по счетчикам, вызывается после заполнения часов в prepare"""
+        self.rest_score = {}
+        self.all_day_count = {}
+        self.left_hours = {}
+        self.left = 0
+        for user in self.users:
+            self.rest_score[user.rest_score] = self.rest_score.get(user.rest_score, 0) | user.bit
+            self._move(self.all_day_count, user, None, user.all_day_count)
+            self._move(self.left_hours, user, None, user.left_hours)
+            if user.left_hours > 0:
+                self.left |= user.bit
+
+    def update_left_hours(self, user: UserMonthWork, old_left_hours: int):
+        if not self.left_hours:  # индекс еще не построен
+            return
+        self._move(self.left_hours, user, old_left_hours, user.left_hours)
+        if user.left_hours > 0:
+            self.left |= user.bit
+        else:
+            self.left &= ~user.bit
+
+    @staticmethod
+    def _move(groups: dict[int, int], user: UserMonthWork, old, new):
+        if old is not None:
+            bits = groups[old] & ~user.bit
+            if bits:
+                groups[old] = bits
+            else:
+                del groups[old]
+        groups[new] = groups.get(new, 0) | user.bit
+
 
 def get_hours_for_day(order: ws_order.Order, is_rest: bool):
+    # то же правило считает база в ws_hours
     if order is ws_order.Order.WORK:
-        return 8
+        return ws_hours.WORK_HOURS
     if order is ws_order.Order.ALL_DAY:
-        return 20 if is_rest else 12
+        return ws_hours.ALL_DAY_REST_HOURS if is_rest else ws_hours.ALL_DAY_HOURS
     return 0
 
 
 def get_work_hours(day: date) -> dict[int, int]:
-    is_rest = ws_holiday.is_rest_day(day)
-    out = {}
-    for row in ws_order.get_orders(day):
-        out.setdefault(row.user_id, 0)
-        out[row.user_id] += get_hours_for_day(row.order, is_rest)
-    return out
+    return ws_hours.get_hours_between(day, day + timedelta(days=1))
 
 
-class OrdersSnapshot:
+class MonthSnapshot:
+    """
+    Все данные месяца, нужные для распределения, одним чтением из базы.
+    После загрузки алгоритм работает только с памятью.
+    """
 
     def __init__(self, cur: date):
+        self.cur = cur
         self.start = cur.replace(day=1)
         self.end = self.start + relativedelta(months=1)
-        self.by_date: dict[int, list[ws_order.OrderRow]] = {}
-        for order in ws_order.get_orders_between(self.start, self.end):
-            self.by_date.setdefault(order.date.day, []).append(order)
+        with ws_db.transaction():  # один согласованный снимок
+            self.users: list[ws_user.UserRow] = ws_user.get_users()
+            orders = ws_order.get_orders_between(self.start, self.end)
+            self.desires: list[ws_desire.DesireRow] = ws_desire.get_desires_between(self.cur, self.end)
+            rest_days = ws_holiday.get_rest_days_between(self.start, self.end)
+            self.required_hours = ws_holiday.calc_hours_for_month(self.start)
+            # часы с начала месяца до cur и перенос бонусов/штрафов из прошлых месяцев считает база
+            self.done_hours: dict[int, int] = ws_hours.get_hours_between(self.start, self.cur)
+            self.carry_hours: dict[int, int] = ws_hours.get_carry_hours(self.start)
+            # кто дежурил в день перед началом распределения
+            self.last_all_day_user_id = ws_order.get_all_day_order_user_id(self.cur - timedelta(days=1))
+        start_epoch_day = to_epoch_days(self.start)
+        self.rest_days: set[int] = {epoch_day - start_epoch_day + 1 for epoch_day in rest_days}  # дни месяца
+        self.orders_by_day: dict[int, list[ws_order.OrderRow]] = {}
+        for order in orders:
+            self.orders_by_day.setdefault(order.date.day, []).append(order)
 
         def order_sort_key(row: ws_order.OrderRow):
             return (int(row.order), row.user_id)
-        for orders in self.by_date.values():
-            orders.sort(key=order_sort_key)
-
-
-def _collect_max_left_hours_users(users: typing.Iterable[UserMonthWork]) -> list[UserMonthWork]:
-    max_left_hours = 0
-    out = []
-    for user in users:
-        if user.left_hours < max_left_hours:
-            continue
-        if user.left_hours > max_left_hours:
-            max_left_hours = user.left_hours
-            out = []
-        out.append(user)
-    return out
-
-
-def _collect_min_all_day_users(users: typing.Iterable[UserMonthWork]) -> list[UserMonthWork]:
-    min_all_day_count = 31 + 1
-    out = []
-    for user in users:
-        all_day_count = len(user.all_day)
-        if all_day_count > min_all_day_count:
-            continue
-        if all_day_count < min_all_day_count:
-            min_all_day_count = all_day_count
-            out = []
-        out.append(user)
-    return out
-
-
-def _collect_max_rest_score_users(users: typing.Iterable[UserMonthWork], day: date) -> list[UserMonthWork]:
-    max_rest_score = 0
-    out = []
-    for user in users:
-        if user.rest_score < max_rest_score:
-            continue
-        if user.rest_score > max_rest_score:
-            max_rest_score = user.rest_score
-            out = []
-        if user.get_desire(day) is ws_desire.Desire.REST:
-            continue
-        out.append(user)
-    return out
-
-
-def _collect_users_with_left_hours(users: typing.Iterable[UserMonthWork]) -> list[UserMonthWork]:
-    out = []
-    for user in users:
-        if user.left_hours <= 0:  # уже отработал все часы на этот месяц
-            continue
-        out.append(user)
-    return out
-
-
-def _collect_all_day_candidates(users: typing.Iterable[UserMonthWork], day: date) -> list[UserMonthWork]:
-    out = []
-    for user in users:
-        if day.day in user.force_rest:  # должен отдыхать в этот день
-            continue
-        if day.day in user.all_day:  # уже записан на этот день
-            continue
-        if day.day in user.work8h:  # уже записан на этот день
-            continue
-        # if user.left_hours <= 0:  # уже отработал все часы на этот месяц
-        #     continue
-        # закоментировано: так как следующие операции сортируют по отработаным часам,
-        #   переработки допустимы ради закрытия дежурств
-        out.append(user)
-    return out
-
-
-def _collect_work8h_candidates(users: typing.Iterable[UserMonthWork], day: date) -> list[UserMonthWork]:
-    out = []
-    for user in users:
-        if day.day in user.force_rest:  # должен отдыхать в этот день
-            continue
-        if day.day in user.work8h:  # уже записан на этот день
-            continue
-        if day.day in user.all_day:  # уже записан на этот день
-            continue
-        if user.left_hours <= 0:  # уже отработал все часы на этот месяц
-            continue
-        out.append(user)
-    return out
-
-
-def _collect_who_desire_all_day(users: typing.Iterable[UserMonthWork], day: date) -> list[UserMonthWork]:
-    out = []
-    for user in users:
-        if day.day in user.force_rest:  # не берем пользователей, которым нужно отдыхать
-            continue
-        if user.get_desire(day) is ws_desire.Desire.ALL_DAY:
-            out.append(user)
-            break
-    return out
+        for day_orders in self.orders_by_day.values():
+            day_orders.sort(key=order_sort_key)
 
 
-def _collect_who_desire_work8h(users: typing.Iterable[UserMonthWork], day: date) -> list[UserMonthWork]:
-    out = []
-    for user in users:
-        if day.day in user.force_rest:  # не берем пользователей, которым нужно отдыхать
-            continue
-        if user.get_desire(day) is ws_desire.Desire.WORK:
-            out.append(user)
+def _collect_max_left_hours_users(bits: MonthBits, users: int) -> int:
+    # переработавшие (left_hours < 0) не выбираются
+    for left_hours in sorted(bits.left_hours, reverse=True):
+        if left_hours < 0:
             break
-    return out
+        out = users & bits.left_hours[left_hours]
+        if out:
+            return out
+    return 0
+
+
+def _collect_min_all_day_users(bits: MonthBits, users: int) -> int:
+    for count in sorted(bits.all_day_count):
+        out = users & bits.all_day_count[count]
+        if out:
+            return out
+    return 0
+
+
+def _collect_max_rest_score_users(bits: MonthBits, users: int, day: date) -> int:
+    # максимальный показатель отдыха ищется среди всех, но желающие отдыхать в этот день не выбираются
+    for rest_score in sorted(bits.rest_score, reverse=True):
+        with_score = users & bits.rest_score[rest_score]
+        if with_score:
+            return with_score & ~bits.desire[ws_desire.Desire.REST][day.day]
+    return 0
+
+
+def _collect_users_with_left_hours(bits: MonthBits, users: int) -> int:
+    return users & bits.left  # у остальных уже отработаны все часы на этот месяц
+
+
+def _collect_all_day_candidates(bits: MonthBits, users: int, day: date) -> int:
+    # не берем тех, кто должен отдыхать или уже записан на этот день
+    # переработки допустимы ради закрытия дежурств, поэтому left_hours не проверяем
+    return users & ~bits.busy(day)
+
+
+def _collect_work8h_candidates(bits: MonthBits, users: int, day: date) -> int:
+    # не берем тех, кто должен отдыхать, уже записан на этот день или уже отработал все часы
+    return users & ~bits.busy(day) & bits.left
+
+
+def _collect_who_desire_all_day(bits: MonthBits, users: int, day: date) -> int:
+    # первый желающий, не считая тех, кому нужно отдыхать
+    out = users & ~bits.force_rest[day.day] & bits.desire[ws_desire.Desire.ALL_DAY][day.day]
+    return out & -out
+
+
+def _collect_who_desire_work8h(bits: MonthBits, users: int, day: date) -> int:
+    # первый желающий, не считая тех, кому нужно отдыхать
+    out = users & ~bits.force_rest[day.day] & bits.desire[ws_desire.Desire.WORK][day.day]
+    return out & -out
+
+
+class AlgProfile:
+    """Замеры DistributionAlg: время фаз, размеры множества кандидатов после каждого фильтра, счетчики"""
+
+    def __init__(self):
+        self.phases: dict[str, float] = {}  # мс
+        self.stages: dict[str, list[int]] = {}  # фильтр -> [вызовов, сумма, min, max]
+        self.counters: dict[str, int] = {}
+
+    @contextlib.contextmanager
+    def phase(self, name: str):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[name] = self.phases.get(name, 0) + (time.perf_counter() - t0) * 1000
+
+    def stage(self, name: str, users: int):
+        size = users.bit_count()
+        stat = self.stages.get(name)
+        if stat is None:
+            self.stages[name] = [1, size, size, size]
+            return
+        stat[0] += 1
+        stat[1] += size
+        stat[2] = min(stat[2], size)
+        stat[3] = max(stat[3], size)
+
+    def count(self, name: str, value: int = 1):
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def to_json(self) -> dict:
+        return {
+            'phases_ms': {k: round(v, 3) for k, v in self.phases.items()},
+            'stages': {
+                name: {'calls': calls, 'avg': round(total / calls, 2), 'min': lo, 'max': hi}
+                for name, (calls, total, lo, hi) in self.stages.items()
+            },
+            'counters': dict(self.counters),
+        }
 
 
 class DistributionAlg:
 
-    def __init__(self, cur: date):
+    def __init__(self, cur: date, snapshot: MonthSnapshot = None, rng: random.Random = None, profile=False):
         """
         Это инструмент для дозаполнения недозаполненных дней и недоработанных рабочих часов.
         Если у пользователя план перевыполнен, убирайте у него дни вручную
         (возможно можно как то реализовать перевыполнение через
          автоматическое убирание рабочих дней с конца месяца
          или через бонусы на след месяц если убирать нечего)
+        rng - генератор случайных чисел, с фиксированным seed результат воспроизводим
+        profile - собирать AlgProfile в self.profile
         """
+        self.rng = rng if rng is not None else random
+        self.profile = AlgProfile() if profile else None
+        self.snapshot = snapshot if snapshot is not None else MonthSnapshot(cur)
         self.cur = cur
-        self.start = self.cur.replace(day=1)
-        self.end = self.start + relativedelta(months=1)
-        self.user_map = {row.id: UserMonthWork(row) for row in ws_user.get_users()}
-        self.old_orders_snapshot = OrdersSnapshot(cur)
-        self.rest_days = ws_holiday.get_rest_days_between(self.start, self.end)
+        self.start = self.snapshot.start
+        self.end = self.snapshot.end
+        self.user_map = {row.id: UserMonthWork(row, i) for i, row in enumerate(self.snapshot.users)}
+        self.bits = MonthBits(list(self.user_map.values()))
+        self.rest_days = self.snapshot.rest_days  # дни месяца
         self.days = list(daterange(self.cur, self.end))
-        random.shuffle(self.days)  # перемешиваем порядок дней для увеличения равномерности распределения
+        self.rng.shuffle(self.days)  # перемешиваем порядок дней для увеличения равномерности распределения
+        # очередь дней по загрузке: (число work8h, позиция в self.days, день), строится в _run_work8h
+        self._day_queue: list[tuple[int, int, date]] or None = None
+        self._day_pos: dict[int, int] = {day.day: pos for pos, day in enumerate(self.days)}
 
         # результат выполнения: изменения для БД
         # нельзя применять изменения к БД в процессе рассчетов,
@@ -199,40 +311,64 @@ class DistributionAlg:
         self.make_work8h: dict[int, list[tuple[UserMonthWork, list[str]]]] = {}
 
     def prepare(self):
+        with self._phase('prepare'):
+            self._prepare()
+
+    def _prepare(self):
         # * * *  Подготовка * * *
         # вычисляем сколько каждый должен отработать за текущий месяц
-        required_hours = ws_holiday.calc_hours_for_month(self.start)
+        required_hours = self.snapshot.required_hours
         for user in self.user_map.values():  # type: UserMonthWork
-            user.required_hours = required_hours
-            # учитываем штрафы/бонусы из предыдущего месяца
-            # todo: штрафные/бонусные часы
-        # собираем отработанные часы с начала месяца до текущего дня
+            # учитываем штрафы/бонусы из прошлых месяцев: переработка уменьшает норму, недоработка увеличивает
+            user.required_hours = required_hours - self.snapshot.carry_hours.get(user.row.id, 0)
+            # отработанные часы с начала месяца до текущего дня
+            user.done_hours = self.snapshot.done_hours.get(user.row.id, 0)
+        # собираем заказы с начала месяца до текущего дня
         for day in daterange(self.start, self.cur):
-            is_rest = day.day in self.rest_days
-            for row in ws_order.get_orders(day):
+            for row in self.snapshot.orders_by_day.get(day.day, []):
                 user = self.user_map[row.user_id]
-                user.done_hours += get_hours_for_day(row.order, is_rest)
                 if row.order is ws_order.Order.ALL_DAY:
-                    user.all_day.add(day.day)
+                    self.bits.add_all_day(user, day.day)
                 if row.order is ws_order.Order.WORK:
-                    user.work8h.add(day.day)
+                    self.bits.add_work8h(user, day.day)
         # достаем модификаторы выбора пользователя
         #   учитываем пожелания
-        for row in ws_desire.get_desires_between(self.cur, self.end):
+        for row in self.snapshot.desires:
             user = self.user_map[row.user_id]
             assert row.date.day not in user.desire_map
             user.desire_map[row.date.day] = row
+            self.bits.add_desire(user, row.date.day, row.desire)
         #     пожелание отдыха в один день почти гарантирует выбор в другой день
             if row.desire is ws_desire.Desire.REST:
                 user.rest_score += 1
         #   учитываем особые условия для отдыха
         #     если юзер работал all_day в день до начала распределения
-        ad_user_id = ws_order.get_all_day_order_user_id(self.cur - timedelta(days=1))
+        ad_user_id = self.snapshot.last_all_day_user_id
         if ad_user_id is not None:
-            self.user_map[ad_user_id].force_rest[self.cur.day] = 'last_month_all_day'
+            self.bits.add_force_rest(self.user_map[ad_user_id], self.cur.day)  # last_month_all_day
+        self.bits.build_index()
 
     def run(self):
         # * * *  Алгоритм * * *
+        with self._phase('preserve_old_orders'):
+            ignore_days = self._preserve_old_orders()
+        # распределяем all_day
+        with self._phase('run_all_day'):
+            self._run_all_day(ignore_days)
+        # распределяем work8h
+        with self._phase('run_work8h'):
+            self._run_work8h()
+
+    def _phase(self, name: str):
+        if self.profile is None:
+            return contextlib.nullcontext()
+        return self.profile.phase(name)
+
+    def _stage(self, name: str, users: int):
+        if self.profile is not None:
+            self.profile.stage(name, users)
+
+    def _preserve_old_orders(self) -> list[int]:
         # сохраняем старое значение для всех кто устанавливался ранее на all_day
         ignore_days = []
         for day in daterange(self.cur, self.end):
@@ -245,34 +381,37 @@ class DistributionAlg:
             user_ids = self._get_old_users_work8h(day)
             for user_id in user_ids:
                 self._on_user_set_work8h(day, self.user_map[user_id])
-        # распределяем all_day
-        self._run_all_day(ignore_days)
-        # распределяем work8h
-        self._run_work8h()
+        return ignore_days
 
     def _run_all_day(self, ignore_days: list):
+        bits = self.bits
         missing_days: list[date] = []
         for day in self.days:
             if day.day in ignore_days:
                 continue
             # выбираем тех, кого можно добавить на этот день
-            candidates: list[UserMonthWork] = _collect_all_day_candidates(self.user_map.values(), day)
+            candidates = _collect_all_day_candidates(bits, bits.all, day)
+            self._stage('all_day.candidates', candidates)
             # стараемся учесть пожелания
-            who_desire = _collect_who_desire_all_day(candidates, day)
+            who_desire = _collect_who_desire_all_day(bits, candidates, day)
+            self._stage('all_day.who_desire', who_desire)
             if who_desire:  # если есть желающие на этот день
-                reason = [f'by_desire:{len(who_desire)}/{len(candidates)}']
+                reason = [f'by_desire:{who_desire.bit_count()}/{candidates.bit_count()}']
                 candidates = who_desire
-                max_rest_score = _collect_max_rest_score_users(candidates, day)
+                max_rest_score = _collect_max_rest_score_users(bits, candidates, day)
+                self._stage('all_day.desire.max_rest_score', max_rest_score)
                 if max_rest_score:
-                    if len(max_rest_score) != len(candidates):
-                        reason.append(f'by_rest_score:{len(max_rest_score)}/{len(candidates)}')
+                    if max_rest_score != candidates:
+                        reason.append(f'by_rest_score:{max_rest_score.bit_count()}/{candidates.bit_count()}')
                     candidates = max_rest_score
                 # выбраем тех, у кого меньше всего дежурства за этот месяц
-                candidates = _collect_min_all_day_users(candidates)
+                candidates = _collect_min_all_day_users(bits, candidates)
+                self._stage('all_day.desire.min_all_day', candidates)
                 # затем выбраем тех, у кого осталось больше всего неотработанных часов
-                candidates = _collect_max_left_hours_users(candidates)
+                candidates = _collect_max_left_hours_users(bits, candidates)
+                self._stage('all_day.desire.max_left_hours', candidates)
                 # только затем рандом
-                user: UserMonthWork = random.choice(candidates)
+                user: UserMonthWork = self.rng.choice(bits.to_users(candidates))
                 self.make_all_day[day.day] = (user, reason)
                 self._on_user_set_all_day(day, user)
                 continue
@@ -281,107 +420,278 @@ class DistributionAlg:
 
         # заполняем оставшиеся пустые позиции
         for day in missing_days:
-            candidates = _collect_all_day_candidates(self.user_map.values(), day)
+            candidates = _collect_all_day_candidates(bits, bits.all, day)
+            self._stage('all_day.missing.candidates', candidates)
             if not candidates:
                 self.error_all_day[day.day] = 'no user to select'
                 continue
             reason = []  # модификаторы, повлиявшие на выбор
             # выбраем тех, у кого меньше всего дежурства за этот месяц
-            candidates = _collect_min_all_day_users(candidates)
+            candidates = _collect_min_all_day_users(bits, candidates)
+            self._stage('all_day.missing.min_all_day', candidates)
             # затем выбраем тех, у кого больше всего показатель отдыха
-            max_rest_score = _collect_max_rest_score_users(candidates, day)
+            max_rest_score = _collect_max_rest_score_users(bits, candidates, day)
+            self._stage('all_day.missing.max_rest_score', max_rest_score)
             if max_rest_score:
-                if len(max_rest_score) != len(candidates):
-                    reason.append(f'by_rest_score:{len(max_rest_score)}/{len(candidates)}')
+                if max_rest_score != candidates:
+                    reason.append(f'by_rest_score:{max_rest_score.bit_count()}/{candidates.bit_count()}')
                 candidates = max_rest_score
             # затем выбраем тех, у кого осталось больше всего неотработанных часов
-            candidates = _collect_max_left_hours_users(candidates)
+            candidates = _collect_max_left_hours_users(bits, candidates)
+            self._stage('all_day.missing.max_left_hours', candidates)
             # только затем рандом
-            user: UserMonthWork = random.choice(candidates)
+            user: UserMonthWork = self.rng.choice(bits.to_users(candidates))
             self.make_all_day[day.day] = (user, reason)
             self._on_user_set_all_day(day, user)
 
     def _run_work8h(self):
         # выполняем балансировку нагрузки по дням
+        bits = self.bits
         ignore_days = set()
+        self._day_queue = [(bits.work8h[day.day].bit_count(), pos, day) for pos, day in enumerate(self.days)]
+        heapq.heapify(self._day_queue)
         while True:
             # пока есть юзеры с непогашенными рабочими часами
-            left_users = _collect_users_with_left_hours(self.user_map.values())
+            left_users = _collect_users_with_left_hours(bits, bits.all)
             if not left_users:
                 break
+            if self.profile is not None:
+                self.profile.count('work8h.iterations')
+            self._stage('work8h.left_users', left_users)
             # ищем менее нагруженный день по количеству сотрудников
             day = self._find_less_overload_day(ignore_days)
             if day is None:
                 # случай, когда есть пользователи с неотработанными часами,
                 # но не осталось дней куда можно было бы их вписать
-                self.notify = f'has users but has no days {left_users}'
+                self.notify = f'has users but has no days {bits.to_users(left_users)}'
                 break
             # выбираем тех, кого можно добавить на этот день
-            candidates = _collect_work8h_candidates(left_users, day)  # те кто могут работать в этот день
+            candidates = _collect_work8h_candidates(bits, left_users, day)  # те кто могут работать в этот день
+            self._stage('work8h.candidates', candidates)
             if not candidates:
                 # в этот день никто не может. игнорируем его
                 ignore_days.add(day.day)
+                if self.profile is not None:
+                    self.profile.count('work8h.ignored_days')
                 # print(f'ignore {day}')
                 continue
             # стараемся учесть пожелания
-            who_desire = _collect_who_desire_work8h(candidates, day)
+            who_desire = _collect_who_desire_work8h(bits, candidates, day)
+            self._stage('work8h.who_desire', who_desire)
             reason = []  # модификаторы, повлиявшие на выбор
             if who_desire:  # если есть желающие, то выбираем среди них
-                if len(who_desire) != len(candidates):
-                    reason.append(f'by_desire:{len(who_desire)}/{len(candidates)}')
+                if who_desire != candidates:
+                    reason.append(f'by_desire:{who_desire.bit_count()}/{candidates.bit_count()}')
                 candidates = who_desire
             # затем выбраем тех, у кого больше всего показатель отдыха
-            max_rest_score = _collect_max_rest_score_users(candidates, day)
+            max_rest_score = _collect_max_rest_score_users(bits, candidates, day)
+            self._stage('work8h.max_rest_score', max_rest_score)
             if max_rest_score:
-                if len(max_rest_score) != len(candidates):
-                    reason.append(f'by_rest_score:{len(max_rest_score)}/{len(candidates)}')
+                if max_rest_score != candidates:
+                    reason.append(f'by_rest_score:{max_rest_score.bit_count()}/{candidates.bit_count()}')
                 candidates = max_rest_score
             # затем выбраем тех, у кого осталось больше всего неотработанных часов
-            candidates = _collect_min_all_day_users(candidates)
+            candidates = _collect_min_all_day_users(bits, candidates)
+            self._stage('work8h.min_all_day', candidates)
             # только затем рандом
-            user: UserMonthWork = random.choice(candidates)
+            user: UserMonthWork = self.rng.choice(bits.to_users(candidates))
             self.make_work8h.setdefault(day.day, []).append((user, reason))
             self._on_user_set_work8h(day, user)
 
+    def get_order_rows(self) -> list[tuple[date, int, ws_order.Order, str]]:
+        """Результат распределения в виде строк для ws_order.set_orders_bulk"""
+        rows = []
+        for day in daterange(self.cur, self.end):
+            all_day = self.make_all_day.get(day.day)
+            if all_day is not None:  # нет, если дежурство было назначено до автозаполнения
+                user, reasons = all_day
+                rows.append((day, user.row.id, ws_order.Order.ALL_DAY, str(reasons)))
+            for user, reasons in self.make_work8h.get(day.day, []):
+                rows.append((day, user.row.id, ws_order.Order.WORK, str(reasons)))
+        return rows
+
+    def score(self) -> 'ScheduleScore':
+        out = ScheduleScore()
+        users = list(self.user_map.values())
+        out.errors = len(self.error_all_day)
+        if users:
+            left_hours = [user.left_hours for user in users]
+            out.left_hours_spread = max(left_hours) - min(left_hours)
+            all_day_counts = [user.all_day_count for user in users]
+            out.all_day_spread = max(all_day_counts) - min(all_day_counts)
+        for user in users:
+            for day, row in user.desire_map.items():
+                out.desires += 1
+                day_bit = 1 << day
+                if row.desire is ws_desire.Desire.REST:
+                    honoured = not (user.work8h | user.all_day) & day_bit
+                elif row.desire is ws_desire.Desire.WORK:
+                    honoured = user.work8h & day_bit
+                else:
+                    honoured = user.all_day & day_bit
+                if honoured:
+                    out.desires_honoured += 1
+        return out
+
     def _get_old_user_all_day(self, day):
-        for order_row in self.old_orders_snapshot.by_date.get(day, []):
+        for order_row in self.snapshot.orders_by_day.get(day.day, []):
             if order_row.order is ws_order.Order.ALL_DAY:
                 return order_row.user_id
         return None
 
     def _get_old_users_work8h(self, day) -> list[int]:
         out = []
-        for order_row in self.old_orders_snapshot.by_date.get(day, []):
+        for order_row in self.snapshot.orders_by_day.get(day.day, []):
             if order_row.order is ws_order.Order.WORK:
                 out.append(order_row.user_id)
         return out
 
     def _on_user_set_all_day(self, day: date, user: UserMonthWork):
         # запоминаем что след день это отдых
-        user.force_rest[day.day + 1] = 'after all_day'
+        self.bits.add_force_rest(user, day.day + 1)  # after all_day
         # обновляем рабочие часы
+        old_left_hours = user.left_hours
         user.plan_hours += get_hours_for_day(ws_order.Order.ALL_DAY, day.day in self.rest_days)
-        user.all_day.add(day.day)
+        self.bits.update_left_hours(user, old_left_hours)
+        self.bits.add_all_day(user, day.day)
 
     def _on_user_set_work8h(self, day: date, user: UserMonthWork):
         # обновляем рабочие часы
+        old_left_hours = user.left_hours
         user.plan_hours += get_hours_for_day(ws_order.Order.WORK, day.day in self.rest_days)
-        user.work8h.add(day.day)
+        self.bits.update_left_hours(user, old_left_hours)
+        self.bits.add_work8h(user, day.day)
+        if self._day_queue is not None and day.day in self._day_pos:
+            # старая запись дня в очереди станет неактуальной и будет пропущена
+            count = self.bits.work8h[day.day].bit_count()
+            heapq.heappush(self._day_queue, (count, self._day_pos[day.day], day))
 
     def _find_less_overload_day(self, ignore_days: set[int]):
-        out = None
-        min_work8h_count = 10_000_000
-        for day in self.days:
-            if day.day in ignore_days:
+        # день с минимальным числом work8h, при равенстве - раньше в self.days
+        while self._day_queue:
+            count, pos, day = self._day_queue[0]
+            if day.day in ignore_days or count != self.bits.work8h[day.day].bit_count():
+                heapq.heappop(self._day_queue)
                 continue
-            work8h_count = 0
-            for user in self.user_map.values():
-                if day.day in user.work8h:
-                    work8h_count += 1
-            if work8h_count < min_work8h_count:
-                min_work8h_count = work8h_count
-                out = day
-        return out
+            return day
+        return None
+
+
+class ScheduleScore:
+    """Оценка справедливости распределения, меньше - лучше"""
+
+    ERROR_WEIGHT = 1000  # незакрытое дежурство хуже любого перекоса
+    LEFT_HOURS_WEIGHT = 1
+    ALL_DAY_WEIGHT = 8
+    DESIRE_WEIGHT = 4
+
+    def __init__(self):
+        self.errors = 0  # дни без дежурного
+        self.left_hours_spread = 0  # разброс недоработанных часов
+        self.all_day_spread = 0  # разброс числа дежурств
+        self.desires = 0
+        self.desires_honoured = 0
+
+    @property
+    def total(self) -> float:
+        return (self.errors * self.ERROR_WEIGHT
+                + self.left_hours_spread * self.LEFT_HOURS_WEIGHT
+                + self.all_day_spread * self.ALL_DAY_WEIGHT
+                + (self.desires - self.desires_honoured) * self.DESIRE_WEIGHT)
+
+    def to_json(self) -> dict:
+        return {
+            'total': self.total,
+            'errors': self.errors,
+            'left_hours_spread': self.left_hours_spread,
+            'all_day_spread': self.all_day_spread,
+            'desires': self.desires,
+            'desires_honoured': self.desires_honoured,
+        }
+
+
+class AutofillResult:
+
+    def __init__(self, seed: int, alg: DistributionAlg):
+        self.seed = seed
+        self.profile = alg.profile.to_json() if alg.profile is not None else None
+        self.score = alg.score()
+        self.rows = alg.get_order_rows()
+        self.error_all_day = {alg.start.replace(day=day): err for day, err in alg.error_all_day.items()}
+
+
+def run_seed(cur: date, seed: int, snapshot: MonthSnapshot = None, profile=False) -> AutofillResult:
+    alg = DistributionAlg(cur, snapshot, rng=random.Random(seed), profile=profile)
+    alg.prepare()
+    alg.run()
+    return AutofillResult(seed, alg)
+
+
+# процессы пула не форкаются от сервера: в многопоточном процессе fork копирует блокировки (пул соединений,
+# трассировка запросов), захваченные другими потоками, и дочерний процесс может на них зависнуть
+_START_METHOD = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+FIRST_RESULT_TIMEOUT_SEC = 5 * 60
+
+_worker_snapshot: MonthSnapshot or None = None
+
+
+def _init_worker(snapshot: MonthSnapshot):
+    global _worker_snapshot
+    _worker_snapshot = snapshot
+
+
+def _run_seed_in_worker(cur: date, seed: int, profile: bool) -> AutofillResult:
+    return run_seed(cur, seed, _worker_snapshot, profile)
+
+
+def _terminate_pool(executor: concurrent.futures.ProcessPoolExecutor):
+    # shutdown(cancel_futures=True) не прерывает уже начатые запуски, процессы досчитывали бы их впустую.
+    # Публичный terminate_workers() есть только с Python 3.14
+    if hasattr(executor, 'terminate_workers'):
+        executor.terminate_workers()
+        return
+    processes = list((executor._processes or {}).values())
+    executor.shutdown(wait=False, cancel_futures=True)
+    for process in processes:
+        process.terminate()
+    for process in processes:
+        process.join()
+
+
+def run_best_of(cur: date, runs: int, time_budget: float, workers: int = None, profile=False,
+                on_progress=None) -> AutofillResult:
+    """
+    Запускает runs распределений с разными seed в пуле процессов и возвращает лучшее по ScheduleScore.
+    По истечении time_budget секунд незавершенные запуски прерываются вместе с процессами пула.
+    on_progress(завершено, всего) вызывается после каждого завершенного запуска.
+    """
+    if runs < 1 or not time_budget > 0:
+        raise ValueError(f'invalid runs {runs} or time_budget {time_budget}')
+    snapshot = MonthSnapshot(cur)  # база читается один раз, процессы получают копию
+    seeds = [random.randrange(2 ** 32) for _ in range(runs)]
+    workers = min(workers or os.cpu_count() or 1, runs)
+    deadline = time.monotonic() + time_budget
+    results: list[AutofillResult] = []
+    executor = concurrent.futures.ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context(_START_METHOD),
+                                                      initializer=_init_worker, initargs=(snapshot,))
+    try:
+        futures = [executor.submit(_run_seed_in_worker, cur, seed, profile) for seed in seeds]
+        try:
+            for future in concurrent.futures.as_completed(futures, timeout=max(deadline - time.monotonic(), 0)):
+                results.append(future.result())
+                if on_progress is not None:
+                    on_progress(len(results), runs)
+        except concurrent.futures.TimeoutError:
+            pass
+        if not results:  # бюджет кончился раньше первого результата, ждем хотя бы один
+            done, _ = concurrent.futures.wait(futures, FIRST_RESULT_TIMEOUT_SEC,
+                                              return_when=concurrent.futures.FIRST_COMPLETED)
+            if not done:
+                raise TimeoutError(f'no autofill run finished in {time_budget + FIRST_RESULT_TIMEOUT_SEC}s')
+            results.extend(future.result() for future in done)
+    finally:
+        _terminate_pool(executor)
+    return min(results, key=lambda r: (r.score.total, r.seed))
 
 
 def auto_alg():
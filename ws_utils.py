@@ -2,8 +2,15 @@ from datetime import datetime, date, timedelta
 from dateutil.relativedelta import relativedelta
 
 
+EPOCH = date(1970, 1, 1)
+
+
 def to_epoch_days(day: date):
-    return (day - date(1970, 1, 1)).days
+    return (day - EPOCH).days
+
+
+def from_epoch_days(days: int) -> date:
+    return EPOCH + timedelta(days=days)
 
 
 def parse_date(text: str) -> date: